@@ -1,38 +1,176 @@
+import numpy as np
+import pandas as pd
+from analysis_columns import ANALYSIS_COLUMNS, ANALYSIS_SOURCES, normalize_claim_amount, rows_to_columns  # noqa: F401
 from logger import logger
 
-# Normalizes claim amount irrespective of its format (string, float, etc.)
-def normalize_claim_amount(amount):
-    if isinstance(amount, str):
-        amount = amount.replace('$', '').replace(',', '')
-        return float(amount)
-    return amount
+# Characters removed from string amounts before parsing
+AMOUNT_STRIP_TABLE = str.maketrans("", "", "$, \t\r")
 
-# Analyzes a specific set of claims data (textfile or gptmsg)
-def analyze_specific_claims_data(claims_data):
-    category_counts = {}
-    category_totals = {}
-
-    for data in claims_data:
+# Vectorised version of normalize_claim_amount, anything that doesn't parse becomes NaN
+def parse_amounts(amounts):
+    values = pd.Series(amounts, dtype=object).to_numpy()
+    try:
+        # Fast path, every amount is already a number (or missing)
+        return pd.Series(values, dtype=object).astype(float)
+    except (TypeError, ValueError):
+        pass
+    is_string = np.fromiter((type(value) is str for value in values), dtype=bool, count=len(values))
+    numbers = pd.Series(np.where(is_string, None, values), dtype=object)
+    try:
+        parsed = numbers.astype(float).to_numpy(copy=True)
+    except (TypeError, ValueError):
+        # Odd LLM output (lists, dicts...) lands here, the slower coercing path turns it into NaN
+        parsed = pd.to_numeric(numbers, errors="coerce").to_numpy(dtype=float, copy=True)
+    if is_string.any():
+        # Only the string amounts go through the "$1,200.00" cleanup, done as one translate over all of them
+        strings = "\n".join(values[is_string]).translate(AMOUNT_STRIP_TABLE).split("\n")
+        if len(strings) != is_string.sum():
+            # A value had its own newline, clean them one by one instead
+            strings = [value.translate(AMOUNT_STRIP_TABLE) for value in values[is_string]]
         try:
-            category = data.get('Claims Category')
-            amount = data.get('Claim Amount')
+            parsed[is_string] = np.array(strings).astype(float)
+        except ValueError:
+            parsed[is_string] = pd.to_numeric(pd.Series(strings, dtype=object), errors="coerce").to_numpy(dtype=float)
+        failed = int(np.isnan(parsed[is_string]).sum())
+        if failed:
+            logger.error(f"Error processing data: {failed} claim amounts could not be parsed")
+    return pd.Series(parsed)
+
+# Pulls the category/amount fields for each source out of claim documents into one list per column
+def claims_to_columns(claims):
+    analyses = [claim.get('analysis') or {} for claim in claims]
+    columns = {"id": [claim.get("id") for claim in claims]}
+    for prefix, source in ANALYSIS_SOURCES.items():
+        data = [analysis.get(source) or {} for analysis in analyses]
+        columns[f"{prefix}_category"] = [item.get('Claims Category') for item in data]
+        columns[f"{prefix}_amount"] = [item.get('Claim Amount') for item in data]
+    return columns
+
+# Lists and dicts from the LLM can't be a category, the dict loop skipped those rows
+def _hashable_category(value):
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+# Categories as a pandas Categorical, empty strings count as missing like in the dict loop
+def parse_categories(categories):
+    values = pd.Series(categories, dtype=object)
+    try:
+        parsed = pd.Categorical(values)
+    except TypeError:
+        values = values.map(_hashable_category)
+        parsed = pd.Categorical(values)
+    if not all(isinstance(category, str) for category in parsed.categories):
+        # Rare, the LLM returned a non-string category, compare everything as text
+        parsed = pd.Categorical(values.where(values.isna(), values.astype(str)))
+    if "" in parsed.categories:
+        parsed = parsed.remove_categories([""])
+    return pd.Series(parsed)
+
+# Columnar frame with parsed amounts and categorical category columns
+def build_claims_frame(columns):
+    length = max((len(values) for values in columns.values()), default=0)
+    frame = pd.DataFrame({"id": pd.Series(columns.get("id", [None] * length), dtype=object)})
+    for prefix in ANALYSIS_SOURCES:
+        frame[f"{prefix}_category"] = parse_categories(columns.get(f"{prefix}_category", [None] * length))
+        frame[f"{prefix}_amount"] = parse_amounts(columns.get(f"{prefix}_amount", [None] * length))
+    return frame
+
+def _none_if_nan(value):
+    return None if value is None or pd.isna(value) else float(value)
+
+# Counts, totals, spread and outlier rate per category for one source ("textfile" or "gptmsg")
+def category_statistics(frame: pd.DataFrame, prefix: str):
+    category = frame[f"{prefix}_category"]
+    amount = frame[f"{prefix}_amount"]
+    valid = category.notna() & amount.notna()
+    if not valid.any():
+        return {}
+    amounts = amount[valid]
+    keys = category[valid].cat.remove_unused_categories()
+    groups = amounts.groupby(keys, observed=True)
 
-            if category and amount is not None:
-                normalized_amount = normalize_claim_amount(amount)
-                category_counts[category] = category_counts.get(category, 0) + 1
-                category_totals[category] = category_totals.get(category, 0) + normalized_amount
-        except Exception as e:
-            logger.error(f"Error processing data: {e}")
+    stats = groups.agg(["count", "sum", "mean", "median", "min", "max"])
+    quantiles = groups.quantile([0.25, 0.75, 0.9, 0.99]).unstack()
 
-    category_averages = {cat: category_totals[cat] / category_counts[cat] for cat in category_counts if category_counts[cat] > 0}
+    # Tukey fences per category, an amount outside 1.5 IQR of its own category counts as an outlier
+    iqr = quantiles[0.75] - quantiles[0.25]
+    lower = keys.map(quantiles[0.25] - 1.5 * iqr).astype(float)
+    upper = keys.map(quantiles[0.75] + 1.5 * iqr).astype(float)
+    outlier_rate = ((amounts < lower) | (amounts > upper)).groupby(keys, observed=True).mean()
+
+    return {
+        cat: {
+            "count": int(stats.at[cat, "count"]),
+            "sum": float(stats.at[cat, "sum"]),
+            "mean": float(stats.at[cat, "mean"]),
+            "median": float(stats.at[cat, "median"]),
+            "p90": float(quantiles.at[cat, 0.9]),
+            "p99": float(quantiles.at[cat, 0.99]),
+            "min": float(stats.at[cat, "min"]),
+            "max": float(stats.at[cat, "max"]),
+            "outlier_rate": float(outlier_rate.at[cat]),
+        }
+        for cat in stats.index
+    }
+
+# How often the textfile and gptmsg analyses of the same claim agree
+def source_agreement(frame: pd.DataFrame, amount_tolerance: float = 0.01):
+    both = frame["textfile_category"].notna() & frame["gptmsg_category"].notna()
+    textfile_category = frame.loc[both, "textfile_category"].astype(str)
+    matches = textfile_category == frame.loc[both, "gptmsg_category"].astype(str)
+
+    txt_amount = frame["textfile_amount"]
+    gpt_amount = frame["gptmsg_amount"]
+    both_amounts = txt_amount.notna() & gpt_amount.notna()
+    # Amounts agree when they are within amount_tolerance (relative) of each other
+    scale = np.maximum(txt_amount[both_amounts].abs(), gpt_amount[both_amounts].abs()).clip(lower=1.0)
+    amount_matches = (txt_amount[both_amounts] - gpt_amount[both_amounts]).abs() <= amount_tolerance * scale
+
+    by_category = matches.groupby(textfile_category).mean()
+    return {
+        "compared_categories": int(both.sum()),
+        "category_agreement_rate": _none_if_nan(matches.mean()) if len(matches) else None,
+        "category_agreement_by_textfile_category": {cat: float(rate) for cat, rate in by_category.items()},
+        "compared_amounts": int(both_amounts.sum()),
+        "amount_agreement_rate": _none_if_nan(amount_matches.mean()) if len(amount_matches) else None,
+    }
+
+# Full report for the textfile and gptmsg analyses plus their agreement
+def analyze_claims_frame(frame: pd.DataFrame):
+    return {
+        "claims": int(len(frame)),
+        "textfile_statistics": category_statistics(frame, "textfile"),
+        "gptmsg_statistics": category_statistics(frame, "gptmsg"),
+        "agreement": source_agreement(frame),
+    }
+
+def analyze_claim_columns(columns):
+    return analyze_claims_frame(build_claims_frame(columns))
+
+# Analyzes a specific set of claims data (textfile or gptmsg)
+def analyze_specific_claims_data(claims_data):
+    claims_data = [data for data in claims_data if data]
+    columns = {
+        "textfile_category": [data.get('Claims Category') for data in claims_data],
+        "textfile_amount": [data.get('Claim Amount') for data in claims_data],
+    }
+    stats = category_statistics(build_claims_frame(columns), "textfile")
+    category_counts = {cat: values["count"] for cat, values in stats.items()}
+    category_averages = {cat: values["mean"] for cat, values in stats.items()}
     return category_counts, category_averages
 
 # Main function to analyze all claims
 def analyze_claims(claims):
-    textfile_data = [claim.get('analysis', {}).get('textfile_analysis', {}) for claim in claims]
-    gptmsg_data = [claim.get('analysis', {}).get('gptmsg_analysis', {}) for claim in claims]
+    frame = build_claims_frame(claims_to_columns(claims))
+    textfile_stats = category_statistics(frame, "textfile")
+    gptmsg_stats = category_statistics(frame, "gptmsg")
 
-    textfile_counts, textfile_averages = analyze_specific_claims_data(textfile_data)
-    gptmsg_counts, gptmsg_averages = analyze_specific_claims_data(gptmsg_data)
+    textfile_counts = {cat: values["count"] for cat, values in textfile_stats.items()}
+    textfile_averages = {cat: values["mean"] for cat, values in textfile_stats.items()}
+    gptmsg_counts = {cat: values["count"] for cat, values in gptmsg_stats.items()}
+    gptmsg_averages = {cat: values["mean"] for cat, values in gptmsg_stats.items()}
 
     return textfile_counts, textfile_averages, gptmsg_counts, gptmsg_averages
@@ -0,0 +1,15 @@
+# Claim analysis fields shared by the write paths (crud, rollup) and the pandas engine in analysis.py.
+# Kept free of pandas/numpy so importing the API doesn't pay for them, analysis.py is loaded on first use.
+ANALYSIS_SOURCES = {"textfile": "textfile_analysis", "gptmsg": "gptmsg_analysis"}
+ANALYSIS_COLUMNS = ["id"] + [f"{prefix}_{field}" for prefix in ANALYSIS_SOURCES for field in ("category", "amount")]
+
+# Normalizes claim amount irrespective of its format (string, float, etc.)
+def normalize_claim_amount(amount):
+    if isinstance(amount, str):
+        amount = amount.replace('$', '').replace(',', '')
+        return float(amount)
+    return amount
+
+# Same columns from already flattened rows, e.g. a projected Cosmos query
+def rows_to_columns(rows):
+    return {column: [row.get(column) for row in rows] for column in ANALYSIS_COLUMNS}
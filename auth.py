@@ -1,7 +1,20 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import httpx
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2AuthorizationCodeBearer
-import httpx
 from config_loader import config  # Import the config module
+from http_clients import get_graph_client
+from logger import logger
+from ttl_cache import TTLCache, SingleFlight
+
+try:
+    import jwt  # PyJWT, optional, only needed for local token signature checks
+except ImportError:
+    jwt = None
 
 # Extract Azure AD configuration values
 azure_ad_config = config['azure_ad']
@@ -21,16 +34,113 @@ oauth2_scheme = OAuth2AuthorizationCodeBearer(
     },
 )
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    async with httpx.AsyncClient() as client:
-        # Exchange token for user information
-        response = await client.post(
-            "https://graph.microsoft.com/oidc/userinfo",
-            headers={"Authorization": f"Bearer {token}"}
-        )
-        if response.status_code != 200:
+# Validated tokens are cached by their sha256 so each one only hits Graph once until it expires
+token_cache_ttl = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+token_cache_size = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+token_expiry_skew = 30  # Seconds, drop cached tokens a little before their exp
+token_cache = TTLCache(maxsize=token_cache_size, ttl=token_cache_ttl)
+token_flight = SingleFlight()
+
+# Tokens issued for this audience (e.g. api://<client_id>) are checked locally against the tenant JWKS.
+# Graph tokens can't be verified that way so they still go through userinfo.
+local_jwt_audience = os.getenv("AUTH_LOCAL_JWT_AUDIENCE")
+jwks_url = f"https://login.microsoftonline.com/{tenant_id}/discovery/v2.0/keys"
+jwks_ttl = float(os.getenv("AUTH_JWKS_TTL", "86400"))
+jwks_cache = TTLCache(maxsize=64, ttl=jwks_ttl)
+jwks_flight = SingleFlight()
+# Seconds between refetches for an unknown kid, so tokens with made up kids can't drive a JWKS call each
+jwks_refetch_interval = float(os.getenv("AUTH_JWKS_REFETCH_INTERVAL", "60"))
+jwks_fetched_at = 0.0  # time.monotonic() of the last fetch attempt
+token_issuers = [
+    f"https://login.microsoftonline.com/{tenant_id}/v2.0",
+    f"https://sts.windows.net/{tenant_id}/",
+]
+
+# Reads the claims of a JWT without verifying it, only used for exp/aud routing decisions
+def unverified_claims(token: str):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except Exception:
+        return {}
+
+async def fetch_jwks():
+    global jwks_fetched_at
+    # Failed attempts count too, an unreachable endpoint is not retried on every request
+    jwks_fetched_at = time.monotonic()
+    try:
+        response = await get_graph_client().get(jwks_url)
+        response.raise_for_status()
+        jwks = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Fetching the JWKS failed: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Token signing keys are unavailable")
+    keys = {}
+    for jwk in jwks.get("keys", []):
+        try:
+            keys[jwk["kid"]] = jwt.PyJWK(jwk).key
+        except Exception as e:
+            logger.warning(f"Skipping unusable JWKS key {jwk.get('kid')}: {str(e)}")
+    jwks_cache.set("keys", keys)
+    return keys
+
+async def get_signing_key(kid: str):
+    keys = jwks_cache.get("keys")
+    if keys is None:
+        keys = await jwks_flight.do("keys", fetch_jwks)
+    elif kid not in keys and time.monotonic() - jwks_fetched_at >= jwks_refetch_interval:
+        # Keys rotate, refetch before giving up on an unknown kid, at most once per interval
+        keys = await jwks_flight.do("keys", fetch_jwks)
+    return keys.get(kid)
+
+async def validate_token_locally(token: str):
+    try:
+        key = await get_signing_key(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-        return response.json()
+        claims = jwt.decode(token, key, algorithms=["RS256"], audience=local_jwt_audience, issuer=token_issuers)
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    # Same shape as the Graph userinfo response
+    return {
+        "sub": claims.get("sub"),
+        "oid": claims.get("oid"),
+        "name": claims.get("name"),
+        "email": claims.get("email") or claims.get("preferred_username"),
+    }
+
+async def fetch_userinfo(token: str):
+    # Exchange token for user information
+    response = await get_graph_client().post(
+        "https://graph.microsoft.com/oidc/userinfo",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return response.json()
+
+async def validate_token(token: str, cache_key: str):
+    claims = unverified_claims(token)
+    if jwt is not None and local_jwt_audience and claims.get("aud") == local_jwt_audience:
+        user = await validate_token_locally(token)
+    else:
+        user = await fetch_userinfo(token)
+
+    # Never keep a token in the cache past its own exp
+    ttl = None
+    if "exp" in claims:
+        ttl = claims["exp"] - time.time() - token_expiry_skew
+    token_cache.set(cache_key, user, ttl=ttl)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    user = token_cache.get(cache_key)
+    if user is not None:
+        return user
+    # Concurrent requests carrying the same uncached token share one validation call
+    return await token_flight.do(cache_key, lambda: validate_token(token, cache_key))
 
 async def exchange_code_for_token(auth_code: str):
     # Define the token endpoint
@@ -44,9 +154,8 @@ async def exchange_code_for_token(auth_code: str):
         'client_secret': client_secret,
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_endpoint, data=params)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise HTTPException(status_code=400, detail="Failed to exchange token")
+    response = await get_graph_client().post(token_endpoint, data=params)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise HTTPException(status_code=400, detail="Failed to exchange token")
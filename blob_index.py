@@ -0,0 +1,192 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from clients import get_blob_container_client
+from crud import decode_continuation, encode_continuation
+from logger import logger
+
+# In-process index of the claim-notes container: blob name -> metadata, plus claim_id -> names.
+# Built from a paged list_blobs(include=["metadata"]), kept current by the upload path and
+# rebuilt every BLOB_INDEX_REFRESH_SECONDS to pick up blobs written by other processes.
+blob_index_refresh_seconds = float(os.getenv("BLOB_INDEX_REFRESH_SECONDS", "300"))
+blob_list_page_size = int(os.getenv("BLOB_LIST_PAGE_SIZE", "1000"))
+
+
+def blob_entry(blob):
+    return {
+        "name": blob.name,
+        "metadata": blob.metadata or {},
+        "size": blob.size,
+        "last_modified": blob.last_modified.isoformat() if blob.last_modified else None,
+    }
+
+
+# One page of the container listing with metadata included, (entries, next marker)
+def list_blob_page(container_client, prefix: Optional[str], page_size: int, marker: Optional[str] = None):
+    pages = container_client.list_blobs(
+        name_starts_with=prefix, include=["metadata"], results_per_page=page_size
+    ).by_page(continuation_token=marker)
+    for page in pages:
+        return [blob_entry(blob) for blob in page], pages.continuation_token
+    return [], None
+
+
+def list_all_blobs(container_client, prefix: Optional[str] = None):
+    entries, marker = list_blob_page(container_client, prefix, blob_list_page_size)
+    while marker:
+        page, marker = list_blob_page(container_client, prefix, blob_list_page_size, marker)
+        entries.extend(page)
+    return entries
+
+
+class BlobMetadataIndex:
+    def __init__(self):
+        self.entries: Dict[str, dict] = {}
+        self.names: List[str] = []
+        self.by_claim: Dict[str, set] = {}
+        self.ready = False
+        self.refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Uploads (and deletes, as None) that land while a rebuild is listing the container, replayed
+        # onto the new snapshot
+        self._recent: Optional[Dict[str, Optional[dict]]] = None
+
+    def _add(self, entries: Dict[str, dict], by_claim: Dict[str, set], entry: dict):
+        previous = entries.get(entry["name"])
+        if previous is not None:
+            by_claim.get(previous["metadata"].get("claim_id"), set()).discard(entry["name"])
+        entries[entry["name"]] = entry
+        claim_id = entry["metadata"].get("claim_id")
+        if claim_id:
+            by_claim.setdefault(claim_id, set()).add(entry["name"])
+
+    def _discard(self, entries: Dict[str, dict], by_claim: Dict[str, set], name: str):
+        previous = entries.pop(name, None)
+        if previous is not None:
+            claim_id = previous["metadata"].get("claim_id")
+            names = by_claim.get(claim_id)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del by_claim[claim_id]
+        return previous
+
+    def rebuild(self, container_client):
+        with self._lock:
+            self._recent = {}
+        try:
+            listed = list_all_blobs(container_client)
+        except Exception:
+            with self._lock:
+                self._recent = None
+            raise
+        entries, by_claim = {}, {}
+        for entry in listed:
+            self._add(entries, by_claim, entry)
+        with self._lock:
+            for name, entry in self._recent.items():
+                if entry is None:
+                    self._discard(entries, by_claim, name)
+                else:
+                    self._add(entries, by_claim, entry)
+            self._recent = None
+            self.entries, self.by_claim = entries, by_claim
+            self.names = sorted(entries)
+            self.ready = True
+            self.refreshed_at = time.time()
+        logger.info(f"Blob metadata index rebuilt, {len(entries)} blobs")
+
+    def upsert(self, name: str, metadata: dict, size: Optional[int] = None, last_modified: Optional[str] = None):
+        entry = {"name": name, "metadata": metadata or {}, "size": size, "last_modified": last_modified}
+        with self._lock:
+            if self._recent is not None:
+                self._recent[name] = entry
+            if name not in self.entries:
+                bisect.insort(self.names, name)
+            self._add(self.entries, self.by_claim, entry)
+
+    # For deleted blobs (and ones found already gone) so listings don't wait for the next rebuild
+    def remove(self, name: str):
+        with self._lock:
+            if self._recent is not None:
+                self._recent[name] = None
+            if self._discard(self.entries, self.by_claim, name) is not None:
+                index = bisect.bisect_left(self.names, name)
+                if index < len(self.names) and self.names[index] == name:
+                    del self.names[index]
+
+    # Names in order, optionally limited to a prefix and/or claim_id, starting after `after`
+    def query(self, prefix: Optional[str] = None, claim_id: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None):
+        with self._lock:
+            if claim_id is not None:
+                names = sorted(self.by_claim.get(claim_id, ()))
+                if prefix:
+                    names = [name for name in names if name.startswith(prefix)]
+                start = bisect.bisect_right(names, after) if after is not None else 0
+            else:
+                names = self.names
+                start = bisect.bisect_left(names, prefix or "")
+                if after is not None:
+                    start = max(start, bisect.bisect_right(names, after))
+            results = []
+            for name in names[start:]:
+                if prefix and not name.startswith(prefix):
+                    break
+                results.append(self.entries[name])
+                if limit is not None and len(results) == limit:
+                    break
+            return results
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "blobs": len(self.entries),
+            "claims": len(self.by_claim),
+            "refreshed_at": self.refreshed_at,
+        }
+
+
+blob_index = BlobMetadataIndex()
+
+
+async def refresh_blob_index_forever():
+    while True:
+        try:
+            # The client is built in the worker thread too, startup doesn't wait for the blob SDK
+            await asyncio.to_thread(lambda: blob_index.rebuild(get_blob_container_client()))
+        except Exception as e:
+            logger.error(f"Error rebuilding blob metadata index: {str(e)}")
+        await asyncio.sleep(blob_index_refresh_seconds)
+
+
+# Claim notes matching prefix/claim_id. Served from the index once it is built, before that from a
+# metadata-including listing. page_size returns one page plus a continuation for the next one.
+async def find_claim_notes(container_client, prefix: Optional[str] = None, claim_id: Optional[str] = None,
+                           page_size: Optional[int] = None, continuation: Optional[str] = None):
+    try:
+        token = json.loads(decode_continuation(continuation)) if continuation else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid continuation token")
+    if blob_index.ready and token.get("source") != "listing":
+        limit = page_size + 1 if page_size else None
+        entries = blob_index.query(prefix, claim_id, after=token.get("after"), limit=limit)
+        if page_size and len(entries) > page_size:
+            entries = entries[:page_size]
+            return entries, encode_continuation(json.dumps({"source": "index", "after": entries[-1]["name"]}))
+        return entries, None
+
+    if not page_size:
+        entries = await asyncio.to_thread(list_all_blobs, container_client, prefix)
+        marker = None
+    else:
+        # claim_id can only be filtered client side here, so a page may come back short
+        entries, marker = await asyncio.to_thread(list_blob_page, container_client, prefix, page_size, token.get("marker"))
+    if claim_id is not None:
+        entries = [entry for entry in entries if entry["metadata"].get("claim_id") == claim_id]
+    next_token = encode_continuation(json.dumps({"source": "listing", "marker": marker})) if marker else None
+    return entries, next_token
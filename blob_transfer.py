@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import codecs
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import Optional, Tuple
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from fastapi import HTTPException, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+
+# Size of each ranged GET against Blob Storage while streaming, this is all a download holds in memory
+blob_download_chunk_size = int(os.getenv("BLOB_DOWNLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))
+# Uploads are staged as blocks of this size, at most blob_upload_concurrency of them in memory/in flight
+blob_upload_block_size = int(os.getenv("BLOB_UPLOAD_BLOCK_SIZE", str(4 * 1024 * 1024)))
+blob_upload_concurrency = int(os.getenv("BLOB_UPLOAD_CONCURRENCY", "4"))
+blob_upload_max_bytes = int(os.getenv("BLOB_UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+# Single "bytes=start-end" range as inclusive offsets, None means send the whole blob.
+# Malformed or multi-range headers are ignored (allowed by RFC 9110), out of range ones get a 416.
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range, the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # An invalid range-spec is ignored (RFC 9110 14.2), the full body is served
+        return None
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+# If-None-Match can list several ETags or "*", weak validators compare equal to strong ones for GET
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    normalise = lambda tag: tag.strip().removeprefix("W/")
+    return normalise(etag) in {normalise(tag) for tag in if_none_match.split(",")}
+
+
+async def get_blob_properties(blob_client):
+    try:
+        return await asyncio.to_thread(blob_client.get_blob_properties)
+    except ResourceNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Blob {blob_client.blob_name} not found")
+
+
+def not_modified(properties):
+    return Response(status_code=304, headers={"ETag": properties.etag})
+
+
+# Iterates the blob in BLOB_DOWNLOAD_CHUNK_SIZE pieces. Pinned to the ETag we answered with,
+# so a blob overwritten mid-download fails instead of mixing two versions.
+def blob_chunks(blob_client, etag: str, offset: int = 0, length: Optional[int] = None):
+    if length == 0:
+        return
+    downloader = blob_client.download_blob(
+        offset=offset,
+        length=length,
+        etag=etag,
+        match_condition=MatchConditions.IfNotModified,
+        max_concurrency=1,
+    )
+    yield from downloader.chunks()
+
+
+# Passthrough download with Range (206) and If-None-Match (304) support.
+# StreamingResponse runs the sync chunk iterator in the threadpool, the event loop never blocks on it.
+async def stream_blob(blob_client, request: Request):
+    properties = await get_blob_properties(blob_client)
+    if etag_matches(request.headers.get("if-none-match"), properties.etag):
+        return not_modified(properties)
+
+    size = properties.size
+    byte_range = parse_range(request.headers.get("range"), size)
+    # A Range whose If-Range validator is stale gets the full, current blob
+    if_range = request.headers.get("if-range")
+    if byte_range is not None and if_range and if_range.strip() != properties.etag:
+        byte_range = None
+
+    headers = {
+        "ETag": properties.etag,
+        "Accept-Ranges": "bytes",
+    }
+    if properties.last_modified:
+        headers["Last-Modified"] = properties.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    content_type = properties.content_settings.content_type or "application/octet-stream"
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(blob_chunks(blob_client, properties.etag), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        blob_chunks(blob_client, properties.etag, start, end - start + 1),
+        status_code=206,
+        media_type=content_type,
+        headers=headers,
+    )
+
+
+# {"claim_note": "<text>"} built up chunk by chunk, so large notes never sit in memory whole
+def claim_note_json_chunks(blob_client, etag: str):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    yield '{"claim_note": "'
+    for chunk in blob_chunks(blob_client, etag):
+        yield json.dumps(decoder.decode(chunk))[1:-1]
+    yield json.dumps(decoder.decode(b"", final=True))[1:-1]
+    yield '"}'
+
+
+async def stream_claim_note_json(blob_client, request: Request):
+    properties = await get_blob_properties(blob_client)
+    if etag_matches(request.headers.get("if-none-match"), properties.etag):
+        return not_modified(properties)
+    return StreamingResponse(
+        claim_note_json_chunks(blob_client, properties.etag),
+        media_type="application/json",
+        headers={"ETag": properties.etag},
+    )
+
+
+# Block ids must all have the same length within a blob, the per-upload prefix keeps two
+# concurrent uploads of the same name from committing each other's blocks
+def block_id(upload_id: str, index: int):
+    return base64.b64encode(f"{upload_id}-{index:08d}".encode("ascii")).decode("ascii")
+
+
+# Reads the upload in blob_upload_block_size chunks and stages them as blocks in parallel, then
+# commits the block list. The MD5 of the whole file is computed on the way through and stored on the blob.
+async def upload_stream(blob_client, file: UploadFile, metadata: Optional[dict] = None, max_bytes: Optional[int] = None):
+    max_bytes = blob_upload_max_bytes if max_bytes is None else max_bytes
+    upload_id = uuid.uuid4().hex
+    semaphore = asyncio.Semaphore(blob_upload_concurrency)
+    md5 = hashlib.md5()
+    block_ids = []
+    tasks = []
+    size = 0
+
+    async def stage(block: str, chunk: bytes):
+        try:
+            await asyncio.to_thread(blob_client.stage_block, block, chunk, length=len(chunk))
+        finally:
+            semaphore.release()
+
+    try:
+        while True:
+            # Waiting for a free slot before reading keeps memory at concurrency * block size
+            await semaphore.acquire()
+            chunk = await file.read(blob_upload_block_size)
+            if not chunk:
+                semaphore.release()
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                semaphore.release()
+                raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes} byte limit")
+            md5.update(chunk)
+            block = block_id(upload_id, len(block_ids))
+            block_ids.append(block)
+            tasks.append(asyncio.create_task(stage(block, chunk)))
+            # Surface a failed block early instead of reading the rest of the upload
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Staged but uncommitted blocks are discarded by the service after a week
+        raise
+
+    # Imported here so serving downloads doesn't require loading the whole blob SDK up front
+    from azure.storage.blob import BlobBlock, ContentSettings
+
+    content_settings = ContentSettings(
+        content_type=file.content_type or "application/octet-stream",
+        content_md5=bytearray(md5.digest()),
+    )
+    await asyncio.to_thread(
+        blob_client.commit_block_list,
+        [BlobBlock(block_id=block) for block in block_ids],
+        metadata=metadata,
+        content_settings=content_settings,
+    )
+    return {
+        "size": size,
+        "blocks": len(block_ids),
+        "content_md5": base64.b64encode(md5.digest()).decode("ascii"),
+    }
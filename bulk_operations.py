@@ -0,0 +1,139 @@
+import asyncio
+import itertools
+import os
+import random
+from typing import Any, Awaitable, Callable, Iterable, Optional
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from database import get_async_container
+from entity_cache import entity_cache
+from logger import logger
+
+# Defaults for bulk writes, size concurrency to the container's provisioned RU/s
+bulk_concurrency = int(os.getenv("COSMOS_BULK_CONCURRENCY", "32"))
+bulk_chunk_size = int(os.getenv("COSMOS_BULK_CHUNK_SIZE", "500"))
+# Extra 429 retries on top of the SDK's own throttle retry policy
+max_throttle_retries = int(os.getenv("COSMOS_MAX_THROTTLE_RETRIES", "9"))
+
+
+def new_summary():
+    return {
+        "total": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "throttled": 0,
+        "request_charge": 0.0,
+        "failures": [],
+    }
+
+
+# Adds a partial summary (one bulk call over part of the items) to a running one
+def merge_summary(summary: dict, part: dict):
+    for key in ("total", "succeeded", "failed", "throttled", "request_charge"):
+        summary[key] += part[key]
+    summary["failures"].extend(part["failures"])
+    return summary
+
+
+# Cosmos accepts at most 10 operations in one patch request
+MAX_PATCH_OPERATIONS = 10
+
+
+# Cosmos tells us how long to wait on a 429, fall back to jittered exponential backoff if it doesn't
+def retry_after_seconds(error: CosmosHttpResponseError, attempt: int):
+    headers = getattr(error, "headers", None) or {}
+    retry_after_ms = headers.get("x-ms-retry-after-ms")
+    if retry_after_ms:
+        return float(retry_after_ms) / 1000
+    return min(0.1 * 2 ** attempt, 5.0) * (1 + random.random())
+
+
+async def run_with_throttle_retry(operation: Callable[[], Awaitable[Any]], summary: dict):
+    for attempt in range(max_throttle_retries + 1):
+        try:
+            return await operation()
+        except CosmosHttpResponseError as e:
+            if e.status_code != 429 or attempt == max_throttle_retries:
+                raise
+            summary["throttled"] += 1
+            await asyncio.sleep(retry_after_seconds(e, attempt))
+
+
+# Runs operation(item, response_hook) over items in chunks, at most `concurrency` requests in flight.
+# Items can be a lazy generator, only one chunk is held in memory at a time.
+async def run_bulk(
+    items: Iterable[Any],
+    operation: Callable[[Any, Callable], Awaitable[Any]],
+    item_id: Callable[[Any], str] = lambda item: item["id"],
+    concurrency: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+):
+    summary = new_summary()
+    semaphore = asyncio.Semaphore(concurrency or bulk_concurrency)
+
+    def record_charge(headers, _result):
+        summary["request_charge"] += float(headers.get("x-ms-request-charge", 0) or 0)
+
+    async def run_one(item):
+        async with semaphore:
+            try:
+                await run_with_throttle_retry(lambda: operation(item, record_charge), summary)
+                summary["succeeded"] += 1
+            except Exception as e:
+                summary["failed"] += 1
+                summary["failures"].append({
+                    "id": item_id(item),
+                    "status_code": getattr(e, "status_code", None),
+                    "error": str(e),
+                })
+
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size or bulk_chunk_size))
+        if not chunk:
+            break
+        summary["total"] += len(chunk)
+        await asyncio.gather(*(run_one(item) for item in chunk))
+
+    logger.info(
+        f"Bulk operation finished: {summary['succeeded']}/{summary['total']} succeeded, "
+        f"{summary['failed']} failed, {summary['throttled']} throttled, {summary['request_charge']:.2f} RU"
+    )
+    return summary
+
+
+async def bulk_upsert(items: Iterable[dict], concurrency: Optional[int] = None, chunk_size: Optional[int] = None):
+    container = get_async_container()
+    return await run_bulk(
+        items,
+        lambda item, hook: container.upsert_item(item, response_hook=hook),
+        concurrency=concurrency,
+        chunk_size=chunk_size,
+    )
+
+
+# Cosmos patch "set" operations for top level fields
+def field_patch_operations(fields: dict):
+    return [{"op": "set", "path": f"/{name}", "value": value} for name, value in fields.items()]
+
+
+# Field updates for many documents at once, each item is {"id", "fields", optional "etag"}.
+# Items with an etag fail with 412 (reported in the summary) if the document changed since it was read.
+async def bulk_patch(items: Iterable[dict], concurrency: Optional[int] = None, chunk_size: Optional[int] = None):
+    container = get_async_container()
+
+    async def patch(item, hook):
+        operations = field_patch_operations(item["fields"])
+        if len(operations) > MAX_PATCH_OPERATIONS:
+            raise ValueError(f"At most {MAX_PATCH_OPERATIONS} fields can be patched at once")
+        options = {"etag": item["etag"], "match_condition": MatchConditions.IfNotModified} if item.get("etag") else {}
+        try:
+            doc = await container.patch_item(
+                item=item["id"], partition_key=item["id"], patch_operations=operations, response_hook=hook, **options
+            )
+        except CosmosHttpResponseError:
+            entity_cache.invalidate(item["id"])
+            raise
+        entity_cache.put(doc)
+
+    return await run_bulk(items, patch, concurrency=concurrency, chunk_size=chunk_size)
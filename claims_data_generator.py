@@ -1,15 +1,18 @@
+import asyncio
+import datetime
+import functools
+import itertools
 import os
 import random
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from faker import Faker
 import markovify
 import numpy as np
-from azure.storage.blob import BlobServiceClient, BlobClient
-from config_loader import config
-from database import container
-
-# Initialize Azure Blob Service Client
-blob_service_client = BlobServiceClient.from_connection_string(config['azure_blob_storage']['connection_string_one'])
-container_client = blob_service_client.get_container_client(config['azure_blob_storage']['container_name'])
+from clients import get_blob_container_client, get_cosmos_container
+from bulk_operations import bulk_chunk_size, bulk_upsert, merge_summary, new_summary
+from rollup import apply_rollup_delta
+from logger import logger
+from entity_cache import entity_cache
 
 # Initialize Faker
 fake = Faker()
@@ -88,7 +91,6 @@ def generate_claim_amount(incident_type):
 
 # Function to generate a single claim note, now accepting a policyholder_id
 def generate_claim_note(policyholder_id: str):
-    print("Claim data generator starting to attempt this")
     category = random.choice(list(sample_sentences_by_type.keys()))
     markov_model = markov_models[category]
     incident_date = fake.date_between(start_date='-2y', end_date='today')
@@ -106,34 +108,199 @@ def generate_claim_note(policyholder_id: str):
     # Additional note for high claim amounts
     if claim_amount > claim_amount_ranges[category][1]:
         claim_note_text += "Note: High claim amount - requires additional review.\n"
-    print(claim_note_text)
     return claim_note_text
 
 def generate_claim_notes(number_of_notes, policyholder_id):
+    return [note for _, note in iter_claim_notes([policyholder_id], number_of_notes)]
+
+
+# Detail sentences per category (in ClaimNoteGenerator.categories order), sampled once per seed and
+# reused, making sentences from these tiny corpora takes many rejected tries.
+# markovify draws from the global random module, seed it just for the sampling and put it back after.
+@functools.lru_cache(maxsize=8)
+def sample_sentence_pools(seed: Optional[int], size: int):
+    state = random.getstate()
+    if seed is not None:
+        random.seed(seed)
+    try:
+        pools = []
+        for category in sample_sentences_by_type:
+            sentences = [markov_models[category].make_short_sentence(320) for _ in range(size)]
+            # make_short_sentence gives up now and then, fall back to the source sentences
+            pools.append([sentence or random.choice(sample_sentences_by_type[category]) for sentence in sentences])
+        return pools
+    finally:
+        random.setstate(state)
+
+
+# Bulk mode: names are looked up once per batch, categories/dates/amounts are drawn as NumPy arrays
+# and note details come from sentence pools sampled from the Markov models up front.
+# Same notes as generate_claim_note, a seed makes a run reproducible.
+class ClaimNoteGenerator:
+    def __init__(self, seed: Optional[int] = None, sentence_pool_size: int = 64):
+        self.rng = np.random.default_rng(seed)
+        self.categories = list(sample_sentences_by_type)
+        self.range_min = np.array([claim_amount_ranges[category][0] for category in self.categories], dtype=float)
+        self.range_max = np.array([claim_amount_ranges[category][1] for category in self.categories], dtype=float)
+        self.sentence_pools = sample_sentence_pools(seed, sentence_pool_size)
+
+    # Vectorised generate_claim_amount: normal within the range, 10% outliers split between high and low
+    def claim_amounts(self, category_indexes: np.ndarray):
+        count = len(category_indexes)
+        base_min = self.range_min[category_indexes]
+        base_max = self.range_max[category_indexes]
+        amounts = np.maximum(self.rng.normal((base_max + base_min) / 2, (base_max - base_min) / 4), base_min)
+        outlier = self.rng.random(count) < 0.1
+        high = self.rng.random(count) < 0.5
+        high_amounts = self.rng.uniform(base_max * 1.5, base_max * 3)
+        low_amounts = self.rng.uniform(base_min / 3, base_min)
+        amounts = np.where(outlier, np.where(high, high_amounts, low_amounts), amounts)
+        return np.round(amounts, 2)
+
+    # Incident dates within the last two years, as ISO strings
+    def incident_dates(self, count: int):
+        today = np.datetime64(datetime.date.today(), "D")
+        return (today - self.rng.integers(0, 731, count)).astype(str)
+
+    # Random (version 4) UUID strings drawn from the generator's rng, so a seeded run also reproduces the ids
+    def uuids(self, count: int):
+        raw = self.rng.integers(0, 256, (count, 16), dtype=np.uint8)
+        raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+        raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+        hexes = raw.tobytes().hex()
+        return [
+            f"{hexes[i:i + 8]}-{hexes[i + 8:i + 12]}-{hexes[i + 12:i + 16]}-{hexes[i + 16:i + 20]}-{hexes[i + 20:i + 32]}"
+            for i in range(0, 32 * count, 32)
+        ]
+
+    # Notes for one batch of policyholder ids (repeats allowed), names must already be resolved
+    def note_batch(self, policyholder_ids: List[str], names: Dict[str, str]):
+        count = len(policyholder_ids)
+        category_indexes = self.rng.integers(0, len(self.categories), count)
+        sentence_indexes = self.rng.integers(0, len(self.sentence_pools[0]), count)
+        amounts = self.claim_amounts(category_indexes).tolist()
+        dates = self.incident_dates(count).tolist()
+        high_amount = (np.array(amounts) > self.range_max[category_indexes]).tolist()
 
-    return [generate_claim_note(policyholder_id) for _ in range(number_of_notes)]
+        notes = []
+        for policyholder_id, category_index, sentence_index, amount, date, is_high in zip(
+            policyholder_ids, category_indexes.tolist(), sentence_indexes.tolist(), amounts, dates, high_amount
+        ):
+            category = self.categories[category_index]
+            note = (
+                f"{date} - Claim by {names.get(policyholder_id, 'Error')}.\n"
+                f"Policyholder ID: {policyholder_id}\n"
+                f"Category: {category}\nDetails: {self.sentence_pools[category_index][sentence_index]}\n"
+                f"Estimated Claim Amount: ${amount}\n"
+            )
+            if is_high:
+                note += "Note: High claim amount - requires additional review.\n"
+            notes.append(note)
+        return notes
 
 
-# Functions to generate and save multiple claim notes
-def generate_and_save_claim_notes_local(n):
-    for i in range(n):
-        claim_note = generate_claim_note()
+# Policyholder ids expanded to notes_per_policyholder each, cut into batches with their notes.
+# Names are looked up once per batch unless given, e.g. for load tests against made up policyholder ids.
+def note_batches(generator: ClaimNoteGenerator, policyholder_ids: Iterable[str], notes_per_policyholder: int,
+                 batch_size: int, names: Optional[Dict[str, str]] = None):
+    expanded = (policyholder_id for policyholder_id in policyholder_ids for _ in range(notes_per_policyholder))
+    while True:
+        batch = list(itertools.islice(expanded, batch_size))
+        if not batch:
+            return
+        batch_names = names if names is not None else get_policyholder_names(set(batch))
+        yield batch, generator.note_batch(batch, batch_names)
+
+
+# Yields (policyholder_id, note) lazily, only one batch is held in memory at a time
+def iter_claim_notes(
+    policyholder_ids: Iterable[str],
+    notes_per_policyholder: int = 1,
+    seed: Optional[int] = None,
+    batch_size: int = 10000,
+    names: Optional[Dict[str, str]] = None,
+) -> Iterator[Tuple[str, str]]:
+    generator = ClaimNoteGenerator(seed)
+    for batch, notes in note_batches(generator, policyholder_ids, notes_per_policyholder, batch_size, names):
+        yield from zip(batch, notes)
+
+
+# Cosmos claim documents ready for bulk ingestion, generated lazily
+def iter_claim_note_items(
+    number_of_notes: int,
+    policyholder_ids: Iterable[str],
+    seed: Optional[int] = None,
+    batch_size: int = 10000,
+    names: Optional[Dict[str, str]] = None,
+) -> Iterator[dict]:
+    generator = ClaimNoteGenerator(seed)
+    for batch, notes in note_batches(generator, policyholder_ids, number_of_notes, batch_size, names):
+        for item_id, policyholder_id, note in zip(generator.uuids(len(batch)), batch, notes):
+            yield {
+                "id": item_id,
+                "policyholder_id": policyholder_id,
+                "textfile": note,
+            }
+
+
+# Generates notes for the policyholders and writes them through the bulk ingest engine one chunk at a
+# time, so only a chunk of notes is in memory. Returns the id and policyholder of every claim written.
+async def generate_and_ingest_claim_notes(number_of_notes, policyholder_ids, concurrency=None, seed: Optional[int] = None):
+    items = iter_claim_note_items(number_of_notes, policyholder_ids, seed)
+    summary, written = new_summary(), []
+    while True:
+        # Generation reads policyholder names with the sync client so keep it off the event loop
+        chunk = await asyncio.to_thread(lambda: list(itertools.islice(items, bulk_chunk_size)))
+        if not chunk:
+            break
+        part = await bulk_upsert(chunk, concurrency=concurrency)
+        merge_summary(summary, part)
+        failed_ids = {failure["id"] for failure in part["failures"]}
+        written.extend(
+            {"id": item["id"], "policyholder_id": item["policyholder_id"]} for item in chunk if item["id"] not in failed_ids
+        )
+    await apply_rollup_delta(claims_delta=summary["succeeded"])
+    return written, summary
+
+
+# Functions to generate and save multiple claim notes, n notes spread over the given policyholders
+def generate_and_save_claim_notes_local(n, policyholder_ids: List[str], seed: Optional[int] = None):
+    ids = itertools.islice(itertools.cycle(policyholder_ids), n)
+    for i, (_, claim_note) in enumerate(iter_claim_notes(ids, seed=seed)):
         with open(f'claim_notes/claim_note_{i}.txt', 'w') as file:
             file.write(claim_note)
 
-def generate_and_save_claim_notes(n):
-    for i in range(n):
-        claim_note = generate_claim_note()
+def generate_and_save_claim_notes(n, policyholder_ids: List[str], seed: Optional[int] = None):
+    ids = itertools.islice(itertools.cycle(policyholder_ids), n)
+    container_client = get_blob_container_client()
+    for i, (_, claim_note) in enumerate(iter_claim_notes(ids, seed=seed)):
         blob_name = f'claim_note_{i}.txt'
-        print(blob_name)
         blob_client = container_client.get_blob_client(blob_name)
-        print(blob_client)
         blob_client.upload_blob(claim_note, overwrite=True)
+    logger.info(f"Uploaded {n} claim notes to blob storage")
+
+
+# Names for many policyholders in one query per 1000 ids, unknown ids come back as "Error" like below
+def get_policyholder_names(policyholder_ids: Iterable[str]):
+    policyholder_ids = list(policyholder_ids)
+    names = {}
+    query = "SELECT c.id, c.name FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+    container = get_cosmos_container()
+    for start in range(0, len(policyholder_ids), 1000):
+        chunk = policyholder_ids[start:start + 1000]
+        try:
+            for item in container.query_items(
+                query=query, parameters=[{"name": "@ids", "value": chunk}], enable_cross_partition_query=True
+            ):
+                names[item["id"]] = item.get("name") or fake.name()
+        except Exception as e:
+            logger.error(f"Error looking up policyholder names: {str(e)}")
+    return names
 
 
 def get_policyholder_name_by_id(policyholder_id: str):
     try:
-        policyholder = container.read_item(item=policyholder_id, partition_key=policyholder_id)
+        policyholder = entity_cache.read_sync(get_cosmos_container(), policyholder_id)
         return policyholder.get('name', fake.name())  # Return the name if available, otherwise generate a random name
     except Exception:
         return "Error"  # In case of any exception, return Error as the name
\ No newline at end of file
@@ -0,0 +1,158 @@
+import asyncio
+import os
+from typing import List, Optional
+from fastapi import HTTPException
+from bulk_operations import bulk_patch
+from crud import get_claim_by_id, get_claims_by_ids, patch_claim_fields, update_claim_with_gptmsg
+from llm_batcher import MicroBatcher, llm_batch_enabled, llm_batch_max_items
+from llm_service import call_gpt_service, categorize_claim, new_categorization_batcher
+from logger import logger
+from rollup import apply_rollup_delta
+
+# Per-claim LLM pipelines shared by the API endpoints and the background job workers
+
+# Max categorize_claim calls in flight at once, size this to the LLM server's parallel slots
+llm_concurrency_limit = int(os.getenv("LLM_CONCURRENCY_LIMIT", "4"))
+# Most finished elaborations written back in one bulk patch by process_claims_pipeline
+process_claims_write_batch = int(os.getenv("PROCESS_CLAIMS_WRITE_BATCH", "50"))
+
+
+# Notes allowed in flight for a given number of concurrent LLM requests. With batching on each
+# request carries up to LLM_BATCH_MAX_ITEMS notes, so the batcher needs that many queued to fill one.
+def categorization_slots(concurrency: int):
+    return concurrency * llm_batch_max_items if llm_batch_enabled else concurrency
+
+# (semaphore, batcher) for one batch of analyses. Without an override the notes go through the shared
+# batcher, where LLM_BATCH_CONCURRENCY caps batched requests across every caller. With one the batch gets
+# its own batcher holding at most `concurrency` LLM requests in flight, so 1 sends them one at a time.
+def categorization_limits(concurrency: Optional[int] = None):
+    if not concurrency:
+        return asyncio.Semaphore(categorization_slots(llm_concurrency_limit)), None
+    concurrency = max(int(concurrency), 1)
+    batcher = new_categorization_batcher(concurrency) if llm_batch_enabled else None
+    return asyncio.Semaphore(categorization_slots(concurrency)), batcher
+
+async def categorize_claim_limited(claim_text: Optional[str], better_prompt: bool, semaphore: asyncio.Semaphore,
+                                   bypass_cache: bool = False, batcher: Optional[MicroBatcher] = None):
+    if not claim_text:
+        return None
+    async with semaphore:
+        return await categorize_claim(claim_text, better_prompt, bypass_cache, batcher)
+
+async def analyze_single_claim(claim: dict, better_prompt: bool, semaphore: asyncio.Semaphore, bypass_cache: bool = False,
+                               batcher: Optional[MicroBatcher] = None):
+    claim_id = claim.get("id")
+    try:
+        # Analyze textfile and gptmsg side by side, each waits for its own LLM slot
+        textfile_analysis, gptmsg_analysis = await asyncio.gather(
+            categorize_claim_limited(claim.get("textfile"), better_prompt, semaphore, bypass_cache, batcher),
+            categorize_claim_limited(claim.get("gptmsg"), better_prompt, semaphore, bypass_cache, batcher),
+        )
+
+        analysis_data = {
+            "textfile_analysis": textfile_analysis,
+            "gptmsg_analysis": gptmsg_analysis
+        }
+
+        # Update the claim in the database without blocking the other claims
+        try:
+            await update_claim_with_analysis(claim_id, analysis_data)
+        except Exception as e:
+            # The analysis is still returned, the error tells callers (and jobs) it wasn't stored
+            logger.error(f"Error updating claim {claim_id} with analysis: {str(e)}")
+            return {"id": claim_id, **analysis_data, "error": f"Saving the analysis failed: {str(e)}"}
+
+        return {
+            "id": claim_id,
+            **analysis_data
+        }
+    except Exception as e:
+        # A failing claim is reported in place so the rest of the batch still completes
+        logger.error(f"Error analyzing claim {claim_id}: {str(e)}")
+        return {
+            "id": claim_id,
+            "textfile_analysis": None,
+            "gptmsg_analysis": None,
+            "error": str(e)
+        }
+
+# Attempts at the read + conditional patch below before giving up on a claim that keeps changing
+analysis_write_attempts = 3
+
+# Raises when the analysis could not be stored
+async def update_claim_with_analysis(claim_id: str, analysis_data: dict):
+    for _ in range(analysis_write_attempts):
+        # The old analysis is needed for the rollup delta, the etag makes sure it is still the old one
+        claim = await get_claim_by_id(claim_id)
+        if not claim:
+            raise HTTPException(status_code=404, detail=f"Claim with id {claim_id} not found")
+        try:
+            await patch_claim_fields(claim_id, {"analysis": analysis_data}, etag=claim.get("_etag"))
+        except HTTPException as e:
+            if e.status_code == 412:
+                continue
+            raise
+        await apply_rollup_delta(old_analysis=claim.get('analysis'), new_analysis=analysis_data)
+        return
+    raise HTTPException(status_code=409, detail=f"Claim {claim_id} kept changing, analysis not saved")
+
+
+async def process_single_claim(claim_id: str, bypass_cache: bool = False):
+    claim = await get_claim_by_id(claim_id)
+    if claim and claim.get('textfile'):
+        gpt_response = await call_gpt_service(claim['textfile'], bypass_cache)
+        if gpt_response:
+            await update_claim_with_gptmsg(claim_id, gpt_response)
+            return gpt_response
+    return None
+
+
+# Elaborates many claims at once: one batched read of all claims, up to `concurrency` LLM calls in
+# flight, and finished results written back in bulk patches. Yields {"id", "gptmsg"} or {"id", "error"}
+# per claim in completion order, each only after its write went through.
+async def process_claims_pipeline(claim_ids: List[str], bypass_cache: bool = False, concurrency: Optional[int] = None):
+    claim_ids = list(dict.fromkeys(claim_ids))
+    claims = await get_claims_by_ids(claim_ids)
+    semaphore = asyncio.Semaphore(max(concurrency or llm_concurrency_limit, 1))
+    finished = asyncio.Queue()
+
+    async def elaborate(claim_id: str):
+        claim = claims.get(claim_id)
+        try:
+            if claim is None:
+                result = {"id": claim_id, "error": "Claim not found"}
+            elif not claim.get("textfile"):
+                result = {"id": claim_id, "error": "Claim has no textfile"}
+            else:
+                async with semaphore:
+                    gpt_response = await call_gpt_service(claim["textfile"], bypass_cache)
+                result = {"id": claim_id, "gptmsg": gpt_response} if gpt_response else {"id": claim_id, "error": "The LLM returned nothing"}
+        except Exception as e:
+            logger.error(f"Error processing claim {claim_id}: {str(e)}")
+            result = {"id": claim_id, "error": str(e)}
+        await finished.put(result)
+
+    tasks = [asyncio.create_task(elaborate(claim_id)) for claim_id in claim_ids]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            # Everything that finished while the previous batch was being written goes out together
+            batch = [await finished.get()]
+            while len(batch) < process_claims_write_batch and not finished.empty():
+                batch.append(finished.get_nowait())
+            remaining -= len(batch)
+            writes = [{"id": result["id"], "fields": {"gptmsg": result["gptmsg"]}} for result in batch if "gptmsg" in result]
+            if writes:
+                summary = await bulk_patch(writes)
+                errors = {failure["id"]: failure["error"] for failure in summary["failures"]}
+                for result in batch:
+                    if result["id"] in errors:
+                        result.pop("gptmsg")
+                        result["error"] = f"Saving the result failed: {errors[result['id']]}"
+            for result in batch:
+                yield result
+    finally:
+        # A client that disconnects from the stream stops the remaining LLM calls
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
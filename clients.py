@@ -0,0 +1,54 @@
+import threading
+from blob_transfer import blob_download_chunk_size
+from config_loader import config
+from metrics import blob_client_hooks, cosmos_client_hooks
+from repository import local_blob_container, local_sync_container, storage_backend
+from startup_timing import timed
+
+# Storage and sync Cosmos clients shared by the API and the data generator scripts. Nothing is built
+# (or even imported, azure.storage.blob alone takes a good part of a second) until first use.
+_lock = threading.Lock()
+_blob_container_client = None
+_cosmos_container = None
+
+
+def get_blob_container_client():
+    global _blob_container_client
+    if _blob_container_client is None:
+        with _lock:
+            if _blob_container_client is None:
+                blob_config = config['azure_blob_storage']
+                if storage_backend == "local":
+                    _blob_container_client = local_blob_container(blob_config['container_name'])
+                    return _blob_container_client
+                with timed("clients: blob storage"):
+                    from azure.storage.blob import BlobServiceClient
+
+                    # Downloads are fetched in blob_download_chunk_size ranged GETs, including the first one
+                    blob_service_client = BlobServiceClient.from_connection_string(
+                        blob_config[blob_config['active_string']],
+                        max_single_get_size=blob_download_chunk_size,
+                        max_chunk_get_size=blob_download_chunk_size,
+                        **blob_client_hooks(),
+                    )
+                    _blob_container_client = blob_service_client.get_container_client(blob_config['container_name'])
+    return _blob_container_client
+
+
+# Sync client, only used by the claims data generator scripts; the API goes through database.py
+def get_cosmos_container():
+    global _cosmos_container
+    if _cosmos_container is None:
+        with _lock:
+            if _cosmos_container is None:
+                if storage_backend == "local":
+                    _cosmos_container = local_sync_container()
+                    return _cosmos_container
+                with timed("clients: cosmos (sync)"):
+                    from azure.cosmos import CosmosClient
+
+                    cosmosdb_config = config['cosmos_db']
+                    client = CosmosClient(cosmosdb_config['url'], credential=cosmosdb_config['key_one'], **cosmos_client_hooks())
+                    database = client.get_database_client(cosmosdb_config['database_name'])
+                    _cosmos_container = database.get_container_client(cosmosdb_config['container_name'])
+    return _cosmos_container
@@ -1,34 +1,119 @@
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from repository import storage_backend
+from startup_timing import timed
+
+# Key Vault secret name -> (config section, key). Each one can also be supplied through an environment
+# variable named after the secret (upper case, dashes as underscores, e.g. ASSIGNMENT_COSMOS_KEY_ONE).
+SECRETS = {
+    'assignment-cosmos-key-one': ('cosmos_db', 'key_one'),
+    'assignment-cosmos-key-two': ('cosmos_db', 'key_two'),
+    'assignment-blob-connection-string-one': ('azure_blob_storage', 'connection_string_one'),
+    'assignment-blob-connection-string-two': ('azure_blob_storage', 'connection_string_two'),
+    'azure-ad-client-id': ('azure_ad', 'client_id'),
+    'azure-ad-client-secret': ('azure_ad', 'client_secret'),
+    'azure-ad-tenant-id': ('azure_ad', 'tenant_id'),
+}
+
+key_vault_name = os.getenv("KEY_VAULT_NAME", "AssignmentVault")
+# Optional local copy of the secrets so quick restarts skip Key Vault, off unless CONFIG_CACHE_TTL > 0.
+# The file holds plain-text secrets, only enable it where the disk is private to the app.
+config_cache_path = os.getenv("CONFIG_CACHE_PATH", ".config_cache.json")
+config_cache_ttl = float(os.getenv("CONFIG_CACHE_TTL", "0"))
+
+
+def secret_env_var(secret_name: str):
+    return secret_name.upper().replace('-', '_')
+
+
+def read_cached_secrets():
+    if config_cache_ttl <= 0:
+        return {}
+    try:
+        with open(config_cache_path) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if time.time() - cached.get('fetched_at', 0) > config_cache_ttl:
+        return {}
+    return cached.get('secrets', {})
+
+
+def write_cached_secrets(secrets: dict):
+    if config_cache_ttl <= 0:
+        return
+    try:
+        temp_path = f"{config_cache_path}.tmp"
+        # Owner read/write only, and swapped in atomically so a reader never sees half a file
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            json.dump({'fetched_at': time.time(), 'secrets': secrets}, file)
+        os.replace(temp_path, config_cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write the config cache: {str(e)}")
 
-def load_config_from_key_vault():
-    key_vault_name = "AssignmentVault"
-    kv_uri = f"https://{key_vault_name}.vault.azure.net"
 
+# Fetches the given secrets from Key Vault in parallel. The first one goes alone so the credential
+# has a token cached before the rest start, otherwise every thread would request its own.
+def fetch_key_vault_secrets(names):
+    if not names:
+        return {}
+    from azure.identity import DefaultAzureCredential
+    from azure.keyvault.secrets import SecretClient
+
+    kv_uri = f"https://{key_vault_name}.vault.azure.net"
     credential = DefaultAzureCredential()
     client = SecretClient(vault_url=kv_uri, credential=credential)
+    first, rest = names[0], names[1:]
+    secrets = {first: client.get_secret(first).value}
+    if rest:
+        with ThreadPoolExecutor(max_workers=len(rest)) as executor:
+            secrets.update(zip(rest, executor.map(lambda name: client.get_secret(name).value, rest)))
+    return secrets
+
+
+# With STORAGE_BACKEND=local only the Entra ID settings are needed
+def required_secrets():
+    return [name for name, (section, _) in SECRETS.items() if storage_backend == "cosmos" or section == "azure_ad"]
+
+
+def load_secrets():
+    required = required_secrets()
+    secrets = {name: os.environ[secret_env_var(name)] for name in required if secret_env_var(name) in os.environ}
+    missing = [name for name in required if name not in secrets]
+    cached = read_cached_secrets()
+    if missing and all(name in cached for name in missing):
+        secrets.update({name: cached[name] for name in missing})
+        logger.info("Loaded secrets from the local config cache")
+    elif missing:
+        with timed("config: key vault"):
+            fetched = fetch_key_vault_secrets(missing)
+        secrets.update(fetched)
+        write_cached_secrets({**cached, **fetched})
+    return secrets
+
+
+def load_config_from_key_vault():
+    secrets = load_secrets()
     #active_key is setup but not being used right now since we aren't production to rotate keys
     config = {
         'cosmos_db': {
             'url': "https://matlowai.documents.azure.com:443/",
-            'key_one': client.get_secret('assignment-cosmos-key-one').value,
             'database_name': "assignment-data",
             'container_name': "policyclaims",
-            'key_two': client.get_secret('assignment-cosmos-key-two').value,
             'active_key': "key_one"
         },
         'azure_blob_storage': {
-            'connection_string_one': client.get_secret('assignment-blob-connection-string-one').value,
-            'connection_string_two': client.get_secret('assignment-blob-connection-string-two').value,
-            'container_name': "assignmentclaim", 
+            'container_name': "assignmentclaim",
             'active_string': "connection_string_one"
         },
-        'azure_ad': {
-            'client_id': client.get_secret('azure-ad-client-id').value,
-            'client_secret': client.get_secret('azure-ad-client-secret').value,
-            'tenant_id': client.get_secret('azure-ad-tenant-id').value
-        }
+        'azure_ad': {}
     }
+    for name, (section, key) in SECRETS.items():
+        config[section][key] = secrets.get(name)
     return config
 
-config = load_config_from_key_vault()
+with timed("config"):
+    config = load_config_from_key_vault()
@@ -1,43 +1,40 @@
 from fastapi import HTTPException
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError
 from models import Policyholder
-from database import container
-from typing import List, Optional
-from faker import Faker
+from database import get_async_container
+from clients import get_blob_container_client
+from typing import AsyncIterator, List, Optional, Tuple
 from logger import logger
+from analysis_columns import normalize_claim_amount, rows_to_columns, ANALYSIS_COLUMNS
+import asyncio
+import base64
 import uuid
 import random
 import os
-import markovify
-import numpy as np
-from claims_data_generator import generate_claim_note
+from azure.core.exceptions import ResourceNotFoundError
+from bulk_operations import bulk_concurrency, field_patch_operations, new_summary, run_with_throttle_retry
+from rollup import apply_rollup_delta, apply_rollup_changes
+from name_index import name_index
+from entity_cache import entity_cache
 
-fake = Faker()
 # Directory for claim notes
 CLAIM_NOTES_DIR = 'claim_notes'
 os.makedirs(CLAIM_NOTES_DIR, exist_ok=True)
 
 # Function to generate and add claim notes to Cosmos DB
-def generate_and_add_claim_notes_to_db(number_of_notes: int, policyholder_id: str):
-    claim_notes = generate_claim_notes(number_of_notes, policyholder_id)
-    for note in claim_notes:
-        # Create a unique ID for each claim note
-        claim_note_id = str(uuid.uuid4())
-        claim_note_item = {
-            "id": claim_note_id,
-            "policyholder_id": policyholder_id,
-            "textfile": note,  # Store the note text to cosmos instead because its better for text file data
-            # Additional metadata eventually if there is time
-        }
-        container.upsert_item(claim_note_item)
-    print("Claim notes added to Cosmos DB")
+async def generate_and_add_claim_notes_to_db(number_of_notes: int, policyholder_id: str):
+    # The generator pulls in Faker, markovify and numpy, only load it once notes are actually generated
+    from claims_data_generator import generate_and_ingest_claim_notes
 
+    # Notes are stored in cosmos as "textfile" because its better for text file data
+    _, summary = await generate_and_ingest_claim_notes(number_of_notes, [policyholder_id])
+    print("Claim notes added to Cosmos DB")
+    return summary
 
-def generate_claim_notes(number_of_notes: int, policyholder_id: str):
-    return generate_and_add_claim_notes_to_db(number_of_notes, policyholder_id)
 
-def get_all_claims():
-    query = "SELECT * FROM c WHERE IS_DEFINED(c.policyholder_id) AND IS_DEFINED(c.analysis)"
-    return list(container.query_items(query=query, enable_cross_partition_query=True))
+async def generate_claim_notes(number_of_notes: int, policyholder_id: str):
+    return await generate_and_add_claim_notes_to_db(number_of_notes, policyholder_id)
 
 # Function to save a claim note to a file
 def save_claim_note_file(claim_note: str, file_name: str):
@@ -58,7 +55,7 @@ def get_claim_note_file_local(file_name: str):
     return None
 
 def get_claim_note_file(file_name: str):
-    blob_client = container.get_blob_client(file_name)
+    blob_client = get_blob_container_client().get_blob_client(file_name)
     try:
         download_stream = blob_client.download_blob()
         return download_stream.readall().decode("utf-8")
@@ -74,6 +71,8 @@ def get_claim_note_file(file_name: str):
 
 
 def generate_policyholder_data():
+    from claims_data_generator import fake
+
     return {
         "id": str(uuid.uuid4()),
         "name": fake.name(),
@@ -82,96 +81,368 @@ def generate_policyholder_data():
         "policy_amount": round(random.uniform(90000, 900000), 2)
     }
 
-def add_policyholder_to_db(policyholder_data: dict):
-    container.upsert_item(policyholder_data)
+async def add_policyholder_to_db(policyholder_data: dict):
+    created_item = await get_async_container().upsert_item(policyholder_data)
+    name_index.upsert(created_item)
+    entity_cache.put(created_item)
 
 
-def create_policyholder(policyholder: Policyholder):
-    created_item = container.upsert_item(policyholder.dict())
+async def create_policyholder(policyholder: Policyholder):
+    created_item = await get_async_container().upsert_item(policyholder.dict())
+    name_index.upsert(created_item)
+    entity_cache.put(created_item)
     return {
         "message": "Policyholder created",
         "policyholder": created_item
     }
 
-def get_policyholders():
-    query = "SELECT * FROM c WHERE NOT IS_DEFINED(c.policyholder_id)"
-    ret = list(container.query_items(query=query, enable_cross_partition_query=True))
+# Internal documents (like the analytics rollup) carry a doc_type and are not policyholders
+POLICYHOLDERS_QUERY = "SELECT * FROM c WHERE NOT IS_DEFINED(c.policyholder_id) AND NOT IS_DEFINED(c.doc_type)"
+
+async def get_policyholders():
+    ret = [item async for item in get_async_container().query_items(query=POLICYHOLDERS_QUERY)]
     logger.info(ret)
     return ret
 
 
-def get_policyholder(id: str):
+async def get_policyholder(id: str):
     try:
-        item = container.read_item(item=id, partition_key=id)
+        item = await entity_cache.read(get_async_container(), id)
         return item
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Policyholder with id {id} not found")
 
-def update_policyholder(id: str, policyholder_data: dict):
+async def update_policyholder(id: str, policyholder_data: dict):
     policyholder_data['id'] = id
-    updated_item = container.upsert_item(policyholder_data)
+    updated_item = await get_async_container().upsert_item(policyholder_data)
+    name_index.upsert(updated_item)
+    entity_cache.put(updated_item)
     return {
         "message": "Policyholder updated",
         "policyholder": updated_item
     }
 
-def delete_policyholder(id: str):
+async def delete_policyholder(id: str):
     try:
-        container.delete_item(id, partition_key=id)
+        entity_cache.invalidate(id)
+        await get_async_container().delete_item(id, partition_key=id)
+        name_index.remove(id)
         return {"message": "Policyholder deleted"}
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Policyholder with id {id} not found")
 
-def search_policyholders(name: str):
-    query = "SELECT * FROM c WHERE CONTAINS(LOWER(c.name), LOWER(@name))"
+# Served from the in-memory name index, Cosmos is only scanned while the index is still building
+async def search_policyholders(name: str, limit: Optional[int] = None):
+    if name_index.ready:
+        return name_index.search(name, limit)
+    query = POLICYHOLDERS_QUERY + " AND CONTAINS(LOWER(c.name), LOWER(@name))"
     parameters = [{"name": "@name", "value": name.lower()}]
-    ret = list(container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
+    if limit:
+        query += " OFFSET 0 LIMIT @limit"
+        parameters.append({"name": "@limit", "value": limit})
+    ret = [item async for item in get_async_container().query_items(query=query, parameters=parameters)]
     logger.info(ret)
     return ret
 
-def calculate_average_policy_amount():
-    policyholders = get_policyholders()
-    if not policyholders:
+# Runs an aggregate like SELECT VALUE COUNT(1) and returns the single value (None when nothing matched)
+async def query_value(query: str, parameters: Optional[list] = None):
+    values = [value async for value in get_async_container().query_items(query=query, parameters=parameters)]
+    return values[0] if values else None
+
+# Cosmos only computes GROUP BY, or several aggregates in one SELECT, inside a single partition and the
+# Python SDK won't merge them across partitions. Such queries go out once per feed range (in parallel),
+# the caller adds up the partial rows.
+async def query_per_feed_range(query: str, parameters: Optional[list] = None):
+    container = get_async_container()
+    feed_ranges = [feed_range async for feed_range in container.read_feed_ranges()]
+
+    async def run(feed_range):
+        return [row async for row in container.query_items(query=query, parameters=parameters, feed_range=feed_range)]
+
+    return [row for rows in await asyncio.gather(*(run(feed_range) for feed_range in feed_ranges)) for row in rows]
+
+# Amounts saved as strings ("$1,200.00") can't be summed by Cosmos, only those rows come back to Python
+async def sum_string_amounts(query: str, parameters: Optional[list] = None):
+    count, total = 0, 0.0
+    async for amount in get_async_container().query_items(query=query, parameters=parameters):
+        try:
+            total += normalize_claim_amount(amount)
+            count += 1
+        except ValueError as e:
+            logger.error(f"Error processing amount {amount}: {e}")
+    return count, total
+
+async def calculate_average_policy_amount():
+    where = "NOT IS_DEFINED(c.policyholder_id) AND NOT IS_DEFINED(c.doc_type)"
+    partials, (string_count, string_total) = await asyncio.gather(
+        query_per_feed_range(
+            "SELECT COUNT(1) AS claim_count, SUM(c.policy_amount) AS amount_sum FROM c "
+            f"WHERE {where} AND IS_NUMBER(c.policy_amount)"
+        ),
+        sum_string_amounts(f"SELECT VALUE c.policy_amount FROM c WHERE {where} AND IS_STRING(c.policy_amount)"),
+    )
+    count = sum(row.get("claim_count", 0) for row in partials) + string_count
+    if not count:
         return 0
-    total = sum(p['policy_amount'] for p in policyholders)
-    return total / len(policyholders)
+    return (sum(row.get("amount_sum", 0) for row in partials) + string_total) / count
+
+# Claims query, optionally limited to some policyholders. An array parameter only works with ARRAY_CONTAINS, not IN
+def build_claims_query(policyholder_ids: Optional[List[str]] = None):
+    if policyholder_ids:
+        query = "SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.policyholder_id)"
+        return query, [{"name": "@ids", "value": policyholder_ids}]
+    return "SELECT * FROM c WHERE IS_DEFINED(c.policyholder_id)", None
 
 # Fetch claims for specific policyholder IDs
-def get_claims_for_policyholders(ids: List[str]):
-    query = "SELECT * FROM c WHERE c.policyholder_id IN (@ids)"
-    parameters = [{"name": "@ids", "value": ids}]
-    return list(container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
+async def get_claims_for_policyholders(ids: List[str]):
+    query, parameters = build_claims_query(ids)
+    return [item async for item in get_async_container().query_items(query=query, parameters=parameters)]
 
 # Fetch all claims
-def get_all_claims():
-    query = "SELECT * FROM c WHERE IS_DEFINED(c.policyholder_id)"
-    return list(container.query_items(query=query, enable_cross_partition_query=True))
+async def get_all_claims():
+    query, parameters = build_claims_query()
+    return [item async for item in get_async_container().query_items(query=query, parameters=parameters)]
+
+# Cosmos continuation tokens are JSON, wrap them in urlsafe base64 so clients can pass them back as a query param
+def encode_continuation(token: Optional[str]):
+    if not token:
+        return None
+    return base64.urlsafe_b64encode(token.encode("utf-8")).decode("ascii")
+
+def decode_continuation(continuation: Optional[str]):
+    if not continuation:
+        return None
+    try:
+        return base64.urlsafe_b64decode(continuation.encode("ascii")).decode("utf-8")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid continuation token")
+
+# Fetch a single page of results plus the continuation to request the next one (None on the last page)
+async def query_page(query: str, parameters: Optional[list], page_size: int, continuation: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    pager = get_async_container().query_items(
+        query=query, parameters=parameters, max_item_count=page_size
+    ).by_page(decode_continuation(continuation))
+    async for page in pager:
+        items = [item async for item in page]
+        return items, encode_continuation(pager.continuation_token)
+    return [], None
+
+# Yield query results one Cosmos page at a time so memory stays flat however large the result set is
+async def stream_query_pages(query: str, parameters: Optional[list], page_size: int) -> AsyncIterator[list]:
+    pager = get_async_container().query_items(
+        query=query, parameters=parameters, max_item_count=page_size
+    ).by_page()
+    async for page in pager:
+        yield [item async for item in page]
+
+async def get_claims_page(page_size: int, continuation: Optional[str] = None, policyholder_ids: Optional[List[str]] = None):
+    query, parameters = build_claims_query(policyholder_ids)
+    return await query_page(query, parameters, page_size, continuation)
+
+def stream_claims(page_size: int, policyholder_ids: Optional[List[str]] = None):
+    query, parameters = build_claims_query(policyholder_ids)
+    return stream_query_pages(query, parameters, page_size)
+
+async def get_policyholders_page(page_size: int, continuation: Optional[str] = None):
+    return await query_page(POLICYHOLDERS_QUERY, None, page_size, continuation)
+
+def stream_policyholders(page_size: int):
+    return stream_query_pages(POLICYHOLDERS_QUERY, None, page_size)
+
+ANALYSIS_SOURCES = ("textfile_analysis", "gptmsg_analysis")
+
+# Per-category claim counts and average amounts for one analysis source, aggregated inside Cosmos.
+# One GROUP BY query per feed range returns a count and a sum per category, so the work stays at
+# O(partitions x categories) rows instead of O(claims).
+async def aggregate_claim_categories(source: str):
+    if source not in ANALYSIS_SOURCES:
+        raise ValueError(f"Unknown analysis source {source}")
+    category = f'c.analysis.{source}["Claims Category"]'
+    amount = f'c.analysis.{source}["Claim Amount"]'
+    base_where = f'IS_DEFINED(c.policyholder_id) AND IS_STRING({category}) AND {category} != ""'
+
+    category_counts = {}
+    category_sums = {}
+    grouped = await query_per_feed_range(
+        f"SELECT {category} AS category, COUNT(1) AS claim_count, SUM({amount}) AS amount_sum FROM c "
+        f"WHERE {base_where} AND IS_NUMBER({amount}) GROUP BY {category}"
+    )
+    for row in grouped:
+        category_counts[row["category"]] = category_counts.get(row["category"], 0) + row["claim_count"]
+        category_sums[row["category"]] = category_sums.get(row["category"], 0) + row.get("amount_sum", 0)
+
+    # Only string amounts are projected back (category and amount, never the claim text)
+    string_rows = get_async_container().query_items(
+        query=f"SELECT {category} AS category, {amount} AS amount FROM c WHERE {base_where} AND IS_STRING({amount})"
+    )
+    async for row in string_rows:
+        try:
+            normalized_amount = normalize_claim_amount(row["amount"])
+        except ValueError as e:
+            logger.error(f"Error processing data: {e}")
+            continue
+        category_counts[row["category"]] = category_counts.get(row["category"], 0) + 1
+        category_sums[row["category"]] = category_sums.get(row["category"], 0) + normalized_amount
+
+    category_averages = {cat: category_sums[cat] / category_counts[cat] for cat in category_counts}
+    return category_counts, category_averages
+
+# Only the fields the analytics engine needs, already named like ANALYSIS_COLUMNS
+CLAIM_ANALYSIS_FIELDS_QUERY = (
+    'SELECT c.id, '
+    'c.analysis.textfile_analysis["Claims Category"] AS textfile_category, '
+    'c.analysis.textfile_analysis["Claim Amount"] AS textfile_amount, '
+    'c.analysis.gptmsg_analysis["Claims Category"] AS gptmsg_category, '
+    'c.analysis.gptmsg_analysis["Claim Amount"] AS gptmsg_amount '
+    'FROM c WHERE IS_DEFINED(c.policyholder_id) AND IS_DEFINED(c.analysis)'
+)
+
+# Column lists for analysis.build_claims_frame, filled page by page so no claim documents are kept around
+async def get_claim_analysis_columns(page_size: int = 1000):
+    columns = {column: [] for column in ANALYSIS_COLUMNS}
+    async for page in stream_query_pages(CLAIM_ANALYSIS_FIELDS_QUERY, None, page_size):
+        for column, values in rows_to_columns(page).items():
+            columns[column].extend(values)
+    return columns
 
 #gets claim by claim id
-def get_claim_by_id(claim_id: str):
+async def get_claim_by_id(claim_id: str):
     try:
-        return container.read_item(item=claim_id, partition_key=claim_id)
+        return await entity_cache.read(get_async_container(), claim_id)
     except Exception as e:
         return None
 
-def update_claim_with_gptmsg(claim_id: str, gptmsg: str):
-    claim = get_claim_by_id(claim_id)
-    if claim:
-        claim['gptmsg'] = gptmsg
-        container.upsert_item(claim)
+# Sets fields on a claim in one round-trip instead of read + full upsert. With an etag the write
+# only goes through if the claim is unchanged since it was read (412 otherwise).
+# Returns the updated claim, or None when the claim doesn't exist.
+async def patch_claim_fields(claim_id: str, fields: dict, etag: Optional[str] = None):
+    options = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+    try:
+        claim = await get_async_container().patch_item(
+            item=claim_id, partition_key=claim_id, patch_operations=field_patch_operations(fields), **options
+        )
+    except CosmosResourceNotFoundError:
+        entity_cache.invalidate(claim_id)
+        return None
+    except CosmosHttpResponseError as e:
+        if e.status_code == 412:
+            entity_cache.invalidate(claim_id)
+            raise HTTPException(status_code=412, detail=f"Claim {claim_id} was modified concurrently")
+        raise
+    entity_cache.put(claim)
+    return claim
+
+async def update_claim_with_gptmsg(claim_id: str, gptmsg: str, etag: Optional[str] = None):
+    return await patch_claim_fields(claim_id, {"gptmsg": gptmsg}, etag)
 
-def delete_claim(claim_id: str):
+async def delete_claim(claim_id: str):
+    # Read first so the claim's analysis can be taken back out of the analytics rollup
+    claim = await get_claim_by_id(claim_id)
+    entity_cache.invalidate(claim_id)
     try:
-        container.delete_item(claim_id, partition_key=claim_id)
+        await get_async_container().delete_item(claim_id, partition_key=claim_id)
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Claim with id {claim_id} not found")
+    await apply_rollup_delta(old_analysis=(claim or {}).get('analysis'), claims_delta=-1)
+
+# Many claims in one batched point read, returns {id: claim} for the ones that exist
+async def get_claims_by_ids(claim_ids: List[str]):
+    claims = {}
+    if claim_ids:
+        for claim in await get_async_container().read_items([(claim_id, claim_id) for claim_id in claim_ids]):
+            entity_cache.put(claim)
+            claims[claim["id"]] = claim
+    return claims
+
+async def delete_blob_if_exists(blob_container, blob_name: str):
+    # blob_index imports this module for its paging helpers, import lazily to avoid the cycle
+    from blob_index import blob_index
+
+    try:
+        await asyncio.to_thread(blob_container.delete_blob, blob_name)
+        status = "deleted"
+    except ResourceNotFoundError:
+        status = "not_found"
+    # Gone either way, GET /claim-notes shouldn't list it until the next rebuild
+    blob_index.remove(blob_name)
+    return status
+
+# Deletes claims concurrently (bounded, 429s retried with backoff) and reports every id as
+# "deleted", "not_found" or "failed". One id failing doesn't stop the others.
+# With blob_container set, each deleted claim's file_blob_name is removed from storage too.
+async def bulk_delete_claims(claim_ids: List[str], blob_container=None, concurrency: Optional[int] = None):
+    claim_ids = list(dict.fromkeys(claim_ids))
+    # One batched read up front for the rollup delta and blob names instead of a read per delete
+    claims = await get_claims_by_ids(claim_ids)
+    summary = new_summary()
+    semaphore = asyncio.Semaphore(concurrency or bulk_concurrency)
+    results, errors, blobs = {}, {}, {}
+
+    async def delete_one(claim_id: str):
+        async with semaphore:
+            entity_cache.invalidate(claim_id)
+            try:
+                await run_with_throttle_retry(
+                    lambda: get_async_container().delete_item(claim_id, partition_key=claim_id), summary
+                )
+                results[claim_id] = "deleted"
+            except CosmosResourceNotFoundError:
+                results[claim_id] = "not_found"
+                return
+            except Exception as e:
+                results[claim_id] = "failed"
+                errors[claim_id] = str(e)
+                return
+            blob_name = claims.get(claim_id, {}).get("file_blob_name")
+            if blob_container is not None and blob_name:
+                try:
+                    blobs[claim_id] = await delete_blob_if_exists(blob_container, blob_name)
+                except Exception as e:
+                    blobs[claim_id] = "failed"
+                    errors[claim_id] = f"Claim deleted but its blob {blob_name} was not: {str(e)}"
+
+    await asyncio.gather(*(delete_one(claim_id) for claim_id in claim_ids))
+    deleted = [claim_id for claim_id in claim_ids if results[claim_id] == "deleted"]
+    await apply_rollup_changes(
+        [(claims.get(claim_id, {}).get("analysis"), None) for claim_id in deleted], claims_delta=-len(deleted)
+    )
+    response = {
+        "results": {claim_id: results[claim_id] for claim_id in claim_ids},
+        "deleted": len(deleted),
+        "not_found": sum(1 for status in results.values() if status == "not_found"),
+        "failed": sum(1 for status in results.values() if status == "failed"),
+        "throttled": summary["throttled"],
+        "errors": errors,
+    }
+    if blob_container is not None:
+        response["blobs"] = blobs
+    return response
+
+# A policyholder and all of their claims. The policyholder is only removed once every claim is gone,
+# so a partial failure can simply be retried.
+async def delete_policyholder_with_claims(id: str, blob_container=None):
+    query = "SELECT VALUE c.id FROM c WHERE c.policyholder_id = @id"
+    claim_ids = [
+        claim_id async for claim_id in get_async_container().query_items(query=query, parameters=[{"name": "@id", "value": id}])
+    ]
+    claims = await bulk_delete_claims(claim_ids, blob_container)
+    if claims["failed"]:
+        return {"message": "Some claims could not be deleted, policyholder kept", "policyholder": "kept", "claims": claims}
+    entity_cache.invalidate(id)
+    try:
+        await get_async_container().delete_item(id, partition_key=id)
+        status = "deleted"
+    except CosmosResourceNotFoundError:
+        status = "not_found"
+    name_index.remove(id)
+    return {"message": "Policyholder deleted" if status == "deleted" else "Policyholder not found",
+            "policyholder": status, "claims": claims}
 
-def update_claim_with_file_blob_name(claim_id: str, blob_name: str):
+async def update_claim_with_file_blob_name(claim_id: str, blob_name: str, etag: Optional[str] = None):
     try:
         #other tenant didn't like blobs but I'm ok in mine it looks like
-        claim_item = get_claim_by_id(claim_id)
-        if claim_item:
-            claim_item['file_blob_name'] = blob_name
-            container.upsert_item(claim_item)
+        return await patch_claim_fields(claim_id, {"file_blob_name": blob_name}, etag)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating claim {claim_id}")
\ No newline at end of file
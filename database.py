@@ -1,7 +1,44 @@
-from azure.cosmos import CosmosClient
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
 from config_loader import config  # Import the config module
+from metrics import cosmos_client_hooks
+from repository import local_async_container, storage_backend
+from startup_timing import timed
 
 cosmosdb_config = config['cosmos_db']
-client = CosmosClient(cosmosdb_config['url'], credential=cosmosdb_config['key_one'])
-database = client.get_database_client(cosmosdb_config['database_name'])
-container = database.get_container_client(cosmosdb_config['container_name'])
+# The sync client used by the claims data generator scripts lives in clients.py and is built on first use
+
+# Async client for the API, opened once at startup by the FastAPI lifespan hook
+async_client = None
+async_container = None
+
+def _build_async_container():
+    global async_client, async_container
+    if storage_backend == "local":
+        # The local container doubles as its own client (__aenter__/close)
+        async_client = async_container = local_async_container()
+        return
+    with timed("clients: cosmos"):
+        async_client = AsyncCosmosClient(cosmosdb_config['url'], credential=cosmosdb_config['key_one'], **cosmos_client_hooks())
+        async_database = async_client.get_database_client(cosmosdb_config['database_name'])
+        async_container = async_database.get_container_client(cosmosdb_config['container_name'])
+
+async def open_async_container():
+    if async_client is None:
+        _build_async_container()
+        # Warm up the connection pool and account metadata before serving traffic
+        with timed("clients: cosmos warm-up"):
+            await async_client.__aenter__()
+    return async_container
+
+async def close_async_container():
+    global async_client, async_container
+    if async_client is not None:
+        await async_client.close()
+    async_client = None
+    async_container = None
+
+def get_async_container():
+    # Outside the app lifespan (scripts, workers) the client is built on first use
+    if async_container is None:
+        _build_async_container()
+    return async_container
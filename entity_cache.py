@@ -0,0 +1,98 @@
+import copy
+import os
+import time
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from ttl_cache import TTLCache, SingleFlight
+
+# Read-through cache for point reads of policyholders and claims (same container, ids are unique).
+# Within entity_cache_fresh_seconds a cached document is served as is; after that it is revalidated
+# with an If-None-Match on its _etag, which costs no document transfer when nothing changed.
+entity_cache_enabled = os.getenv("ENTITY_CACHE_ENABLED", "true").lower() == "true"
+entity_cache_max_entries = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "10000"))
+entity_cache_fresh_seconds = float(os.getenv("ENTITY_CACHE_FRESH_SECONDS", "30"))
+# How long a document stays around for revalidation before it has to be read again in full
+entity_cache_ttl = float(os.getenv("ENTITY_CACHE_TTL", "600"))
+
+
+class EntityCache:
+    def __init__(self, maxsize: int, ttl: float, fresh_seconds: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.fresh_seconds = fresh_seconds
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def put(self, doc: dict):
+        if entity_cache_enabled and doc and "id" in doc:
+            self.entries.set(doc["id"], (copy.deepcopy(doc), time.monotonic() + self.fresh_seconds))
+
+    def invalidate(self, id: str):
+        self.invalidations += 1
+        self.entries.pop(id)
+
+    def clear(self):
+        self.entries.clear()
+
+    # Callers get their own copy, several of them modify the document before writing it back
+    async def read(self, container, id: str):
+        if not entity_cache_enabled:
+            return await container.read_item(item=id, partition_key=id)
+        entry = self.entries.get(id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+        # Concurrent readers of the same id share one Cosmos call
+        doc = await self.flight.do(id, lambda: self._load(container, id, entry))
+        return copy.deepcopy(doc)
+
+    async def _load(self, container, id: str, entry):
+        try:
+            if entry is not None and entry[0].get("_etag"):
+                cached = entry[0]
+                doc = await container.read_item(
+                    item=id, partition_key=id, etag=cached["_etag"], match_condition=MatchConditions.IfModified
+                )
+                # A 304 comes back without a body, the cached copy is still current
+                if not doc or "id" not in doc:
+                    self.revalidated += 1
+                    self.put(cached)
+                    return cached
+                self.misses += 1
+            else:
+                self.misses += 1
+                doc = await container.read_item(item=id, partition_key=id)
+        except CosmosResourceNotFoundError:
+            self.entries.pop(id)
+            raise
+        self.put(doc)
+        return doc
+
+    # Same lookup for the sync client used by the data generator, no revalidation or single-flight
+    def read_sync(self, container, id: str):
+        entry = self.entries.get(id) if entity_cache_enabled else None
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+        self.misses += 1
+        doc = container.read_item(item=id, partition_key=id)
+        self.put(doc)
+        return doc
+
+    def stats(self):
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "enabled": entity_cache_enabled,
+            "entries": len(self.entries),
+            "maxsize": self.entries.maxsize,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+entity_cache = EntityCache(entity_cache_max_entries, entity_cache_ttl, entity_cache_fresh_seconds)
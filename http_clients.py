@@ -0,0 +1,67 @@
+import os
+from typing import Optional
+import httpx
+from logger import logger
+
+# Connection pool settings for the upstream clients, tune through the environment
+max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 needs the optional h2 package (pip install httpx[http2]) and only applies to TLS upstreams
+http2_enabled = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+# The local LLM server can take a very long time on big prompts
+llm_timeout = httpx.Timeout(6000.0, connect=6000.0)
+graph_timeout = httpx.Timeout(float(os.getenv("GRAPH_TIMEOUT", "10")))
+
+# One client per upstream for the lifetime of the app, opened and closed by the FastAPI lifespan hook
+llm_client: Optional[httpx.AsyncClient] = None
+graph_client: Optional[httpx.AsyncClient] = None  # Microsoft Graph and the Entra ID token endpoint
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("HTTP2_ENABLED is set but the h2 package is not installed, falling back to HTTP/1.1")
+        return False
+
+
+def _build_client(timeout: httpx.Timeout):
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.AsyncClient(timeout=timeout, limits=limits, http2=http2_enabled and _http2_available())
+
+
+def open_http_clients():
+    global llm_client, graph_client
+    if llm_client is None:
+        llm_client = _build_client(llm_timeout)
+    if graph_client is None:
+        graph_client = _build_client(graph_timeout)
+
+
+async def close_http_clients():
+    global llm_client, graph_client
+    for client in (llm_client, graph_client):
+        if client is not None:
+            await client.aclose()
+    llm_client = None
+    graph_client = None
+
+
+# Getters fall back to opening the clients so scripts outside the app lifespan still work
+def get_llm_client():
+    if llm_client is None:
+        open_http_clients()
+    return llm_client
+
+
+def get_graph_client():
+    if graph_client is None:
+        open_http_clients()
+    return graph_client
@@ -0,0 +1,65 @@
+# Standalone job worker for JOB_QUEUE_BACKEND=sqlite, run one or more next to the API:
+#   JOB_QUEUE_BACKEND=sqlite python job_worker.py
+import asyncio
+import os
+import socket
+import uuid
+from database import open_async_container, close_async_container
+from http_clients import open_http_clients, close_http_clients
+from jobs import SqliteJobQueue, TERMINAL_STATUSES, job_queue_path, job_lease_seconds, run_job
+from logger import logger
+
+# Seconds to wait before polling the queue again when it is empty
+poll_interval = float(os.getenv("JOB_WORKER_POLL_INTERVAL", "2"))
+
+
+async def keep_lease(queue: SqliteJobQueue, job_id: str, worker_id: str):
+    while True:
+        await asyncio.sleep(job_lease_seconds / 3)
+        await queue.heartbeat(job_id, worker_id)
+
+
+# Runs a job this worker leased from the queue, the row is only acked once the job is finished
+async def run_claimed_job(queue: SqliteJobQueue, job_id: str, worker_id: str):
+    heartbeat = asyncio.create_task(keep_lease(queue, job_id, worker_id))
+    try:
+        status = await run_job(job_id)
+        if status is None or status in TERMINAL_STATUSES:
+            await queue.ack(job_id)
+        else:
+            # Another worker holds the job's lease in Cosmos (or took it over). The row stays leased
+            # and is picked up again once its lease runs out, until the job finishes or its owner dies.
+            logger.info(f"Job {job_id} is {status} under another worker, retrying it later")
+        return status
+    except Exception as e:
+        # Left leased, another worker retries it once the lease runs out
+        logger.error(f"Job worker {worker_id} error on {job_id}: {str(e)}")
+    finally:
+        heartbeat.cancel()
+
+
+async def work(queue: SqliteJobQueue, worker_id: str):
+    while True:
+        job_id = await queue.claim(worker_id)
+        if job_id is None:
+            await asyncio.sleep(poll_interval)
+            continue
+        await run_claimed_job(queue, job_id, worker_id)
+
+
+async def main():
+    worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    queue = SqliteJobQueue(job_queue_path, job_lease_seconds)
+    open_http_clients()
+    await open_async_container()
+    await queue.start()
+    logger.info(f"Job worker {worker_id} polling {job_queue_path}")
+    try:
+        await work(queue, worker_id)
+    finally:
+        await close_async_container()
+        await close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
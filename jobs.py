@@ -0,0 +1,534 @@
+import asyncio
+import datetime
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosResourceNotFoundError
+from fastapi import HTTPException
+from bulk_operations import bulk_upsert
+from claims_processing import llm_concurrency_limit, categorization_limits, analyze_single_claim, process_single_claim
+from crud import get_claim_by_id
+from database import get_async_container
+from llm_batcher import MicroBatcher
+from logger import logger
+
+# Long LLM batches run as jobs, the job document in Cosmos is the source of truth for progress.
+# It only holds counters, a cursor into the item list and the lease, so it stays small however big
+# the job is. The item ids are split over "job_items" documents written once at submission, and
+# every checkpoint writes the results of its items to one new "job_progress" document.
+# doc_type keeps all of them out of the policyholder and claim queries.
+JOB_DOC_TYPE = "job"
+JOB_ITEMS_DOC_TYPE = "job_items"
+JOB_PROGRESS_DOC_TYPE = "job_progress"
+JOB_KINDS = ("process-claims", "claims-analysis")
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# "inprocess" runs workers inside the API, "sqlite" only enqueues and job_worker.py does the work
+job_queue_backend = os.getenv("JOB_QUEUE_BACKEND", "inprocess").lower()
+job_workers = int(os.getenv("JOB_WORKERS", "2"))
+# Items processed between two progress writes to Cosmos, at most this much work is redone after a crash
+job_checkpoint_every = int(os.getenv("JOB_CHECKPOINT_EVERY", "25"))
+job_queue_path = os.getenv("JOB_QUEUE_PATH", "job_queue.sqlite3")
+# A worker that stops renewing its lease for this long loses its job to another worker
+job_lease_seconds = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Item ids per job_items document
+job_item_chunk_size = int(os.getenv("JOB_ITEM_CHUNK_SIZE", "1000"))
+# Failures kept on the job document for GET /jobs/{id}, the progress documents have all of them
+job_failures_shown = int(os.getenv("JOB_FAILURES_SHOWN", "100"))
+
+# Lease owners are unique per run_job call, a restarted process never mistakes a live lease for its own
+instance_id = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def items_doc_id(job_id: str, index: int):
+    return f"{job_id}-items-{index:06d}"
+
+
+def progress_doc_id(job_id: str, start: int):
+    return f"{job_id}-progress-{start:09d}"
+
+
+# The job document and the item list documents for a new job
+def new_job_documents(kind: str, item_ids: List[str], params: dict):
+    # Duplicate ids would be processed twice and break the progress counts
+    item_ids = list(dict.fromkeys(item_ids))
+    now = _now()
+    job = {
+        "id": f"job-{uuid.uuid4()}",
+        "doc_type": JOB_DOC_TYPE,
+        "kind": kind,
+        "status": "queued",
+        "params": params,
+        "total": len(item_ids),
+        "item_chunk_size": job_item_chunk_size,
+        "cursor": 0,
+        "completed": 0,
+        "failed": 0,
+        "failures": [],
+        "cancel_requested": False,
+        "owner": None,
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "error": None,
+    }
+    item_docs = [
+        {
+            "id": items_doc_id(job["id"], index),
+            "doc_type": JOB_ITEMS_DOC_TYPE,
+            "job_id": job["id"],
+            "item_ids": item_ids[start:start + job_item_chunk_size],
+        }
+        for index, start in enumerate(range(0, len(item_ids), job_item_chunk_size))
+    ]
+    return job, item_docs
+
+
+async def read_job(job_id: str):
+    try:
+        job = await get_async_container().read_item(item=job_id, partition_key=job_id)
+    except CosmosResourceNotFoundError:
+        return None
+    return job if job.get("doc_type") == JOB_DOC_TYPE else None
+
+
+# With etag set the patch fails with CosmosAccessConditionFailedError if the job changed since it was read
+async def update_job(job_id: str, etag: Optional[str] = None, **fields):
+    fields["updated_at"] = _now()
+    operations = [{"op": "set", "path": f"/{name}", "value": value} for name, value in fields.items()]
+    options = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+    return await get_async_container().patch_item(item=job_id, partition_key=job_id, patch_operations=operations, **options)
+
+
+# Progress as returned by GET /jobs/{id}
+def job_status(job: dict):
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "pending": job["total"] - job["completed"] - job["failed"],
+        "cancel_requested": job.get("cancel_requested", False),
+        "failures": job.get("failures", []),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "error": job.get("error"),
+    }
+
+
+# Item ids [start, start + count) of a job, read from the job_items documents that hold them
+async def read_job_item_ids(job: dict, start: int, count: int):
+    chunk_size = job["item_chunk_size"]
+    first, last = start // chunk_size, (start + count - 1) // chunk_size
+    doc_ids = [items_doc_id(job["id"], index) for index in range(first, last + 1)]
+    docs = {doc["id"]: doc for doc in await get_async_container().read_items([(doc_id, doc_id) for doc_id in doc_ids])}
+    item_ids = []
+    for doc_id in doc_ids:
+        if doc_id not in docs:
+            raise RuntimeError(f"Item list {doc_id} of job {job['id']} is missing")
+        item_ids.extend(docs[doc_id]["item_ids"])
+    offset = start - first * chunk_size
+    return item_ids[offset:offset + count]
+
+
+# Ids [offset, offset + limit) of the completed items, in the order they were checkpointed
+async def read_completed_ids(job: dict, offset: int, limit: int):
+    query = "SELECT c.id, c.start, c.completed_count FROM c WHERE c.doc_type = @doc_type AND c.job_id = @job_id"
+    parameters = [{"name": "@doc_type", "value": JOB_PROGRESS_DOC_TYPE}, {"name": "@job_id", "value": job["id"]}]
+    entries = [entry async for entry in get_async_container().query_items(query=query, parameters=parameters)]
+    # A progress document at or past the cursor belongs to a checkpoint that is being redone after a crash
+    entries = sorted((entry for entry in entries if entry["start"] < job.get("cursor", 0)), key=lambda entry: entry["start"])
+    # Only the progress documents that overlap the requested page are read
+    needed, skipped, collected = [], 0, 0
+    for entry in entries:
+        if collected == 0 and skipped + entry["completed_count"] <= offset:
+            skipped += entry["completed_count"]
+            continue
+        needed.append(entry["id"])
+        collected += entry["completed_count"]
+        if skipped + collected >= offset + limit:
+            break
+    completed_ids = []
+    if needed:
+        docs = {doc["id"]: doc for doc in await get_async_container().read_items([(doc_id, doc_id) for doc_id in needed])}
+        for doc_id in needed:
+            completed_ids.extend(docs.get(doc_id, {}).get("completed_ids", []))
+    return completed_ids[offset - skipped:offset - skipped + limit]
+
+
+# Results live on the claims themselves (gptmsg / analysis), read back the ones finished so far
+async def job_results(job: dict, offset: int = 0, limit: int = 100):
+    ids = await read_completed_ids(job, offset, limit)
+    field = "gptmsg" if job["kind"] == "process-claims" else "analysis"
+    results = []
+    if ids:
+        query = f"SELECT c.id, c.{field} FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+        by_id = {
+            item["id"]: item.get(field)
+            async for item in get_async_container().query_items(query=query, parameters=[{"name": "@ids", "value": ids}])
+        }
+        results = [{"id": item_id, field: by_id.get(item_id)} for item_id in ids]
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "offset": offset,
+        "total_completed": job["completed"],
+        "results": results,
+    }
+
+
+# One item of a job, returns None on success or the error message
+async def run_job_item(job: dict, item_id: str, semaphore: asyncio.Semaphore, batcher: Optional[MicroBatcher] = None):
+    params = job.get("params", {})
+    bypass_cache = params.get("bypassCache", False)
+    try:
+        if job["kind"] == "process-claims":
+            async with semaphore:
+                gpt_response = await process_single_claim(item_id, bypass_cache)
+            return None if gpt_response else "Claim has no textfile or the LLM returned nothing"
+        claim = await get_claim_by_id(item_id)
+        if claim is None:
+            return "Claim not found"
+        result = await analyze_single_claim(claim, params.get("betterPrompt", False), semaphore, bypass_cache, batcher)
+        return result.get("error")
+    except Exception as e:
+        # Includes failed writebacks, the item is recorded as failed instead of completed
+        logger.error(f"Job {job['id']} item {item_id} failed: {str(e)}")
+        return str(e)
+
+
+class JobLeaseLost(Exception):
+    pass
+
+
+# Ownership of a running job. Every write to the job document is conditioned on the etag of the last
+# version this worker saw; when it fails the document is re-read, and if another worker has taken
+# the lease (ours expired) this one stops.
+class JobLease:
+    # Writes from others (cancel_job) are re-read and retried, a few in a row is already unusual
+    update_attempts = 5
+
+    def __init__(self, job: dict, owner: str):
+        self.job = job
+        self.owner = owner
+        self._lock = asyncio.Lock()
+
+    async def update(self, **fields):
+        fields.setdefault("lease_until", time.time() + job_lease_seconds)
+        async with self._lock:
+            for _ in range(self.update_attempts):
+                if self.job.get("owner") != self.owner:
+                    raise JobLeaseLost(f"Job {self.job.get('id')} is now owned by {self.job.get('owner')}")
+                try:
+                    self.job = await update_job(self.job["id"], etag=self.job["_etag"], **fields)
+                    return self.job
+                except CosmosAccessConditionFailedError:
+                    self.job = await read_job(self.job["id"]) or {}
+            raise JobLeaseLost(f"Job {self.job.get('id')} kept changing, giving up the lease")
+
+    async def release(self, **fields):
+        return await self.update(owner=None, lease_until=None, **fields)
+
+    async def keep_alive(self):
+        while True:
+            await asyncio.sleep(job_lease_seconds / 3)
+            try:
+                await self.update()
+            except JobLeaseLost:
+                return
+            except Exception as e:
+                logger.error(f"Renewing the lease on job {self.job.get('id')} failed: {str(e)}")
+
+
+# Takes the lease on a job that is queued, or running under a lease nobody renewed in time.
+# Returns None when the job is finished or another worker holds it.
+async def claim_job(job_id: str, owner: str):
+    job = await read_job(job_id)
+    if job is None:
+        logger.error(f"Job {job_id} not found")
+        return None
+    if job["status"] in TERMINAL_STATUSES:
+        return None
+    if job.get("owner") and (job.get("lease_until") or 0) > time.time():
+        logger.info(f"Job {job_id} is leased by {job['owner']}, leaving it")
+        return None
+    try:
+        job = await update_job(
+            job_id,
+            etag=job["_etag"],
+            owner=owner,
+            lease_until=time.time() + job_lease_seconds,
+            status="running",
+            started_at=job.get("started_at") or _now(),
+        )
+    except CosmosAccessConditionFailedError:
+        logger.info(f"Job {job_id} was claimed by another worker")
+        return None
+    return JobLease(job, owner)
+
+
+# Runs a job from its last checkpoint. Safe to call again after a crash, finished items are skipped.
+# Returns the job's status once this call is done with it, None if the job doesn't exist. A status
+# outside TERMINAL_STATUSES means the job still has to run (another worker holds it or took it over).
+async def run_job(job_id: str, cancel_event: Optional[asyncio.Event] = None):
+    lease = await claim_job(job_id, f"{instance_id}-{uuid.uuid4().hex[:8]}")
+    if lease is None:
+        job = await read_job(job_id)
+        return job["status"] if job else None
+    job = lease.job
+    concurrency = job.get("params", {}).get("concurrency")
+    # Elaboration requests go out one by one, categorization notes are micro-batched
+    if job["kind"] == "process-claims":
+        semaphore, batcher = asyncio.Semaphore(max(int(concurrency or llm_concurrency_limit), 1)), None
+    else:
+        semaphore, batcher = categorization_limits(concurrency)
+    cursor, total = job.get("cursor", 0), job["total"]
+    logger.info(f"Job {job_id} running, {total - cursor} of {total} items left")
+    heartbeat = asyncio.create_task(lease.keep_alive())
+    try:
+        while cursor < total:
+            # Cancellation is only checked between chunks so a checkpoint is never half written
+            if (cancel_event is not None and cancel_event.is_set()) or lease.job.get("cancel_requested"):
+                await lease.release(status="cancelled", finished_at=_now())
+                logger.info(f"Job {job_id} cancelled")
+                return lease.job["status"]
+            chunk = await read_job_item_ids(job, cursor, min(job_checkpoint_every, total - cursor))
+            errors = await asyncio.gather(*(run_job_item(job, item_id, semaphore, batcher) for item_id in chunk))
+            completed_ids = [item_id for item_id, error in zip(chunk, errors) if not error]
+            failures = [{"id": item_id, "error": error} for item_id, error in zip(chunk, errors) if error]
+            # Upsert, a crash before the cursor moved means this checkpoint is redone and rewritten
+            await get_async_container().upsert_item({
+                "id": progress_doc_id(job_id, cursor),
+                "doc_type": JOB_PROGRESS_DOC_TYPE,
+                "job_id": job_id,
+                "start": cursor,
+                "completed_ids": completed_ids,
+                "completed_count": len(completed_ids),
+                "failures": failures,
+            })
+            await lease.update(
+                cursor=cursor + len(chunk),
+                completed=lease.job["completed"] + len(completed_ids),
+                failed=lease.job["failed"] + len(failures),
+                failures=(lease.job.get("failures", []) + failures)[:job_failures_shown],
+            )
+            cursor += len(chunk)
+        await lease.release(status="completed", finished_at=_now())
+        logger.info(f"Job {job_id} finished, {lease.job['completed']} completed, {lease.job['failed']} failed")
+    except asyncio.CancelledError:
+        # Worker shutdown, the job stays "running" and is resumed from its last checkpoint once the lease runs out
+        raise
+    except JobLeaseLost as e:
+        logger.error(f"Stopping job {job_id}: {str(e)}")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        await lease.release(status="failed", finished_at=_now(), error=str(e))
+    finally:
+        heartbeat.cancel()
+    return lease.job.get("status")
+
+
+# Jobs nobody is working on: queued, or running under a lease that ran out (the worker is gone)
+async def resumable_job_ids():
+    query = (
+        "SELECT c.id, c.lease_until FROM c WHERE c.doc_type = @doc_type AND c.status IN ('queued', 'running') "
+        "ORDER BY c.created_at"
+    )
+    now = time.time()
+    return [
+        job["id"] async for job in get_async_container().query_items(
+            query=query, parameters=[{"name": "@doc_type", "value": JOB_DOC_TYPE}]
+        )
+        if (job.get("lease_until") or 0) < now
+    ]
+
+
+# asyncio.Queue plus worker tasks living in the API process
+class InProcessJobQueue:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        # Jobs queued or running in this process
+        self.cancel_events: Dict[str, asyncio.Event] = {}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._resume_abandoned_jobs()))
+
+    # At startup and then once per lease period, queues jobs left behind by a stopped process. Other
+    # instances may queue the same job, run_job's lease makes sure only one of them runs it.
+    async def _resume_abandoned_jobs(self):
+        while True:
+            try:
+                for job_id in await resumable_job_ids():
+                    if job_id not in self.cancel_events:
+                        await self.submit(job_id)
+            except Exception as e:
+                logger.error(f"Could not resume unfinished jobs: {str(e)}")
+            await asyncio.sleep(job_lease_seconds)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, job_id: str):
+        self.cancel_events.setdefault(job_id, asyncio.Event())
+        await self.queue.put(job_id)
+
+    async def cancel(self, job_id: str):
+        event = self.cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await run_job(job_id, self.cancel_events.get(job_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error on {job_id}: {str(e)}")
+            finally:
+                self.cancel_events.pop(job_id, None)
+                self.queue.task_done()
+
+
+# Local file queue shared by the API (enqueue) and job_worker.py processes (lease, heartbeat, ack).
+# Cancellation goes through the job document, workers see cancel_requested at their next checkpoint.
+class SqliteJobQueue:
+    def __init__(self, path: str, lease_seconds: float):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_queue ("
+                "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, enqueued_at REAL NOT NULL, "
+                "leased_by TEXT, lease_until REAL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def _enqueue(self, job_id: str):
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR IGNORE INTO job_queue (job_id, status, enqueued_at) VALUES (?, 'queued', ?)",
+                (job_id, time.time()),
+            )
+
+    # Takes the oldest queued job, or one whose worker's lease ran out
+    def _claim(self, worker_id: str):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT job_id FROM job_queue WHERE status = 'queued' OR (status = 'leased' AND lease_until < ?) "
+                    "ORDER BY enqueued_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE job_queue SET status = 'leased', leased_by = ?, lease_until = ? WHERE job_id = ?",
+                        (worker_id, now + self.lease_seconds, row[0]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return row[0] if row else None
+
+    def _heartbeat(self, job_id: str, worker_id: str):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE job_queue SET lease_until = ? WHERE job_id = ? AND leased_by = ?",
+                (time.time() + self.lease_seconds, job_id, worker_id),
+            )
+
+    def _ack(self, job_id: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+
+    async def start(self):
+        await asyncio.to_thread(self._connect)
+
+    async def stop(self):
+        pass
+
+    async def submit(self, job_id: str):
+        await asyncio.to_thread(self._enqueue, job_id)
+
+    async def cancel(self, job_id: str):
+        pass
+
+    async def claim(self, worker_id: str):
+        return await asyncio.to_thread(self._claim, worker_id)
+
+    async def heartbeat(self, job_id: str, worker_id: str):
+        await asyncio.to_thread(self._heartbeat, job_id, worker_id)
+
+    async def ack(self, job_id: str):
+        await asyncio.to_thread(self._ack, job_id)
+
+
+def build_job_queue():
+    if job_queue_backend == "sqlite":
+        return SqliteJobQueue(job_queue_path, job_lease_seconds)
+    if job_queue_backend != "inprocess":
+        logger.error(f"Unknown JOB_QUEUE_BACKEND {job_queue_backend}, using the in-process queue")
+    return InProcessJobQueue(job_workers)
+
+
+job_queue = build_job_queue()
+
+
+async def submit_job(kind: str, item_ids: List[str], params: dict):
+    job, item_docs = new_job_documents(kind, item_ids, params)
+    # Item lists first, a worker never sees a job whose items aren't all stored
+    summary = await bulk_upsert(item_docs)
+    if summary["failed"]:
+        raise HTTPException(status_code=503, detail=f"Could not store the job's items: {summary['failures'][0]['error']}")
+    job = await get_async_container().create_item(job)
+    await job_queue.submit(job["id"])
+    return job
+
+
+async def cancel_job(job_id: str):
+    job = await read_job(job_id)
+    if job is None:
+        return None
+    if job["status"] in TERMINAL_STATUSES:
+        return job
+    if job["status"] == "queued":
+        # Not picked up yet, the worker sees the terminal status and skips it
+        job = await update_job(job_id, status="cancelled", cancel_requested=True, finished_at=_now())
+    else:
+        job = await update_job(job_id, cancel_requested=True)
+    await job_queue.cancel(job_id)
+    return job
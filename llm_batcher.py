@@ -0,0 +1,122 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+from logger import logger
+
+# Micro-batching for short LLM prompts, pending notes are packed into one multi-item request
+llm_batch_enabled = os.getenv("LLM_BATCH_ENABLED", "true").lower() == "true"
+llm_batch_max_items = int(os.getenv("LLM_BATCH_MAX_ITEMS", "8"))
+# Rough prompt budget per batch, keep it well under the LLM server's context length
+llm_batch_max_tokens = int(os.getenv("LLM_BATCH_MAX_TOKENS", "2048"))
+# How long the first note of a batch waits for company before the batch is sent anyway
+llm_batch_max_wait = float(os.getenv("LLM_BATCH_MAX_WAIT_MS", "20")) / 1000
+# Batched requests in flight at once, one batch per parallel slot on the LLM server
+llm_batch_concurrency = int(os.getenv("LLM_BATCH_CONCURRENCY", os.getenv("LLM_CONCURRENCY_LIMIT", "4")))
+
+
+# ~4 characters per token is close enough for English notes, plus a little for the JSON framing
+def estimate_tokens(text: str):
+    return len(text) // 4 + 8
+
+
+# Collects items per group (e.g. prompt template) and hands each full or timed-out group to send_batch.
+# send_batch(group, texts) returns {index: result} for the items it managed to parse, every missing
+# index is retried on its own with send_single(group, text).
+class MicroBatcher:
+    def __init__(
+        self,
+        send_batch: Callable[[str, List[str]], Awaitable[Dict[int, object]]],
+        send_single: Callable[[str, str], Awaitable[object]],
+        max_items: int,
+        max_tokens: int,
+        max_wait: float,
+        concurrency: int,
+    ):
+        self.send_batch = send_batch
+        self.send_single = send_single
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+        self.concurrency = concurrency
+        self._pending: Dict[str, list] = {}
+        self._pending_tokens: Dict[str, int] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.batches = 0
+        self.batched_items = 0
+        self.single_retries = 0
+
+    async def submit(self, group: str, text: str):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        tokens = estimate_tokens(text)
+        pending = self._pending.setdefault(group, [])
+        # Send what we have first if this note would push the batch over its token budget
+        if pending and self._pending_tokens.get(group, 0) + tokens > self.max_tokens:
+            self._flush(group)
+            pending = self._pending.setdefault(group, [])
+        future = loop.create_future()
+        pending.append((text, future))
+        self._pending_tokens[group] = self._pending_tokens.get(group, 0) + tokens
+        if len(pending) >= self.max_items:
+            self._flush(group)
+        elif len(pending) == 1:
+            self._timers[group] = loop.call_later(self.max_wait, self._flush, group)
+        return await future
+
+    def _flush(self, group: str):
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(group, [])
+        self._pending_tokens.pop(group, None)
+        if items:
+            task = asyncio.create_task(self._run(group, items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group: str, items: list):
+        texts = [text for text, _ in items]
+        try:
+            results = {}
+            if len(items) > 1:
+                async with self._semaphore:
+                    results = await self.send_batch(group, texts)
+                self.batches += 1
+                self.batched_items += len(results)
+            retry = [index for index in range(len(items)) if index not in results]
+            if retry:
+                if len(items) > 1:
+                    self.single_retries += len(retry)
+                    logger.info(f"LLM batch of {len(items)} returned {len(results)} items, retrying {len(retry)} on their own")
+                retried = await asyncio.gather(*(self._single(group, texts[index]) for index in retry), return_exceptions=True)
+                results.update(zip(retry, retried))
+            for index, (_, future) in enumerate(items):
+                if future.done():
+                    continue
+                result = results.get(index)
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _single(self, group: str, text: str):
+        async with self._semaphore:
+            return await self.send_single(group, text)
+
+    def stats(self):
+        return {
+            "enabled": llm_batch_enabled,
+            "max_items": self.max_items,
+            "max_tokens": self.max_tokens,
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "single_retries": self.single_retries,
+            "average_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,161 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+from logger import logger
+from ttl_cache import TTLCache
+
+# Result cache for LLM calls, an in-memory LRU in front of a size-bounded SQLite file
+llm_cache_enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+llm_cache_path = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+llm_cache_memory_entries = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "2048"))
+llm_cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+llm_cache_ttl = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+# Content-addressed key, any change to the prompt template, flags, input or model settings is a new entry
+def llm_cache_key(template: str, better_prompt: bool, text: str, settings: dict):
+    payload = json.dumps([template, better_prompt, text, settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResultCache:
+    def __init__(self, path: str, memory_entries: int, max_bytes: int, ttl: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=memory_entries, ttl=ttl)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._disk_bytes = 0
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._disk_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            self._connection = connection
+        return self._connection
+
+    def _disk_get(self, key: str):
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl <= time.time():
+                self._delete(connection, key)
+                connection.commit()
+                return None
+            connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            return json.loads(row[0])
+
+    def _delete(self, connection, key: str):
+        row = connection.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._disk_bytes -= row[0]
+
+    def _disk_set(self, key: str, value: Any):
+        encoded = json.dumps(value)
+        size = len(encoded)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            self._delete(connection, key)
+            connection.execute(
+                "INSERT INTO llm_cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, size, now, now),
+            )
+            self._disk_bytes += size
+            # Evict least recently used entries until the file is back under its byte budget
+            while self._disk_bytes > self.max_bytes:
+                oldest = connection.execute(
+                    "SELECT key FROM llm_cache ORDER BY last_access LIMIT 64"
+                ).fetchall()
+                if not oldest:
+                    break
+                for (old_key,) in oldest:
+                    self._delete(connection, old_key)
+                    self.evictions += 1
+                    if self._disk_bytes <= self.max_bytes:
+                        break
+            connection.commit()
+
+    # Callers get their own copy, the memory tier is shared by every request (like entity_cache)
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return copy.deepcopy(value)
+        try:
+            value = await asyncio.to_thread(self._disk_get, key)
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache read failed: {str(e)}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, value)
+        return copy.deepcopy(value)
+
+    async def set(self, key: str, value: Any):
+        self.memory.set(key, copy.deepcopy(value))
+        try:
+            await asyncio.to_thread(self._disk_set, key, value)
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache write failed: {str(e)}")
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM llm_cache")
+            connection.commit()
+            self._disk_bytes = 0
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": llm_cache_enabled,
+            "memory_entries": len(self.memory),
+            "disk_bytes": self._disk_bytes,
+            "max_disk_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+llm_cache = LLMResultCache(llm_cache_path, llm_cache_memory_entries, llm_cache_max_bytes, llm_cache_ttl)
+
+
+async def cached_llm_call(key: str, call, bypass_cache: bool = False, cacheable=lambda result: result is not None):
+    # bypass_cache skips the lookup but still stores the fresh result so later calls benefit
+    if llm_cache_enabled and not bypass_cache:
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            return cached
+    result = await call()
+    if llm_cache_enabled and cacheable(result):
+        await llm_cache.set(key, result)
+    return result
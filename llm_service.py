@@ -0,0 +1,202 @@
+import json
+import time
+from typing import List, Optional
+from http_clients import get_llm_client
+from llm_batcher import (
+    MicroBatcher, llm_batch_enabled, llm_batch_max_items, llm_batch_max_tokens,
+    llm_batch_max_wait, llm_batch_concurrency
+)
+from llm_cache import cached_llm_call, llm_cache_key
+from logger import logger
+from metrics import llm_json_parse_failures, llm_request_duration, llm_retries, record_llm_usage
+
+gpt_service_url = "http://127.0.0.1:5000/v1/chat/completions"  # Adjust the URL if different
+# Sent with every chat completion, part of the cache key so changing them invalidates old results
+llm_model_settings = {
+    "mode": "instruct",
+    "instruction_template": "Alpaca"
+}
+
+ELABORATE_PROMPT = "Please transform this brief note into a more detailed claim adjuster's note. Focus on the date, the type of damage, and the details of the claim. Keep it factual and under three sentences. Here's the note: {text} Please elaborate on the incident, ensuring it reads naturally stick to the facts and number provided."
+
+CATEGORIZE_PROMPT = "Please extract the Claim Amount, Claims Category, Date, and Policyholder ID from the following text. Please structure data in JSON: '{text}'"
+
+CATEGORY_GUIDELINES = (
+    "For categorization, use these guidelines:\n\n"
+    "- Water Damage: Look for keywords like 'pipe burst', 'flooding', 'leakage'.\n"
+    "- Fire Damage: Identify phrases like 'fire', 'burned', 'smoke damage'.\n"
+    "- Theft/Burglary: Extract incidents involving 'theft', 'stolen', 'break-in'.\n"
+    "- Auto Accident: Include cases with 'car crash', 'vehicle damage', 'collision'.\n"
+    "- Natural Disaster: Categorize incidents related to 'storm', 'earthquake', 'hurricane'.\n"
+    "- Health/Medical: Focus on 'medical care', 'hospitalization', 'health treatment'.\n"
+    "- Liability Claims: Consider 'legal liability', 'personal injury', 'property damage'.\n\n"
+)
+
+CATEGORIZE_BETTER_PROMPT = (
+    "Please extract the Claim Amount, Claims Category, Date, and Policyholder ID from the following text, structuring the data in JSON format. "
+    + CATEGORY_GUIDELINES +
+    "Example text for extraction:\n'{text}'.\n\n"
+    "If uncertain about the category, suggest the most likely one and confirm. For unique incidents, provide your best judgment on categorization based on these guidelines."
+)
+
+# Several notes in one request, each answer carries the id of its note so the reply can be split back up
+CATEGORIZE_BATCH_PROMPT = (
+    "Please extract the Claim Amount, Claims Category, Date, and Policyholder ID from each of the claim notes below. "
+    "{guidelines}"
+    "Reply with only a JSON array containing one object per note. Each object must copy the note's \"id\" exactly "
+    "and have the keys \"Claim Amount\", \"Claims Category\", \"Date\" and \"Policyholder ID\".\n\n"
+    "Notes:\n{notes}"
+)
+
+
+def chat_request(content: str):
+    return {
+        "messages": [{
+            "role": "user",
+            "content": content
+        }],
+        **llm_model_settings
+    }
+
+
+# kind labels the LLM metrics: elaborate, categorize or categorize_batch
+async def post_chat(kind: str, request_body: dict):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await get_llm_client().post(gpt_service_url, json=request_body)
+        outcome = str(response.status_code)
+        return response
+    finally:
+        llm_request_duration.observe(time.perf_counter() - started, kind, outcome)
+
+
+async def call_gpt_service(textfile: str, bypass_cache: bool = False):
+    key = llm_cache_key(ELABORATE_PROMPT, False, textfile, llm_model_settings)
+    return await cached_llm_call(key, lambda: request_elaboration(textfile), bypass_cache)
+
+
+async def request_elaboration(textfile: str):
+    request_body = chat_request(ELABORATE_PROMPT.format(text=textfile))
+    response = await post_chat("elaborate", request_body)
+    if response.status_code == 200:
+        response_data = response.json()
+        record_llm_usage("elaborate", response_data)
+        # Extract the transformed text from the response
+        transformed_text = response_data['choices'][0]['message']['content']
+        return transformed_text
+    else:
+        # Handle errors or unexpected response format
+        return None
+
+
+# The fallback error object from request_categorization must never be cached
+def is_cacheable_categorization(result):
+    return isinstance(result, dict) and "BadReturn" not in result
+
+
+# batcher defaults to the shared categorization_batcher, see claims_processing.categorization_limits
+async def categorize_claim(claim_text: str, better_prompt: bool = False, bypass_cache: bool = False,
+                           batcher: Optional[MicroBatcher] = None):
+    template = CATEGORIZE_BETTER_PROMPT if better_prompt else CATEGORIZE_PROMPT
+    key = llm_cache_key(template, better_prompt, claim_text, llm_model_settings)
+    # Only cache misses reach the batcher, a batched answer is cached under the same key as a single one
+    if llm_batch_enabled:
+        batcher = batcher or categorization_batcher
+        call = lambda: batcher.submit(template, claim_text)
+    else:
+        call = lambda: request_categorization(template, claim_text)
+    return await cached_llm_call(key, call, bypass_cache, cacheable=is_cacheable_categorization)
+
+
+# Extracts the JSON array from a batched reply, tolerating chatter or code fences around it
+def parse_batch_reply(content: str):
+    content = content.split("</s>")[0]
+    start, end = content.find("["), content.rfind("]")
+    if start == -1 or end <= start:
+        raise json.JSONDecodeError("No JSON array in reply", content, 0)
+    return json.loads(content[start:end + 1])
+
+
+# One request for several notes, returns {index: result} for the notes that came back well formed.
+# Notes are keyed by their position in the batch, one claim contributes both its textfile and gptmsg.
+async def request_batch_categorization(template: str, claim_texts: List[str]):
+    guidelines = CATEGORY_GUIDELINES if template == CATEGORIZE_BETTER_PROMPT else ""
+    notes = json.dumps([{"id": str(index + 1), "text": text} for index, text in enumerate(claim_texts)], ensure_ascii=False)
+    request_body = chat_request(CATEGORIZE_BATCH_PROMPT.format(guidelines=guidelines, notes=notes))
+    try:
+        response = await post_chat("categorize_batch", request_body)
+        if response.status_code != 200:
+            logger.error(f"Batched categorization got a {response.status_code} response")
+            return {}
+        response_data = response.json()
+        record_llm_usage("categorize_batch", response_data)
+        content = response_data['choices'][0]['message']['content']
+        answers = parse_batch_reply(content)
+    except Exception as e:
+        if isinstance(e, json.JSONDecodeError):
+            llm_json_parse_failures.inc("categorize_batch")
+        # Every note falls back to its own request
+        logger.error(f"Batched categorization failed: {str(e)}")
+        return {}
+
+    results = {}
+    for answer in answers if isinstance(answers, list) else []:
+        if not isinstance(answer, dict):
+            continue
+        try:
+            index = int(str(answer.pop("id", "")).strip()) - 1
+        except ValueError:
+            continue
+        if 0 <= index < len(claim_texts) and index not in results and answer:
+            results[index] = answer
+    return results
+
+
+
+async def request_categorization(template: str, claim_text: str):
+    content = template.format(text=claim_text)
+    request_body = chat_request(content)
+
+    max_attempts = 4
+    for attempt in range(max_attempts):
+        if attempt:
+            llm_retries.inc("categorize")
+        try:
+            response = await post_chat("categorize", request_body)
+            if response.status_code == 200:
+                gpt_response = response.json()
+                record_llm_usage("categorize", gpt_response)
+                content = gpt_response['choices'][0]['message']['content']
+                # Attempt to parse JSON
+                json_data = json.loads(content.split("</s>")[0])
+                return json_data
+            else:
+                print(f"Attempt {attempt + 1}: Non-200 response")
+        except json.JSONDecodeError:
+            llm_json_parse_failures.inc("categorize")
+            print(f"Attempt {attempt + 1}: Malformed JSON received. Response content: {content}")
+
+    # If all attempts fail, return a predefined error object
+    return {
+        "Date": "error",
+        "PolicyholderId": "error",
+        "ClaimAmount": "error",
+        "ClaimsCategory": "error",
+        "BadReturn": content
+    }
+
+
+# concurrency is the number of LLM requests (batches and single retries) the batcher has in flight
+def new_categorization_batcher(concurrency: int):
+    return MicroBatcher(
+        send_batch=request_batch_categorization,
+        send_single=request_categorization,
+        max_items=llm_batch_max_items,
+        max_tokens=llm_batch_max_tokens,
+        max_wait=llm_batch_max_wait,
+        concurrency=concurrency,
+    )
+
+
+categorization_batcher = new_categorization_batcher(llm_batch_concurrency)
@@ -0,0 +1,229 @@
+import base64
+import bisect
+import datetime
+import hashlib
+import json
+import os
+import threading
+import types
+import uuid
+from typing import List, Optional
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from blob_transfer import blob_download_chunk_size
+
+# Filesystem stand-in for the Blob Storage container client, covering the calls this repo makes.
+# Blob data lives under <root>/data/<name>, properties (etag, metadata, content settings) in
+# <root>/meta/<name>.json and staged blocks under <root>/blocks until they are committed.
+# Writes go to <root>/tmp first and are moved into place.
+
+
+class LocalBlobProperties:
+    def __init__(self, name: str, size: int, meta: dict):
+        self.name = name
+        self.size = size
+        self.etag = meta["etag"]
+        self.last_modified = datetime.datetime.fromisoformat(meta["last_modified"])
+        self.metadata = meta.get("metadata") or {}
+        self.content_settings = types.SimpleNamespace(
+            content_type=meta.get("content_type"),
+            content_md5=base64.b64decode(meta["content_md5"]) if meta.get("content_md5") else None,
+        )
+
+
+class LocalBlobDownloader:
+    def __init__(self, path: str, offset: int, length: Optional[int]):
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def chunks(self):
+        remaining = self.length
+        with open(self.path, "rb") as file:
+            file.seek(self.offset)
+            while remaining is None or remaining > 0:
+                size = blob_download_chunk_size if remaining is None else min(blob_download_chunk_size, remaining)
+                chunk = file.read(size)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def readall(self):
+        return b"".join(self.chunks())
+
+
+class LocalBlobClient:
+    def __init__(self, container: "LocalBlobContainerClient", name: str):
+        self.container = container
+        self.blob_name = name
+        self.container_name = container.container_name
+
+    def get_blob_properties(self, **kwargs):
+        return self.container.properties(self.blob_name)
+
+    def download_blob(self, offset: Optional[int] = None, length: Optional[int] = None, etag: Optional[str] = None,
+                      match_condition=None, **kwargs):
+        properties = self.container.properties(self.blob_name)
+        if match_condition == MatchConditions.IfNotModified and etag != properties.etag:
+            raise ResourceModifiedError(f"Blob {self.blob_name} was modified")
+        return LocalBlobDownloader(self.container.data_path(self.blob_name), offset or 0, length)
+
+    def upload_blob(self, data, overwrite: bool = False, metadata: Optional[dict] = None, content_settings=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif hasattr(data, "read"):
+            data = data.read()
+        if not overwrite and os.path.exists(self.container.data_path(self.blob_name)):
+            raise ResourceExistsError(f"Blob {self.blob_name} already exists")
+        return self.container.write(self.blob_name, [data], metadata, content_settings)
+
+    def stage_block(self, block_id: str, data, length: Optional[int] = None, **kwargs):
+        path = self.container.block_path(self.blob_name, block_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+
+    def commit_block_list(self, block_list: List, metadata: Optional[dict] = None, content_settings=None, **kwargs):
+        block_paths = [
+            self.container.block_path(self.blob_name, block if isinstance(block, str) else block.id) for block in block_list
+        ]
+        missing = [path for path in block_paths if not os.path.exists(path)]
+        if missing:
+            raise ResourceNotFoundError(f"{len(missing)} blocks of {self.blob_name} were never staged")
+        result = self.container.write(self.blob_name, (read_file(path) for path in block_paths), metadata, content_settings)
+        for path in block_paths:
+            os.remove(path)
+        return result
+
+    def delete_blob(self, **kwargs):
+        self.container.delete_blob(self.blob_name)
+
+
+def read_file(path: str):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+class LocalBlobPager:
+    def __init__(self, container: "LocalBlobContainerClient", prefix: Optional[str], page_size: int, continuation_token: Optional[str]):
+        self.container = container
+        self.prefix = prefix or ""
+        self.page_size = page_size
+        self.continuation_token = continuation_token
+        self._done = False
+
+    def __iter__(self):
+        while not self._done:
+            names = self.container.blob_names()
+            start = bisect.bisect_left(names, self.prefix)
+            if self.continuation_token:
+                start = max(start, bisect.bisect_right(names, self.continuation_token))
+            page = []
+            for name in names[start:]:
+                if not name.startswith(self.prefix) or len(page) == self.page_size:
+                    break
+                page.append(self.container.properties(name))
+            has_more = start + len(page) < len(names) and names[start + len(page)].startswith(self.prefix)
+            self.continuation_token = page[-1].name if page and has_more else None
+            self._done = self.continuation_token is None
+            yield page
+
+
+class LocalBlobList:
+    def __init__(self, container: "LocalBlobContainerClient", prefix: Optional[str], page_size: int):
+        self.container = container
+        self.prefix = prefix
+        self.page_size = page_size
+
+    def by_page(self, continuation_token: Optional[str] = None):
+        return LocalBlobPager(self.container, self.prefix, self.page_size, continuation_token)
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+
+class LocalBlobContainerClient:
+    def __init__(self, root: str, container_name: str):
+        self.root = os.path.abspath(root)
+        self.container_name = container_name
+        self._lock = threading.Lock()
+        for directory in ("data", "meta", "blocks", "tmp"):
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+
+    def _path(self, directory: str, name: str, suffix: str = ""):
+        base = os.path.join(self.root, directory)
+        path = os.path.normpath(os.path.join(base, name + suffix))
+        if not name or os.path.commonpath([base, path]) != base:
+            raise ValueError(f"Invalid blob name {name}")
+        return path
+
+    def data_path(self, name: str):
+        return self._path("data", name)
+
+    def block_path(self, name: str, block_id: str):
+        blob_key = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "blocks", blob_key, base64.urlsafe_b64encode(block_id.encode("ascii")).decode("ascii"))
+
+    def get_blob_client(self, blob: str):
+        return LocalBlobClient(self, blob)
+
+    def properties(self, name: str):
+        try:
+            with open(self._path("meta", name, ".json")) as file:
+                meta = json.load(file)
+            size = os.path.getsize(self.data_path(name))
+        except (OSError, ValueError):
+            raise ResourceNotFoundError(f"Blob {name} not found")
+        return LocalBlobProperties(name, size, meta)
+
+    # Writes the blob and its properties, each swapped in atomically so readers see old or new, never half
+    def write(self, name: str, chunks, metadata: Optional[dict], content_settings):
+        data_path, meta_path = self.data_path(name), self._path("meta", name, ".json")
+        md5 = hashlib.md5()
+        temp_data_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        temp_meta_path = temp_data_path + ".json"
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        with open(temp_data_path, "wb") as file:
+            for chunk in chunks:
+                md5.update(chunk)
+                file.write(chunk)
+        content_md5 = getattr(content_settings, "content_md5", None) or md5.digest()
+        meta = {
+            "etag": f'"{uuid.uuid4().hex}"',
+            "last_modified": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "metadata": metadata or {},
+            "content_type": getattr(content_settings, "content_type", None) or "application/octet-stream",
+            "content_md5": base64.b64encode(bytes(content_md5)).decode("ascii"),
+        }
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        with self._lock:
+            with open(temp_meta_path, "w") as file:
+                json.dump(meta, file)
+            os.replace(temp_data_path, data_path)
+            os.replace(temp_meta_path, meta_path)
+        return {"etag": meta["etag"], "last_modified": meta["last_modified"]}
+
+    def blob_names(self):
+        data_root = os.path.join(self.root, "data")
+        names = []
+        for directory, _, files in os.walk(data_root):
+            for file_name in files:
+                names.append(os.path.relpath(os.path.join(directory, file_name), data_root).replace(os.sep, "/"))
+        return sorted(names)
+
+    def list_blobs(self, name_starts_with: Optional[str] = None, include=None, results_per_page: Optional[int] = None, **kwargs):
+        return LocalBlobList(self, name_starts_with, results_per_page or 5000)
+
+    def delete_blob(self, blob: str, **kwargs):
+        with self._lock:
+            try:
+                os.remove(self.data_path(blob))
+            except FileNotFoundError:
+                raise ResourceNotFoundError(f"Blob {blob} not found")
+            try:
+                os.remove(self._path("meta", blob, ".json"))
+            except FileNotFoundError:
+                pass
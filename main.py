@@ -1,41 +1,88 @@
 # main.py
+# Imported first so the startup timing report measures from (almost) the start of the process
+from startup_timing import mark_imported, mark_ready, startup_report, timed
+import asyncio
+import hmac
 import json
+import os
 import uuid
 import traceback
-import io
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from fastapi import Body, FastAPI, HTTPException, UploadFile, File, Query, Form, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import Body, FastAPI, HTTPException, UploadFile, File, Query, Form, Depends, Request
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from azure.storage.blob import BlobServiceClient
-import httpx
-from analysis import analyze_claims
 from logger import logger
+from metrics import MetricsMiddleware, metrics_token, render_metrics
+from profiling import ProfilingMiddleware, list_profiles, profile_file_path
 from models import (
     AddClaimRequest, AuthCode, ClaimIdsRequest, Policyholder, PolicyholderRequest, 
-    GenerateClaimNotesRequest, ProcessClaimsRequest
+    GenerateClaimNotesRequest, ProcessClaimsRequest, ClaimsAnalysisJobRequest
 )
 from crud import (
-    delete_claim, generate_policyholder_data, add_policyholder_to_db,
-    create_policyholder, get_claim_by_id, get_policyholders, get_policyholder,
-    update_claim_with_file_blob_name, update_claim_with_gptmsg,
-    update_policyholder, delete_policyholder, search_policyholders,
-    calculate_average_policy_amount, generate_claim_notes,
-    get_claims_for_policyholders, get_all_claims
+    generate_policyholder_data,
+    create_policyholder, get_policyholders, get_policyholder,
+    update_claim_with_file_blob_name,
+    update_policyholder, delete_policyholder, delete_policyholder_with_claims, search_policyholders,
+    bulk_delete_claims,
+    calculate_average_policy_amount,
+    get_claims_for_policyholders, get_all_claims,
+    get_claims_page, stream_claims, get_policyholders_page, stream_policyholders,
+    get_claim_analysis_columns
 )
-from claims_data_generator import generate_claim_note, generate_claim_notes
-from config_loader import config
-from database import container
+from rollup import apply_rollup_delta, read_rollup, rebuild_rollup, rollup_summary
+from bulk_operations import bulk_upsert
+from clients import get_blob_container_client
+from database import open_async_container, close_async_container, get_async_container
 from auth import exchange_code_for_token, get_current_user
-
-# Initialize Azure Blob Service Client
-blob_service_client = BlobServiceClient.from_connection_string(config['azure_blob_storage']['connection_string_one'])
-container_client = blob_service_client.get_container_client(config['azure_blob_storage']['container_name'])
-
-
-gpt_service_url = "http://127.0.0.1:5000/v1/chat/completions"  # Adjust the URL if different
-
-app = FastAPI()
+from http_clients import open_http_clients, close_http_clients
+from claims_processing import categorization_limits, analyze_single_claim, process_claims_pipeline
+from llm_cache import llm_cache
+from llm_service import categorization_batcher
+from name_index import name_index, build_name_index
+from entity_cache import entity_cache
+from blob_index import blob_index, find_claim_notes, refresh_blob_index_forever
+from blob_transfer import stream_blob, stream_claim_note_json, upload_stream
+from jobs import job_queue, submit_job, read_job, cancel_job, job_status, job_results
+
+mark_imported()
+
+
+# Cosmos page size used when streaming list endpoints as NDJSON
+stream_page_size = int(os.getenv("STREAM_PAGE_SIZE", "500"))
+
+# Modules kept off the startup path, loaded in the background once the app is serving
+def warm_lazy_imports():
+    with timed("warm: claims data generator"):
+        import claims_data_generator  # noqa: F401
+    with timed("warm: analysis engine"):
+        import analysis  # noqa: F401
+    get_blob_container_client()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled upstream HTTP clients live for the whole app so connections are reused
+    open_http_clients()
+    # One async Cosmos client for the whole app so endpoints never block the event loop
+    await open_async_container()
+    # Background job workers (or just the enqueue side when workers run in job_worker.py)
+    await job_queue.start()
+    # Claim-notes metadata index, built in the background and rebuilt periodically
+    blob_index_task = asyncio.create_task(refresh_blob_index_forever())
+    # Policyholder name search index, searches go to Cosmos until it is built
+    name_index_task = asyncio.create_task(build_name_index())
+    warm_task = asyncio.create_task(asyncio.to_thread(warm_lazy_imports))
+    mark_ready()
+    logger.info(f"Startup timing: {json.dumps(startup_report())}")
+    yield
+    warm_task.cancel()
+    name_index_task.cancel()
+    blob_index_task.cancel()
+    await job_queue.stop()
+    await close_async_container()
+    await close_http_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -45,141 +92,100 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+# Opt-in request profiling, off unless PROFILING_ENABLED is set
+app.add_middleware(ProfilingMiddleware)
+# Outermost, so the latency covers CORS handling and the full streamed body
+app.add_middleware(MetricsMiddleware)
+
 @app.post("/analyze-claims")
 async def analyze_claims_endpoint(user=Depends(get_current_user)):
-    claims = get_all_claims()
-    logger.info(claims)
-    txtcounts, txtaverages, gptcounts, gptaverages = analyze_claims(claims)
-    return {
-        "textfile_category_counts": txtcounts,
-        "textfile_category_averages": txtaverages,
-        "gptmsg_category_counts": gptcounts,
-        "gptmsg_category_averages": gptaverages
-    }
-
-async def call_gpt_service(textfile: str):
-    request_body = {
-        "messages": [
-            {
-                "role": "user",
-                "content": f"Please transform this brief note into a more detailed claim adjuster's note. Focus on the date, the type of damage, and the details of the claim. Keep it factual and under three sentences. Here's the note: {textfile} Please elaborate on the incident, ensuring it reads naturally stick to the facts and number provided."
-            }
-        ],
-        "mode": "instruct",
-        "instruction_template": "Alpaca"
-    }
-    timeout = httpx.Timeout(6000.0, connect=6000.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(gpt_service_url, json=request_body)
-        if response.status_code == 200:
-            response_data = response.json()
-            # Extract the transformed text from the response
-            transformed_text = response_data['choices'][0]['message']['content']
-            return transformed_text
-        else:
-            # Handle errors or unexpected response format
-            return None
-
-
-async def categorize_claim(claim_text: str, better_prompt: bool = False):
-    if better_prompt:
-        content = (
-            "Please extract the Claim Amount, Claims Category, Date, and Policyholder ID from the following text, structuring the data in JSON format. For categorization, use these guidelines:\n\n"
-            "- Water Damage: Look for keywords like 'pipe burst', 'flooding', 'leakage'.\n"
-            "- Fire Damage: Identify phrases like 'fire', 'burned', 'smoke damage'.\n"
-            "- Theft/Burglary: Extract incidents involving 'theft', 'stolen', 'break-in'.\n"
-            "- Auto Accident: Include cases with 'car crash', 'vehicle damage', 'collision'.\n"
-            "- Natural Disaster: Categorize incidents related to 'storm', 'earthquake', 'hurricane'.\n"
-            "- Health/Medical: Focus on 'medical care', 'hospitalization', 'health treatment'.\n"
-            "- Liability Claims: Consider 'legal liability', 'personal injury', 'property damage'.\n\n"
-            f"Example text for extraction:\n'{claim_text}'.\n\n"
-            "If uncertain about the category, suggest the most likely one and confirm. For unique incidents, provide your best judgment on categorization based on these guidelines."
-        )
-    else:
-        content = f"Please extract the Claim Amount, Claims Category, Date, and Policyholder ID from the following text. Please structure data in JSON: '{claim_text}'"
-
-    request_body = {
-        "messages": [{
-            "role": "user",
-            "content": content
-        }],
-        "mode": "instruct",
-        "instruction_template": "Alpaca"
-    }
-
-    max_attempts = 4
-    for attempt in range(max_attempts):
-        try:
-            timeout = httpx.Timeout(6000.0, connect=6000.0)
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.post(gpt_service_url, json=request_body)
-                if response.status_code == 200:
-                    gpt_response = response.json()
-                    content = gpt_response['choices'][0]['message']['content']
-                    # Attempt to parse JSON
-                    json_data = json.loads(content.split("</s>")[0])
-                    return json_data
-                else:
-                    print(f"Attempt {attempt + 1}: Non-200 response")
-        except json.JSONDecodeError:
-            print(f"Attempt {attempt + 1}: Malformed JSON received. Response content: {content}")
-
-    # If all attempts fail, return a predefined error object
-    return {
-        "Date": "error",
-        "PolicyholderId": "error",
-        "ClaimAmount": "error",
-        "ClaimsCategory": "error",
-        "BadReturn": content
-    }
+    # Served from the materialised rollup, the claim write paths keep it current
+    return rollup_summary(await read_rollup())
+
+# Full recount of the rollup, for after bulk imports or if it has drifted
+@app.post("/analyze-claims/rebuild")
+async def rebuild_analyze_claims_endpoint(user=Depends(get_current_user)):
+    try:
+        return rollup_summary(await rebuild_rollup())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Median, p90/p99, outlier rates and textfile-vs-gptmsg agreement need the amounts themselves,
+# so this reads the projected analysis fields and runs the columnar engine over them
+@app.post("/analyze-claims/detailed")
+async def analyze_claims_detailed_endpoint(user=Depends(get_current_user)):
+    try:
+        # pandas/numpy stay off the startup path, warm_lazy_imports usually has them loaded by now
+        from analysis import analyze_claim_columns
+
+        columns = await get_claim_analysis_columns()
+        # pandas work is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(analyze_claim_columns, columns)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/claims-analysis")
 async def claims_analysis(data: dict = Body(...)):
+    concurrency = data.get("concurrency")
+    # Checked before the try below, which would turn the 422 into a 500
+    if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1):
+        raise HTTPException(status_code=422, detail="concurrency must be a positive integer")
 
     try:
         claims = data.get("claims", [])
         better_prompt = data.get("betterPrompt", False)
-        analysis = []
-
-        for claim in claims:
-            claim_id = claim.get("id")
-            textfile = claim.get("textfile")
-            gptmsg = claim.get("gptmsg")
-
-            # Analyze textfile
-            textfile_analysis = await categorize_claim(textfile, better_prompt) if textfile else None
-    
-            # Analyze gptmsg
-            gptmsg_analysis = await categorize_claim(gptmsg, better_prompt) if gptmsg else None
-
-            analysis_data = {
-                "textfile_analysis": textfile_analysis,
-                "gptmsg_analysis": gptmsg_analysis
-            }
-
-            analysis.append({
-                "id": claim_id,
-                **analysis_data
-            })
-
-            # Update the claim in the database
-            update_claim_with_analysis(claim_id, analysis_data)
-
-        return {"analysis": analysis}
+        # Skip cached LLM results, e.g. after changing the model on the LLM server
+        bypass_cache = data.get("bypassCache", False)
+        # Optional per-request cap on LLM requests in flight, 1 runs the batch sequentially
+        semaphore, batcher = categorization_limits(concurrency)
+
+        # gather returns results in the same order as the input claims
+        analysis = await asyncio.gather(
+            *(analyze_single_claim(claim, better_prompt, semaphore, bypass_cache, batcher) for claim in claims)
+        )
+        return {"analysis": list(analysis)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def update_claim_with_analysis(claim_id: str, analysis_data: dict):
-    try:
-        claim = get_claim_by_id(claim_id)
-        if claim:
-            claim['analysis'] = analysis_data
-            container.upsert_item(claim)
-    except Exception as e:
-        print(f"Error updating claim {claim_id} with analysis: {str(e)}")
+@app.get("/llm-cache/stats")
+async def llm_cache_stats(user=Depends(get_current_user)):
+    return llm_cache.stats()
+
+# Prometheus scrape endpoint, scrapers can't do the Azure AD flow so it has its own optional token
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(request: Request):
+    if metrics_token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied.encode(), metrics_token.encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Stored request profiles, newest first, e.g. ?route=/analyze-claims
+@app.get("/profiles")
+async def list_profiles_endpoint(route: Optional[str] = None, request_id: Optional[str] = None, user=Depends(get_current_user)):
+    return await asyncio.to_thread(list_profiles, route, request_id)
+
+@app.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, user=Depends(get_current_user)):
+    path = await asyncio.to_thread(profile_file_path, profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/html" if path.endswith(".html") else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+@app.get("/startup-timing")
+async def startup_timing_report(user=Depends(get_current_user)):
+    return startup_report()
+
+@app.get("/entity-cache/stats")
+async def entity_cache_stats(user=Depends(get_current_user)):
+    return entity_cache.stats()
+
+@app.get("/llm-batcher/stats")
+async def llm_batcher_stats(user=Depends(get_current_user)):
+    return categorization_batcher.stats()
 
-    
 @app.post("/exchange-code")
 async def exchange_auth_code(auth_code: AuthCode):
     token_response = await exchange_code_for_token(auth_code.code)
@@ -190,129 +196,173 @@ async def generate_synthetic_policyholders_data(request: PolicyholderRequest, us
     print(request)
     policyholders = [generate_policyholder_data() for _ in range(request.number_of_policyholders)]
     if request.add_to_database:
-        for policyholder_data in policyholders:
-            add_policyholder_to_db(policyholder_data)
+        # Written in parallel chunks, the bulk engine logs the count/RU summary
+        summary = await bulk_upsert(policyholders)
+        failed = {failure["id"] for failure in summary["failures"]}
+        for policyholder in policyholders:
+            if policyholder["id"] not in failed:
+                name_index.upsert(policyholder)
     return policyholders
 
 @app.post("/policyholders")
 async def create_policyholder_endpoint(policyholder: Policyholder, user=Depends(get_current_user)):
     try:
-        return create_policyholder(policyholder)
+        return await create_policyholder(policyholder)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Serialises pages of items as newline-delimited JSON, one line per item
+async def ndjson_lines(pages):
+    try:
+        async for page in pages:
+            if page:
+                yield "".join(json.dumps(item) + "\n" for item in page)
+    except Exception as e:
+        # Headers are already sent so the client only sees a truncated stream
+        logger.error(f"Error while streaming results: {str(e)}")
+        raise
+
+async def single_item_pages(items):
+    async for item in items:
+        yield [item]
+
 @app.get("/policyholders")
-async def get_policyholders_endpoint(user=Depends(get_current_user)):
+async def get_policyholders_endpoint(
+    page_size: Optional[int] = Query(None, ge=1, le=1000),
+    continuation: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user)
+):
+    try:
+        if stream:
+            return StreamingResponse(ndjson_lines(stream_policyholders(page_size or stream_page_size)), media_type="application/x-ndjson")
+        if page_size:
+            policyholders, next_continuation = await get_policyholders_page(page_size, continuation)
+            return {"policyholders": policyholders, "continuation": next_continuation}
+        return {"policyholders": await get_policyholders()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Registered before /policyholders/{id}, which would otherwise match "average-amount" as an id
+@app.get("/policyholders/average-amount")
+async def calculate_average_policy_amount_endpoint(user=Depends(get_current_user)):
     try:
-        return {"policyholders": get_policyholders()}
+        return {"average_amount": await calculate_average_policy_amount()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/policyholders/{id}")
 async def get_policyholder_endpoint(id: str, user=Depends(get_current_user)):
     try:
-        return {"policyholder": get_policyholder(id)}
+        return {"policyholder": await get_policyholder(id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/policyholders/{id}")
 async def update_policyholder_endpoint(id: str, policyholder: Policyholder, user=Depends(get_current_user)):
     try:
-        return update_policyholder(id, policyholder.dict())
+        return await update_policyholder(id, policyholder.dict())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/policyholders/{id}")
-async def delete_policyholder_endpoint(id: str, user=Depends(get_current_user)):
+async def delete_policyholder_endpoint(
+    id: str,
+    cascade: bool = False,
+    delete_blobs: bool = False,
+    user=Depends(get_current_user),
+):
     try:
-        return delete_policyholder(id)
+        # cascade=true also deletes all of the policyholder's claims (and with delete_blobs their files)
+        if cascade:
+            return await delete_policyholder_with_claims(id, get_blob_container_client() if delete_blobs else None)
+        return await delete_policyholder(id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/policyholders/search")
 async def search_policyholders_endpoint(request_body: dict = Body(...), user=Depends(get_current_user)):
     name = request_body.get("name", "")
+    # Optional cap on the number of (ranked) matches returned
+    limit = request_body.get("limit")
     try:
-        return {"policyholders": search_policyholders(name)}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.get("/policyholders/average-amount")
-async def calculate_average_policy_amount_endpoint(user=Depends(get_current_user)):
-    try:
-        return {"average_amount": calculate_average_policy_amount()}
+        return {"policyholders": await search_policyholders(name, int(limit) if limit else None)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-claim-notes")
 async def generate_claim_notes_api(request: GenerateClaimNotesRequest, user=Depends(get_current_user)):
     try:
-        uploaded_notes = []
-        for policyholder_id in request.policyholder_ids:
-            claim_notes = generate_claim_notes(request.number_of_notes, policyholder_id)
-            for note in claim_notes:
-                claim_note_data = {
-                    "id": str(uuid.uuid4()),
-                    "policyholder_id": policyholder_id,
-                    "textfile": note,
-                }
-                container.upsert_item(claim_note_data)
-                uploaded_notes.append({"policyholder_id": policyholder_id, "claim_note": claim_note_data})
-        return {"message": "Claim notes generated", "uploaded_notes": uploaded_notes}
+        from claims_data_generator import generate_and_ingest_claim_notes
+
+        written, ingest_summary = await generate_and_ingest_claim_notes(request.number_of_notes, request.policyholder_ids)
+        # Ids only, the notes themselves are never held in memory all at once
+        uploaded_notes = [{"policyholder_id": claim["policyholder_id"], "claim_id": claim["id"]} for claim in written]
+        return {"message": "Claim notes generated", "uploaded_notes": uploaded_notes, "ingest_summary": ingest_summary}
     except Exception as e:
         traceback_details = traceback.format_exc()
         print(traceback_details)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/download/{filename}")
-async def download_blob(filename: str, user=Depends(get_current_user)):
+async def download_blob(filename: str, request: Request, user=Depends(get_current_user)):
     try:
-        blob_client = container_client.get_blob_client(blob=filename)
-        download_stream = blob_client.download_blob()
-        data = download_stream.readall()
-
-        # Create an in-memory buffer with the data
-        return StreamingResponse(io.BytesIO(data), media_type="application/octet-stream")
+        blob_client = get_blob_container_client().get_blob_client(blob=filename)
+        # Streams straight from Blob Storage, honours Range and If-None-Match
+        return await stream_blob(blob_client, request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading blob: {str(e)}")
 
 @app.get("/search-blob-filenames")
-async def search_blob_filenames(user=Depends(get_current_user)):
+async def search_blob_filenames(
+    prefix: Optional[str] = None,
+    claim_id: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1, le=5000),
+    continuation: Optional[str] = None,
+    user=Depends(get_current_user),
+):
     try:
-        # Fetch all blobs in the container
-        blob_list = container_client.list_blobs()
-        # Extract the names of the blobs
-        blob_names = [blob.name for blob in blob_list]
-        return {"blob_names": blob_names}
+        entries, next_continuation = await find_claim_notes(get_blob_container_client(), prefix, claim_id, page_size, continuation)
+        response = {"blob_names": [entry["name"] for entry in entries]}
+        if page_size:
+            response["continuation"] = next_continuation
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/claim-notes")
-async def get_claim_notes(user=Depends(get_current_user)):
+async def get_claim_notes(
+    prefix: Optional[str] = None,
+    claim_id: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1, le=5000),
+    continuation: Optional[str] = None,
+    user=Depends(get_current_user),
+):
     try:
-        blob_list = container_client.list_blobs()
-        blobs_with_metadata = []
-        for blob in blob_list:
-            blob_client = container_client.get_blob_client(blob.name)
-            blob_props = blob_client.get_blob_properties()
-            blobs_with_metadata.append({
-                "name": blob.name,
-                "metadata": blob_props.metadata
-            })
-        return {"claim_notes": blobs_with_metadata}
+        # Metadata comes from the index (or the listing itself), no per-blob properties call
+        entries, next_continuation = await find_claim_notes(get_blob_container_client(), prefix, claim_id, page_size, continuation)
+        response = {"claim_notes": [{"name": entry["name"], "metadata": entry["metadata"]} for entry in entries]}
+        if page_size:
+            response["continuation"] = next_continuation
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/claim-notes/index/stats")
+async def claim_notes_index_stats(user=Depends(get_current_user)):
+    return blob_index.stats()
 
 
-@app.get("/claim-notes/{blob_name}")
-async def get_claim_note(blob_name: str, user=Depends(get_current_user)):
-    try:
-        blob_client = container_client.get_blob_client(blob_name)
-        download_stream = blob_client.download_blob()
-        return {"claim_note": download_stream.readall().decode("utf-8")}
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Claim note {blob_name} not found")
 
 @app.get("/claim-notes/analyze")
 async def analyze_claim_notes(user=Depends(get_current_user)):
@@ -320,22 +370,36 @@ async def analyze_claim_notes(user=Depends(get_current_user)):
     # Placeholder for actual analysis logic
     return {"analysis": "This is a placeholder for claim notes analysis."}
 
+@app.get("/claim-notes/{blob_name}")
+async def get_claim_note(blob_name: str, request: Request, raw: bool = False, user=Depends(get_current_user)):
+    try:
+        blob_client = get_blob_container_client().get_blob_client(blob_name)
+        # raw=true sends the note's bytes (with Range support), by default it keeps the {"claim_note": ...} shape
+        if raw:
+            return await stream_blob(blob_client, request)
+        return await stream_claim_note_json(blob_client, request)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Claim note {blob_name} not found")
+
 @app.post("/claim-notes")
 async def upload_claim_note(file: UploadFile = File(...), claimId: str = Form(...), user=Depends(get_current_user)):
     try:
         blob_name = f"claim_note_{claimId}_{file.filename}"
-        blob_client = container_client.get_blob_client(blob_name)
-        file_content = await file.read()  # Read file content as bytes
+        blob_client = get_blob_container_client().get_blob_client(blob_name)
 
         # Define metadata with claim_id
         metadata = {"claim_id": claimId}
 
-        blob_client.upload_blob(file_content, metadata=metadata, overwrite=True)  # Include metadata
+        # Staged in parallel blocks straight from the request body, never held in memory whole
+        upload = await upload_stream(blob_client, file, metadata=metadata)
+        blob_index.upsert(blob_name, metadata, upload["size"])
 
         # Update CosmosDB item for the claim to include file_blob_name
-        update_claim_with_file_blob_name(claimId, blob_name)
+        await update_claim_with_file_blob_name(claimId, blob_name)
 
-        return {"message": "Claim note uploaded", "blob_name": blob_name}
+        return {"message": "Claim note uploaded", "blob_name": blob_name, **upload}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -343,9 +407,11 @@ async def upload_claim_note(file: UploadFile = File(...), claimId: str = Form(..
 @app.post("/add-claim")
 async def add_claim(request: AddClaimRequest, user=Depends(get_current_user)):
     try:
+        from claims_data_generator import generate_claim_note
+
         # Extract details from request
         policyholder_id = request.policyholder_id
-        details = request.details if not request.generate_random else generate_claim_note(policyholder_id)
+        details = request.details if not request.generate_random else await asyncio.to_thread(generate_claim_note, policyholder_id)
 
         # Generate a claim note
         claim_note_data = {
@@ -355,7 +421,8 @@ async def add_claim(request: AddClaimRequest, user=Depends(get_current_user)):
         }
 
         # Add claim note to the database
-        created_claim_note = container.upsert_item(claim_note_data)
+        created_claim_note = await get_async_container().upsert_item(claim_note_data)
+        await apply_rollup_delta(claims_delta=1)
 
         # Return the created claim note
         return {"message": "Claim note added", "claim_note": created_claim_note}
@@ -366,39 +433,88 @@ async def add_claim(request: AddClaimRequest, user=Depends(get_current_user)):
 
 
 @app.get("/claims")
-async def get_claims(policyholder_ids: Optional[List[str]] = Query(None), user=Depends(get_current_user)):
+async def get_claims(
+    policyholder_ids: Optional[List[str]] = Query(None),
+    page_size: Optional[int] = Query(None, ge=1, le=1000),
+    continuation: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user)
+):
     try:
+        if stream:
+            return StreamingResponse(ndjson_lines(stream_claims(page_size or stream_page_size, policyholder_ids)), media_type="application/x-ndjson")
+        if page_size:
+            claims, next_continuation = await get_claims_page(page_size, continuation, policyholder_ids)
+            return {"claims": claims, "continuation": next_continuation}
         if policyholder_ids:
-            claims = get_claims_for_policyholders(policyholder_ids)
+            claims = await get_claims_for_policyholders(policyholder_ids)
         else:
-            claims = get_all_claims()
+            claims = await get_all_claims()
         return {"claims": claims}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# stream=true answers with one NDJSON line per claim as it finishes, errors included
 @app.post("/process-claims")
-async def process_claims(request: ProcessClaimsRequest, user=Depends(get_current_user)):
+async def process_claims(request: ProcessClaimsRequest, stream: bool = False, user=Depends(get_current_user)):
+    results = process_claims_pipeline(request.claimIds, request.bypassCache, request.concurrency)
+    if stream:
+        return StreamingResponse(ndjson_lines(single_item_pages(results)), media_type="application/x-ndjson")
     responses = {}
-    for claim_id in request.claimIds:
-        gpt_response = await process_single_claim(claim_id)
-        if gpt_response:
-            responses[claim_id] = gpt_response
+    async for result in results:
+        if "gptmsg" in result:
+            responses[result["id"]] = result["gptmsg"]
     return responses
 
-async def process_single_claim(claim_id: str):
-    claim = get_claim_by_id(claim_id)
-    if claim and claim.get('textfile'):
-        gpt_response = await call_gpt_service(claim['textfile'])
-        if gpt_response:
-            update_claim_with_gptmsg(claim_id, gpt_response)
-            return gpt_response
-    return None
+# Background versions of /process-claims and /claims-analysis, these return a job id straight away
+@app.post("/jobs/process-claims", status_code=202)
+async def submit_process_claims_job(request: ProcessClaimsRequest, user=Depends(get_current_user)):
+    params = {"bypassCache": request.bypassCache, "concurrency": request.concurrency}
+    job = await submit_job("process-claims", request.claimIds, params)
+    return job_status(job)
+
+@app.post("/jobs/claims-analysis", status_code=202)
+async def submit_claims_analysis_job(request: ClaimsAnalysisJobRequest, user=Depends(get_current_user)):
+    params = {"betterPrompt": request.betterPrompt, "bypassCache": request.bypassCache, "concurrency": request.concurrency}
+    job = await submit_job("claims-analysis", request.claimIds, params)
+    return job_status(job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user=Depends(get_current_user)):
+    job = await read_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
+
+# Results of the items finished so far, available while the job is still running
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    user=Depends(get_current_user),
+):
+    job = await read_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await job_results(job, offset, limit)
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str, user=Depends(get_current_user)):
+    job = await cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
+
 @app.post("/delete-claims")
 async def delete_claims(request: ClaimIdsRequest, user=Depends(get_current_user)):
     try:
-        for claim_id in request.claimIds:
-            delete_claim(claim_id)  # Implement this function in CRUD operations
-        return {"message": "Claims deleted successfully"}
+        # Every id gets its own status, a missing or failing claim doesn't abort the rest
+        result = await bulk_delete_claims(request.claimIds, get_blob_container_client() if request.deleteBlobs else None)
+        message = "Claims deleted successfully" if not result["failed"] else "Some claims could not be deleted"
+        return {"message": message, **result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
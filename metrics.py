@@ -0,0 +1,298 @@
+import bisect
+import os
+import threading
+import time
+from typing import Dict, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+from starlette.routing import Match
+from logger import logger
+
+# Prometheus metrics for the API and its upstreams (Cosmos, Blob Storage, the LLM server), rendered in
+# the text exposition format by GET /metrics. Recording is a dict lookup and an add under a per-metric
+# lock, nothing is formatted until a scrape.
+
+# When set, /metrics requires "Authorization: Bearer <token>", otherwise it is open for scrapers
+metrics_token = os.getenv("METRICS_TOKEN") or None
+
+# Seconds, from a cached Cosmos point read up to a slow LLM completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = ""):
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}" for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum, count], made cumulative at render time
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+registry = []
+
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served", ["method", "route"])
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, including streamed bodies", ["method", "route", "status"]
+)
+cosmos_request_duration = Histogram(
+    "cosmos_request_duration_seconds", "Cosmos DB request latency per attempt", ["operation", "status"]
+)
+cosmos_request_units = Counter("cosmos_request_units_total", "Request units charged by Cosmos DB", ["operation"])
+blob_request_duration = Histogram(
+    "blob_request_duration_seconds", "Blob Storage request latency per attempt", ["operation", "status"]
+)
+blob_bytes = Counter("blob_bytes_total", "Bytes sent to and received from Blob Storage", ["operation", "direction"])
+llm_request_duration = Histogram("llm_request_duration_seconds", "LLM server request latency", ["kind", "outcome"])
+llm_retries = Counter("llm_retries_total", "LLM requests repeated after a bad response", ["kind"])
+llm_json_parse_failures = Counter("llm_json_parse_failures_total", "LLM replies that were not valid JSON", ["kind"])
+llm_tokens = Counter("llm_tokens_total", "Tokens reported by the LLM server", ["kind", "type"])
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# (method, path) -> route label, matching walks every route's regex so repeat paths skip it
+_route_labels: Dict[Tuple[str, str], str] = {}
+ROUTE_LABEL_CACHE_SIZE = 4096
+
+
+# Route template ("/claims/{claim_id}") rather than the raw path so ids don't explode the label set
+def route_label(scope):
+    key = (scope["method"], scope["path"])
+    label = _route_labels.get(key)
+    if label is None:
+        if len(_route_labels) >= ROUTE_LABEL_CACHE_SIZE:
+            _route_labels.clear()
+        label = _route_labels[key] = _match_route(scope)
+    return label
+
+
+def _match_route(scope):
+    router = getattr(scope.get("app"), "router", None)
+    partial = None
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            # Right path, wrong method (a 405)
+            partial = route.path
+    return partial or "unmatched"
+
+
+# Plain ASGI middleware, BaseHTTPMiddleware would buffer streamed responses through an extra task
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method, route = scope["method"], route_label(scope)
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        http_requests_in_flight.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.observe(time.perf_counter() - started, method, route, status)
+            http_requests_in_flight.dec(method, route)
+
+
+# azure-core pipeline hooks, passed as raw_request_hook/raw_response_hook when the clients are built.
+# They run once per attempt (inside the retry policy), so throttled retries show up as their own 429s.
+def start_timer_hook(request):
+    request.context["metrics_started"] = time.perf_counter()
+
+
+def _elapsed(response):
+    started = response.context.get("metrics_started")
+    return time.perf_counter() - started if started is not None else None
+
+
+def cosmos_operation(request):
+    method = request.method
+    parts = urlsplit(request.url).path.strip("/").split("/")
+    # /dbs/{db}/colls/{coll}/docs is the feed, /dbs/{db}/colls/{coll}/docs/{id} a single document
+    resource = parts[-1] if len(parts) % 2 else parts[-2]
+    if resource != "docs":
+        return f"{method.lower()}_{resource or 'account'}"
+    if len(parts) % 2 == 0:
+        return {"GET": "read", "PUT": "replace", "PATCH": "patch", "DELETE": "delete"}.get(method, method.lower())
+    if method == "GET":
+        return "read_feed"
+    headers = request.headers
+    if headers.get("x-ms-documentdb-isquery", "").lower() == "true":
+        return "query"
+    if headers.get("x-ms-cosmos-is-query-plan-request", "").lower() == "true":
+        return "query_plan"
+    if headers.get("x-ms-documentdb-is-upsert", "").lower() == "true":
+        return "upsert"
+    return "create"
+
+
+def cosmos_response_hook(response):
+    try:
+        http_response = response.http_response
+        operation = cosmos_operation(response.http_request)
+        elapsed = _elapsed(response)
+        if elapsed is not None:
+            cosmos_request_duration.observe(elapsed, operation, str(http_response.status_code))
+        charge = http_response.headers.get("x-ms-request-charge")
+        if charge:
+            cosmos_request_units.inc(operation, amount=float(charge))
+    except Exception as e:
+        # Never let metrics fail the request they are measuring
+        logger.debug(f"Cosmos metrics hook failed: {str(e)}")
+
+
+def blob_operation(request):
+    comp = parse_qs(urlsplit(request.url).query).get("comp", [""])[0]
+    method = request.method
+    if comp == "block":
+        return "stage_block"
+    if comp == "blocklist":
+        return "commit_block_list"
+    if comp == "list":
+        return "list"
+    if comp:
+        return f"{method.lower()}_{comp}"
+    return {"GET": "download", "HEAD": "get_properties", "PUT": "upload", "DELETE": "delete"}.get(method, method.lower())
+
+
+def _content_length(headers):
+    try:
+        return int(headers.get("Content-Length") or 0)
+    except ValueError:
+        return 0
+
+
+def blob_response_hook(response):
+    try:
+        request, http_response = response.http_request, response.http_response
+        operation = blob_operation(request)
+        elapsed = _elapsed(response)
+        if elapsed is not None:
+            blob_request_duration.observe(elapsed, operation, str(http_response.status_code))
+        sent = _content_length(request.headers)
+        if sent:
+            blob_bytes.inc(operation, "sent", amount=sent)
+        # HEAD carries the blob's length without a body
+        received = _content_length(http_response.headers) if request.method != "HEAD" else 0
+        if received:
+            blob_bytes.inc(operation, "received", amount=received)
+    except Exception as e:
+        logger.debug(f"Blob metrics hook failed: {str(e)}")
+
+
+# Keyword arguments for the Azure SDK clients
+def cosmos_client_hooks():
+    return {"raw_request_hook": start_timer_hook, "raw_response_hook": cosmos_response_hook}
+
+
+def blob_client_hooks():
+    return {"raw_request_hook": start_timer_hook, "raw_response_hook": blob_response_hook}
+
+
+# Token usage from an OpenAI style completion response, when the server reports it
+def record_llm_usage(kind: str, response_data):
+    usage = response_data.get("usage") if isinstance(response_data, dict) else None
+    if not isinstance(usage, dict):
+        return
+    for token_type in ("prompt", "completion"):
+        count = usage.get(f"{token_type}_tokens")
+        if isinstance(count, int) and count > 0:
+            llm_tokens.inc(kind, token_type, amount=count)
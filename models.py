@@ -11,6 +11,14 @@ class GenerateClaimNotesRequest(BaseModel):
 
 class ProcessClaimsRequest(BaseModel):
     claimIds: List[str]
+    bypassCache: bool = False  # Skip cached LLM results for these claims
+    concurrency: Optional[int] = Field(default=None, ge=1)  # Overrides LLM_CONCURRENCY_LIMIT for this request
+
+class ClaimsAnalysisJobRequest(BaseModel):
+    claimIds: List[str]
+    betterPrompt: bool = False
+    bypassCache: bool = False
+    concurrency: Optional[int] = Field(default=None, ge=1)  # Overrides LLM_CONCURRENCY_LIMIT for this job
 
 class Policyholder(BaseModel):
     id: str
@@ -26,6 +34,7 @@ class AddClaimRequest(BaseModel):
 
 class ClaimIdsRequest(BaseModel):
     claimIds: List[str]
+    deleteBlobs: bool = False  # Also remove each deleted claim's file_blob_name from storage
     
 class AuthCode(BaseModel):
     code: str
\ No newline at end of file
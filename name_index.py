@@ -0,0 +1,175 @@
+import heapq
+import math
+import os
+import re
+import time
+from typing import Dict, Optional, Set
+from logger import logger
+
+# In-memory trigram index over policyholder names so search never scans the container.
+# Built at startup from a paged scan, kept current by the policyholder CRUD functions.
+name_index_page_size = int(os.getenv("NAME_INDEX_PAGE_SIZE", "1000"))
+# Minimum trigram similarity for a fuzzy (non-substring) match
+name_index_min_similarity = float(os.getenv("NAME_INDEX_MIN_SIMILARITY", "0.3"))
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_name(name) -> str:
+    return WHITESPACE.sub(" ", str(name or "")).strip().lower()
+
+
+def trigrams(text: str, padded: bool = False) -> Set[str]:
+    if padded:
+        # Padding gives the start and end of each word their own trigrams, which helps typo matching
+        text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bigrams(text: str) -> Set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class NameIndex:
+    def __init__(self):
+        self.docs: Dict[str, dict] = {}
+        self.names: Dict[str, str] = {}
+        self.grams: Dict[str, Set[str]] = {}
+        # Two-letter queries are too short for trigrams, they get their own small index
+        self.short_grams: Dict[str, Set[str]] = {}
+        self.padded_grams: Dict[str, Set[str]] = {}
+        self.padded_gram_counts: Dict[str, int] = {}
+        self.ready = False
+        self.built_at: Optional[float] = None
+        # Ids written while the startup scan runs, the scan's (possibly older) copy must not win
+        self._touched: Optional[Set[str]] = None
+
+    def _remove(self, id: str):
+        name = self.names.pop(id, None)
+        self.docs.pop(id, None)
+        self.padded_gram_counts.pop(id, None)
+        if name is None:
+            return
+        for index, grams in (
+            (self.grams, trigrams(name)),
+            (self.padded_grams, trigrams(name, padded=True)),
+            (self.short_grams, bigrams(name)),
+        ):
+            for gram in grams:
+                postings = index.get(gram)
+                if postings is not None:
+                    postings.discard(id)
+                    if not postings:
+                        del index[gram]
+
+    def _add(self, doc: dict):
+        id = doc["id"]
+        self._remove(id)
+        name = normalize_name(doc.get("name"))
+        self.docs[id] = doc
+        self.names[id] = name
+        for gram in trigrams(name):
+            self.grams.setdefault(gram, set()).add(id)
+        for gram in bigrams(name):
+            self.short_grams.setdefault(gram, set()).add(id)
+        padded = trigrams(name, padded=True)
+        self.padded_gram_counts[id] = len(padded)
+        for gram in padded:
+            self.padded_grams.setdefault(gram, set()).add(id)
+
+    def upsert(self, doc: dict):
+        if self._touched is not None:
+            self._touched.add(doc["id"])
+        self._add(doc)
+
+    def remove(self, id: str):
+        if self._touched is not None:
+            self._touched.add(id)
+        self._remove(id)
+
+    async def build(self):
+        # crud imports this module for its write paths, import lazily to avoid the cycle
+        from crud import POLICYHOLDERS_QUERY, stream_query_pages
+
+        started = time.perf_counter()
+        self._touched = set()
+        try:
+            async for page in stream_query_pages(POLICYHOLDERS_QUERY, None, name_index_page_size):
+                for doc in page:
+                    if doc["id"] not in self._touched:
+                        self._add(doc)
+            self.ready = True
+            self.built_at = time.time()
+        finally:
+            self._touched = None
+        logger.info(f"Policyholder name index built, {len(self.docs)} names in {time.perf_counter() - started:.2f}s")
+
+    # Ranked matches: exact name, name prefix, word prefix, other substrings (earlier is better),
+    # then fuzzy matches by trigram similarity for typos like "jonh smith"
+    def search(self, query: str, limit: Optional[int] = None):
+        query = normalize_name(query)
+        if not query:
+            return [self.docs[id] for id in self._top(self.names, self.names.get, limit)]
+
+        if len(query) == 1:
+            candidates = (id for id, name in self.names.items() if query in name)
+        elif len(query) == 2:
+            candidates = self.short_grams.get(query, ())
+        else:
+            # Every substring match contains all of the query's trigrams
+            postings = sorted((self.grams.get(gram, set()) for gram in trigrams(query)), key=len)
+            candidates = set.intersection(*postings) if postings else set()
+            candidates = (id for id in candidates if query in self.names[id])
+
+        scored = {}
+        for id in candidates:
+            name = self.names[id]
+            position = name.find(query)
+            if name == query:
+                rank = 0
+            elif position == 0:
+                rank = 1
+            elif name[position - 1] == " ":
+                rank = 2
+            else:
+                rank = 3
+            scored[id] = (rank, position, len(name), name)
+
+        if len(query) >= 3 and (limit is None or len(scored) < limit):
+            query_grams = trigrams(query, padded=True)
+            postings = sorted((self.padded_grams.get(gram, set()) for gram in query_grams), key=len)
+            # A name reaching the similarity threshold shares at least `needed` trigrams with the query,
+            # so it must be in one of the len - needed + 1 rarest postings. Common grams are only probed.
+            needed = max(math.ceil(name_index_min_similarity * len(query_grams)), 1)
+            candidates = set().union(*postings[:len(postings) - needed + 1]) - scored.keys()
+            for id in candidates:
+                count = sum(1 for posting in postings if id in posting)
+                # Jaccard similarity of the padded trigram sets
+                similarity = count / (len(query_grams) + self.padded_gram_counts[id] - count)
+                if similarity >= name_index_min_similarity:
+                    scored[id] = (4, -similarity, len(self.names[id]), self.names[id])
+
+        return [self.docs[id] for id in self._top(scored, scored.get, limit)]
+
+    # The best `limit` ids without sorting every match
+    def _top(self, ids, key, limit: Optional[int]):
+        return sorted(ids, key=key) if limit is None else heapq.nsmallest(limit, ids, key=key)
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "names": len(self.docs),
+            "trigrams": len(self.grams),
+            "built_at": self.built_at,
+        }
+
+
+name_index = NameIndex()
+
+
+async def build_name_index():
+    try:
+        await name_index.build()
+    except Exception as e:
+        # Search keeps using Cosmos until a later restart builds the index
+        logger.error(f"Error building policyholder name index: {str(e)}")
@@ -0,0 +1,207 @@
+import asyncio
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Optional
+from logger import logger
+from metrics import route_label
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler  # optional, statistical profiler with an HTML flame view
+except ImportError:
+    SamplingProfiler = None
+
+# Opt-in per-request profiling. A request is profiled when PROFILING_ENABLED is on and it either
+# carries "X-Profile-Request: <PROFILE_ADMIN_TOKEN>" or is picked by PROFILE_SAMPLE_RATE.
+# Output is pyinstrument HTML when pyinstrument is installed, cProfile pstats otherwise.
+profiling_enabled = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# The header does nothing unless a token is configured, otherwise anyone could trigger profiles
+profile_admin_token = os.getenv("PROFILE_ADMIN_TOKEN") or None
+profile_dir = os.getenv("PROFILE_DIR", "profiles")
+# Ring buffer size, the oldest profiles are deleted past it
+profile_max_files = int(os.getenv("PROFILE_MAX_FILES", "100"))
+# Seconds between pyinstrument samples
+profile_interval = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+PROFILE_HEADER = b"x-profile-request"
+PROFILE_ID_RE = re.compile(r"^[0-9]{13}-[A-Za-z0-9_-]{1,64}$")
+_request_id_re = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# cProfile hooks the whole thread, so on the event loop it also sees every other request that runs
+# while this one awaits. One profile at a time keeps that bleed-through to a single request's window.
+_active = threading.Lock()
+_ring_lock = threading.Lock()
+
+
+def should_profile(headers: dict):
+    if not profiling_enabled:
+        return False
+    token = headers.get(PROFILE_HEADER)
+    if token is not None and profile_admin_token and hmac.compare_digest(token, profile_admin_token.encode()):
+        return True
+    return profile_sample_rate > 0 and random.random() < profile_sample_rate
+
+
+def request_id_from(headers: dict):
+    request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+    return request_id if _request_id_re.match(request_id) else uuid.uuid4().hex
+
+
+class RequestProfiler:
+    def __init__(self):
+        if SamplingProfiler is not None:
+            self.kind, self.extension = "pyinstrument", "html"
+            self._profiler = SamplingProfiler(interval=profile_interval, async_mode="enabled")
+        else:
+            self.kind, self.extension = "cprofile", "pstats"
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    # Rendering the HTML or pstats is CPU heavy, called off the event loop
+    def write(self, path: str):
+        if self.kind == "pyinstrument":
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(self._profiler.output_html())
+        else:
+            self._profiler.dump_stats(path)
+
+
+def save_profile(profiler: RequestProfiler, profile_id: str, meta: dict):
+    os.makedirs(profile_dir, exist_ok=True)
+    file_name = f"{profile_id}.{profiler.extension}"
+    temp_path = os.path.join(profile_dir, f".{file_name}.tmp")
+    profiler.write(temp_path)
+    meta = {**meta, "profile_id": profile_id, "profiler": profiler.kind, "file": file_name,
+            "size": os.path.getsize(temp_path)}
+    with _ring_lock:
+        os.replace(temp_path, os.path.join(profile_dir, file_name))
+        # The metadata goes last, a profile is only listed once its output is in place
+        with open(os.path.join(profile_dir, f"{profile_id}.json"), "w") as file:
+            json.dump(meta, file)
+        _trim_ring_buffer()
+
+
+# Profile ids start with a millisecond timestamp, so name order is age order
+def _trim_ring_buffer():
+    files = {}
+    for name in os.listdir(profile_dir):
+        if not name.startswith("."):
+            files.setdefault(name.split(".", 1)[0], []).append(name)
+    profile_ids = sorted(files)
+    for profile_id in profile_ids[:max(len(profile_ids) - profile_max_files, 0)]:
+        for name in files[profile_id]:
+            try:
+                os.remove(os.path.join(profile_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def read_profile_meta(profile_id: str) -> Optional[dict]:
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(profile_dir, f"{profile_id}.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Newest first, optionally only one route ("/analyze-claims") or one request id
+def list_profiles(route: Optional[str] = None, request_id: Optional[str] = None):
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(profile_dir), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        meta = read_profile_meta(name[:-5])
+        if meta is None:
+            continue
+        if route is not None and meta.get("route") != route:
+            continue
+        if request_id is not None and meta.get("request_id") != request_id:
+            continue
+        profiles.append(meta)
+    return profiles
+
+
+def profile_file_path(profile_id: str) -> Optional[str]:
+    meta = read_profile_meta(profile_id)
+    if meta is None:
+        return None
+    path = os.path.join(profile_dir, meta["file"])
+    return path if os.path.isfile(path) else None
+
+
+# Plain ASGI middleware like MetricsMiddleware. Profiled responses carry X-Profile-Id.
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiling_enabled:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not should_profile(headers) or not _active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = request_id_from(headers)
+        profile_id = f"{int(time.time() * 1000):013d}-{request_id}"
+        status = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        try:
+            profiler = RequestProfiler()
+            profiler.start()
+        except Exception as e:
+            _active.release()
+            logger.error(f"Starting the profiler failed: {str(e)}")
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            # Failed requests are kept too, they are often the ones worth looking at
+            profiler.stop()
+            _active.release()
+            meta = {
+                "request_id": request_id,
+                "method": scope["method"],
+                "route": route_label(scope),
+                "path": scope["path"],
+                "status": status,
+                "duration_seconds": round(time.perf_counter() - started, 4),
+                "created_at": time.time(),
+            }
+            try:
+                # The response has already gone out, only the profile is lost if this fails
+                await asyncio.to_thread(save_profile, profiler, profile_id, meta)
+            except Exception as e:
+                logger.error(f"Saving profile {profile_id} failed: {str(e)}")
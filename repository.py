@@ -0,0 +1,77 @@
+import os
+from typing import Any, Iterable, List, Optional, Protocol, Tuple
+
+# Storage the app runs against. "cosmos" is Azure Cosmos DB plus Blob Storage. "local" is a SQLite
+# file plus a directory tree under LOCAL_STORAGE_PATH, for running and profiling without Azure.
+storage_backend = os.getenv("STORAGE_BACKEND", "cosmos").lower()
+local_storage_path = os.getenv("LOCAL_STORAGE_PATH", "local_storage")
+
+STORAGE_BACKENDS = ("cosmos", "local")
+if storage_backend not in STORAGE_BACKENDS:
+    raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(STORAGE_BACKENDS)}, got {storage_backend!r}")
+
+
+# The document operations the app uses. The azure.cosmos.aio ContainerProxy provides them as is,
+# sqlite_repository.AsyncSqliteContainer is the local implementation. Queries are Cosmos SQL.
+class DocumentContainer(Protocol):
+    async def upsert_item(self, body: dict, **kwargs) -> dict: ...
+
+    async def create_item(self, body: dict, **kwargs) -> dict: ...
+
+    async def read_item(self, item: str, partition_key: Any, **kwargs) -> dict: ...
+
+    async def read_items(self, items: List[Tuple[str, Any]], **kwargs) -> List[dict]: ...
+
+    async def patch_item(self, item: str, partition_key: Any, patch_operations: List[dict], **kwargs) -> dict: ...
+
+    async def delete_item(self, item: str, partition_key: Any, **kwargs) -> None: ...
+
+    # Async iterable of results, by_page(continuation) pages through them
+    def query_items(self, query: str, parameters: Optional[list] = None, max_item_count: Optional[int] = None, **kwargs): ...
+
+    # Async iterable of opaque feed ranges, query_items(feed_range=...) keeps a query inside one of them
+    def read_feed_ranges(self, **kwargs): ...
+
+
+# The blob container operations the app uses, azure.storage.blob.ContainerClient or
+# local_blob_storage.LocalBlobContainerClient. get_blob_client returns a BlobClient-like object
+# (get_blob_properties, download_blob, upload_blob, stage_block, commit_block_list, delete_blob).
+class BlobContainer(Protocol):
+    def get_blob_client(self, blob: str) -> Any: ...
+
+    def list_blobs(self, name_starts_with: Optional[str] = None, include: Optional[Iterable[str]] = None, **kwargs) -> Any: ...
+
+    def delete_blob(self, blob: str, **kwargs) -> None: ...
+
+
+def local_documents_path():
+    return os.path.join(local_storage_path, "documents.sqlite3")
+
+
+def local_blobs_path():
+    return os.path.join(local_storage_path, "blobs")
+
+
+# Sync SQLite container shared by every local caller in the process, the async one wraps it
+_local_container = None
+
+
+def local_sync_container():
+    global _local_container
+    if _local_container is None:
+        from sqlite_repository import SqliteContainer
+
+        _local_container = SqliteContainer(local_documents_path())
+    return _local_container
+
+
+def local_async_container():
+    from sqlite_repository import AsyncSqliteContainer
+
+    return AsyncSqliteContainer(local_sync_container())
+
+
+def local_blob_container(container_name: str):
+    from local_blob_storage import LocalBlobContainerClient
+
+    return LocalBlobContainerClient(local_blobs_path(), container_name)
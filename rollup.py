@@ -0,0 +1,129 @@
+import datetime
+from typing import Iterable, Optional, Tuple
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from analysis_columns import normalize_claim_amount
+from bulk_operations import MAX_PATCH_OPERATIONS
+from database import get_async_container
+from logger import logger
+
+# Materialised per-category counts/totals for each analysis source, kept in the claims container.
+# doc_type keeps it out of the policyholder queries.
+ROLLUP_ID = "analytics-rollup"
+ROLLUP_DOC_TYPE = "analytics_rollup"
+ROLLUP_SOURCES = {"textfile_analysis": "textfile", "gptmsg_analysis": "gptmsg"}
+
+
+# (source, category) -> (count, total) that one claim's analysis adds to the rollup
+def analysis_contribution(analysis_data: Optional[dict]):
+    contribution = {}
+    for source in ROLLUP_SOURCES:
+        data = (analysis_data or {}).get(source) or {}
+        category = data.get('Claims Category')
+        amount = data.get('Claim Amount')
+        # Same rules as crud.aggregate_claim_categories so a rebuild gives the same numbers
+        if not isinstance(category, str) or not category or amount is None:
+            continue
+        try:
+            contribution[(source, category)] = (1, float(normalize_claim_amount(amount)))
+        except (TypeError, ValueError):
+            continue
+    return contribution
+
+
+# JSON pointer escaping, categories like "Theft/Burglary" contain a slash
+def _pointer(*parts: str):
+    return "/" + "/".join(part.replace("~", "~0").replace("/", "~1") for part in parts)
+
+
+# Summed (count, total) changes for a set of (old_analysis, new_analysis) pairs
+def rollup_deltas(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    deltas = {}
+    for old_analysis, new_analysis in changes:
+        for sign, analysis in ((1, new_analysis), (-1, old_analysis)):
+            for key, (count, total) in analysis_contribution(analysis).items():
+                current_count, current_total = deltas.get(key, (0, 0.0))
+                deltas[key] = (current_count + sign * count, current_total + sign * total)
+    return deltas
+
+
+def rollup_operations(old_analysis: Optional[dict] = None, new_analysis: Optional[dict] = None, claims_delta: int = 0):
+    return deltas_to_operations(rollup_deltas([(old_analysis, new_analysis)]), claims_delta)
+
+
+def deltas_to_operations(deltas: dict, claims_delta: int = 0):
+    operations = []
+    if claims_delta:
+        operations.append({"op": "incr", "path": "/claim_count", "value": claims_delta})
+    for (source, category), (count, total) in deltas.items():
+        prefix = ROLLUP_SOURCES[source]
+        if count:
+            operations.append({"op": "incr", "path": _pointer(f"{prefix}_counts", category), "value": count})
+        if total:
+            operations.append({"op": "incr", "path": _pointer(f"{prefix}_totals", category), "value": total})
+    return operations
+
+
+# Applies the change between a claim's old and new analysis (and any created/deleted claims) to the rollup.
+# incr is atomic on the server so concurrent writers don't lose updates.
+async def apply_rollup_delta(old_analysis: Optional[dict] = None, new_analysis: Optional[dict] = None, claims_delta: int = 0):
+    await apply_rollup_changes([(old_analysis, new_analysis)], claims_delta)
+
+
+# Same for many claims at once (bulk deletes, batch writebacks), one patch per 10 changed counters
+async def apply_rollup_changes(changes: Iterable[Tuple[Optional[dict], Optional[dict]]], claims_delta: int = 0):
+    operations = deltas_to_operations(rollup_deltas(changes), claims_delta)
+    if not operations:
+        return
+    container = get_async_container()
+    try:
+        for start in range(0, len(operations), MAX_PATCH_OPERATIONS):
+            await container.patch_item(
+                item=ROLLUP_ID,
+                partition_key=ROLLUP_ID,
+                patch_operations=operations[start:start + MAX_PATCH_OPERATIONS],
+            )
+    except CosmosResourceNotFoundError:
+        # Nothing to increment yet, the first read of /analyze-claims builds it from scratch
+        logger.info("Analytics rollup not built yet, skipping incremental update")
+    except Exception as e:
+        # The rollup can drift here, /analyze-claims/rebuild fixes it
+        logger.error(f"Error updating analytics rollup: {str(e)}")
+
+
+# Full recount, uses the aggregation queries so it stays O(categories) in transferred data
+async def rebuild_rollup():
+    # crud imports this module for its write paths, import lazily to avoid the cycle
+    from crud import aggregate_claim_categories, query_value
+
+    rollup = {
+        "id": ROLLUP_ID,
+        "doc_type": ROLLUP_DOC_TYPE,
+        "claim_count": await query_value("SELECT VALUE COUNT(1) FROM c WHERE IS_DEFINED(c.policyholder_id)") or 0,
+        "rebuilt_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    for source, prefix in ROLLUP_SOURCES.items():
+        counts, averages = await aggregate_claim_categories(source)
+        rollup[f"{prefix}_counts"] = counts
+        rollup[f"{prefix}_totals"] = {category: averages[category] * counts[category] for category in counts}
+    await get_async_container().upsert_item(rollup)
+    return rollup
+
+
+async def read_rollup():
+    try:
+        return await get_async_container().read_item(item=ROLLUP_ID, partition_key=ROLLUP_ID)
+    except CosmosResourceNotFoundError:
+        return await rebuild_rollup()
+
+
+# Rollup in the same shape /analyze-claims has always returned
+def rollup_summary(rollup: dict):
+    summary = {"claim_count": rollup.get("claim_count", 0)}
+    for prefix in ROLLUP_SOURCES.values():
+        counts = rollup.get(f"{prefix}_counts", {})
+        totals = rollup.get(f"{prefix}_totals", {})
+        # Categories whose claims were all deleted or re-analysed stay behind at zero
+        live = {category: count for category, count in counts.items() if count > 0}
+        summary[f"{prefix}_category_counts"] = live
+        summary[f"{prefix}_category_averages"] = {category: totals.get(category, 0) / count for category, count in live.items()}
+    return summary
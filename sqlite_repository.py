@@ -0,0 +1,645 @@
+import asyncio
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+
+# Local stand-in for the Cosmos container: documents live as JSON in one SQLite table and the Cosmos SQL
+# the app sends is translated to SQLite. Only the subset of Cosmos SQL used in this repo is supported.
+# Fields the queries filter on are real (generated, indexed) columns, so lookups by policyholder,
+# name, doc_type or analysis category stay indexed however many documents are loaded.
+INDEXED_FIELDS = {
+    ("policyholder_id",): "policyholder_id",
+    ("name",): "name",
+    ("doc_type",): "doc_type",
+    ("analysis", "textfile_analysis", "Claims Category"): "textfile_category",
+    ("analysis", "gptmsg_analysis", "Claims Category"): "gptmsg_category",
+}
+
+# Results per page when the caller doesn't pass max_item_count
+default_page_size = 1000
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+      (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<param>@\w+)
+    | (?P<name>[A-Za-z_]\w*)
+    | (?P<op>!=|<>|<=|>=|[=<>(),.\[\]*])
+    )""", re.VERBOSE)
+
+KEYWORDS = {"SELECT", "DISTINCT", "VALUE", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "AS", "ORDER", "GROUP", "BY",
+            "ASC", "DESC", "OFFSET", "LIMIT", "TRUE", "FALSE", "NULL"}
+AGGREGATES = {"COUNT", "SUM", "MIN", "MAX", "AVG"}
+
+
+def bad_request(message: str):
+    return CosmosHttpResponseError(status_code=400, message=message)
+
+
+def tokenize(query: str):
+    tokens, position = [], 0
+    query = query.rstrip()
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if not match or match.end() == position:
+            raise bad_request(f"Unsupported query syntax near: {query[position:position + 20]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name" and value.upper() in KEYWORDS:
+            kind, value = "keyword", value.upper()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+# Body of a '...' or "..." literal with its backslash escapes resolved
+def unquote(literal: str):
+    return re.sub(r"\\(.)", lambda match: match.group(1), literal[1:-1])
+
+
+def json_path(keys: Tuple[str, ...]):
+    parts = ["$"]
+    for key in keys:
+        parts.append(f".{key}" if re.fullmatch(r"[A-Za-z_]\w*", key) else '."' + key.replace('"', '\\"') + '"')
+    return "".join(parts)
+
+
+def sql_string(text: str):
+    return "'" + text.replace("'", "''") + "'"
+
+
+class Expr:
+    # sql gives the SQL value, path is set for document paths, aggregate marks COUNT/SUM/...
+    def __init__(self, sql: str, path: Optional[Tuple[str, ...]] = None, aggregate: bool = False):
+        self.sql = sql
+        self.path = path
+        self.aggregate = aggregate
+
+    # As a result column: paths come back as JSON text so objects, arrays and booleans survive
+    def projection(self):
+        if self.path is not None:
+            return f"doc -> {sql_string(json_path(self.path))}"
+        return self.sql
+
+
+def path_expr(path: Tuple[str, ...]):
+    # c.id is the table's primary key
+    if path == ("id",):
+        return Expr("id", path)
+    if path in INDEXED_FIELDS:
+        return Expr(INDEXED_FIELDS[path], path)
+    return Expr(f"json_extract(doc, {sql_string(json_path(path))})", path)
+
+
+class CosmosQueryTranslator:
+    def __init__(self, query: str):
+        self.tokens = tokenize(query)
+        self.position = 0
+        self.params = set()
+
+    def peek(self, offset: int = 0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def accept(self, kind: str, value: Optional[str] = None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return token[1]
+        return None
+
+    def expect(self, kind: str, value: Optional[str] = None):
+        result = self.accept(kind, value)
+        if result is None:
+            raise bad_request(f"Expected {value or kind} in query, found {self.peek()[1]!r}")
+        return result
+
+    def translate(self):
+        self.expect("keyword", "SELECT")
+        distinct = bool(self.accept("keyword", "DISTINCT"))
+        select = {"distinct": distinct, "value": None, "star": False, "columns": []}
+        if self.accept("keyword", "VALUE"):
+            select["value"] = self.expression()
+        elif self.accept("op", "*"):
+            select["star"] = True
+        else:
+            while True:
+                expr = self.expression()
+                alias = self.expect("name") if self.accept("keyword", "AS") else None
+                if alias is None:
+                    if expr.path is None:
+                        raise bad_request("Computed columns need an alias")
+                    alias = expr.path[-1]
+                select["columns"].append((alias, expr))
+                if not self.accept("op", ","):
+                    break
+        self.expect("keyword", "FROM")
+        self.expect("name", "c")
+        where = self.expression().sql if self.accept("keyword", "WHERE") else None
+        group_by = []
+        if self.accept("keyword", "GROUP"):
+            self.expect("keyword", "BY")
+            while True:
+                group_by.append(self.expression().sql)
+                if not self.accept("op", ","):
+                    break
+        order_by = []
+        if self.accept("keyword", "ORDER"):
+            self.expect("keyword", "BY")
+            while True:
+                expr = self.expression()
+                direction = self.accept("keyword", "DESC") or (self.accept("keyword", "ASC") and "") or ""
+                order_by.append(f"{expr.sql} {direction}".strip())
+                if not self.accept("op", ","):
+                    break
+        offset = limit = None
+        if self.accept("keyword", "OFFSET"):
+            offset = self.primary().sql
+            self.expect("keyword", "LIMIT")
+            limit = self.primary().sql
+        if self.position != len(self.tokens):
+            raise bad_request(f"Unexpected {self.peek()[1]!r} in query")
+        return TranslatedQuery(select, where, group_by, order_by, offset, limit, self.params)
+
+    def expression(self):
+        left = self.conjunction()
+        while self.accept("keyword", "OR"):
+            left = Expr(f"({left.sql} OR {self.conjunction().sql})")
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.accept("keyword", "AND"):
+            left = Expr(f"({left.sql} AND {self.negation().sql})")
+        return left
+
+    def negation(self):
+        if self.accept("keyword", "NOT"):
+            return Expr(f"(NOT {self.negation().sql})")
+        return self.comparison()
+
+    def comparison(self):
+        left = self.primary()
+        if self.accept("keyword", "IN"):
+            self.expect("op", "(")
+            values = [self.primary().sql]
+            while self.accept("op", ","):
+                values.append(self.primary().sql)
+            self.expect("op", ")")
+            return Expr(f"({left.sql} IN ({', '.join(values)}))")
+        for op in ("=", "!=", "<>", "<=", ">=", "<", ">"):
+            if self.accept("op", op):
+                return Expr(f"({left.sql} {'!=' if op == '<>' else op} {self.primary().sql})")
+        return left
+
+    def primary(self):
+        kind, value = self.peek()
+        if self.accept("op", "("):
+            expr = self.expression()
+            self.expect("op", ")")
+            return expr
+        if kind == "string":
+            self.position += 1
+            return Expr(sql_string(unquote(value)))
+        if kind == "number":
+            self.position += 1
+            return Expr(value)
+        if kind == "param":
+            self.position += 1
+            self.params.add(value[1:])
+            return Expr(f":{value[1:]}")
+        if kind == "keyword" and value in ("TRUE", "FALSE", "NULL"):
+            self.position += 1
+            return Expr({"TRUE": "1", "FALSE": "0", "NULL": "NULL"}[value])
+        if kind == "name" and value == "c" and self.peek(1)[1] in (".", "["):
+            return path_expr(self.path())
+        if kind == "name" and self.peek(1)[1] == "(":
+            self.position += 2
+            return self.function(value.upper())
+        raise bad_request(f"Unsupported query syntax near {value!r}")
+
+    def path(self):
+        self.expect("name", "c")
+        keys = []
+        while True:
+            if self.accept("op", "."):
+                keys.append(self.expect("name"))
+            elif self.accept("op", "["):
+                keys.append(unquote(self.expect("string")))
+                self.expect("op", "]")
+            else:
+                return tuple(keys)
+
+    def arguments(self):
+        args = []
+        if not self.accept("op", ")"):
+            args.append(self.expression() if not self.accept("op", "*") else Expr("*"))
+            while self.accept("op", ","):
+                args.append(self.expression())
+            self.expect("op", ")")
+        return args
+
+    def function(self, name: str):
+        args = self.arguments()
+        if name in AGGREGATES:
+            argument = "*" if name == "COUNT" else args[0].sql
+            return Expr(f"{name}({argument})", aggregate=True)
+        if name in ("IS_DEFINED", "IS_NUMBER", "IS_STRING", "IS_BOOL", "IS_NULL", "IS_OBJECT", "IS_ARRAY"):
+            path = args[0].path
+            if path is None:
+                raise bad_request(f"{name} is only supported on document paths")
+            if name == "IS_DEFINED" and path in INDEXED_FIELDS:
+                # Answered from the indexed column, a stored JSON null counts as undefined here
+                return Expr(f"({INDEXED_FIELDS[path]} IS NOT NULL)")
+            json_type = f"json_type(doc, {sql_string(json_path(path))})"
+            return Expr({
+                "IS_DEFINED": f"({json_type} IS NOT NULL)",
+                "IS_NUMBER": f"({json_type} IN ('integer', 'real'))",
+                "IS_STRING": f"({json_type} = 'text')",
+                "IS_BOOL": f"({json_type} IN ('true', 'false'))",
+                "IS_NULL": f"({json_type} = 'null')",
+                "IS_OBJECT": f"({json_type} = 'object')",
+                "IS_ARRAY": f"({json_type} = 'array')",
+            }[name])
+        if name == "ARRAY_CONTAINS":
+            array, value = args[0], args[1]
+            if array.path is not None:
+                return Expr(f"EXISTS (SELECT 1 FROM json_each(doc, {sql_string(json_path(array.path))}) WHERE value = {value.sql})")
+            return Expr(f"({value.sql} IN (SELECT value FROM json_each({array.sql})))")
+        if name == "CONTAINS":
+            return Expr(f"(instr({args[0].sql}, {args[1].sql}) > 0)")
+        if name == "STARTSWITH":
+            return Expr(f"(substr({args[0].sql}, 1, length({args[1].sql})) = {args[1].sql})")
+        if name in ("LOWER", "UPPER", "LENGTH"):
+            return Expr(f"{name.lower()}({args[0].sql})")
+        raise bad_request(f"Unsupported function {name}")
+
+
+class TranslatedQuery:
+    def __init__(self, select: dict, where: Optional[str], group_by: List[str], order_by: List[str], offset, limit,
+                 params: set):
+        self.select = select
+        self.where = where
+        self.group_by = group_by
+        self.order_by = order_by
+        self.offset = offset
+        self.limit = limit
+        self.params = params
+        value = select["value"]
+        self.aggregate = bool(group_by) or (value is not None and value.aggregate) or any(
+            expr.aggregate for _, expr in select["columns"]
+        )
+        # Plain filtered scans page by rowid, everything else (ordered, distinct, aggregates) by offset
+        self.keyset = not (order_by or select["distinct"] or self.aggregate or limit is not None)
+
+    def columns(self):
+        if self.select["star"]:
+            return "doc"
+        if self.select["value"] is not None:
+            return self.select["value"].projection()
+        return ", ".join(expr.projection() for _, expr in self.select["columns"])
+
+    def sql(self):
+        distinct = "DISTINCT " if self.select["distinct"] else ""
+        keyset_column = "rowid, " if self.keyset else ""
+        sql = f"SELECT {distinct}{keyset_column}{self.columns()} FROM documents"
+        conditions = [self.where] if self.where else []
+        if self.keyset:
+            conditions.append("rowid > :_after")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if self.keyset:
+            return sql + " ORDER BY rowid LIMIT :_limit"
+        if self.group_by:
+            sql += " GROUP BY " + ", ".join(self.group_by)
+        if self.order_by:
+            sql += " ORDER BY " + ", ".join(self.order_by)
+        if self.limit is not None:
+            sql += f" LIMIT {self.limit} OFFSET {self.offset}"
+        return f"SELECT * FROM ({sql}) LIMIT :_limit OFFSET :_offset"
+
+    def row_to_item(self, row):
+        if self.select["star"]:
+            return json.loads(row[0])
+        if self.select["value"] is not None:
+            value = row[0]
+            if self.select["value"].path is None:
+                return value
+            # Undefined values are left out of the results like Cosmos does
+            return json.loads(value) if value is not None else undefined
+        item = {}
+        for (alias, expr), value in zip(self.select["columns"], row):
+            if expr.path is None:
+                item[alias] = value
+            elif value is not None:
+                item[alias] = json.loads(value)
+        return item
+
+
+undefined = object()
+
+
+def sql_parameters(parameters: Optional[list]):
+    values = {}
+    for parameter in parameters or []:
+        value = parameter["value"]
+        # Arrays and objects are only used through json_each/ARRAY_CONTAINS, pass them as JSON text
+        values[parameter["name"].lstrip("@")] = json.dumps(value) if isinstance(value, (list, dict)) else value
+    return values
+
+
+def parse_pointer(path: str):
+    if not path.startswith("/"):
+        raise bad_request(f"Invalid patch path {path}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def apply_patch_operation(doc: dict, operation: dict):
+    keys = parse_pointer(operation["path"])
+    parent = doc
+    for key in keys[:-1]:
+        parent = parent[int(key)] if isinstance(parent, list) else parent.get(key)
+        if not isinstance(parent, (dict, list)):
+            raise bad_request(f"Patch path {operation['path']} does not exist")
+    key, op, value = keys[-1], operation["op"], operation.get("value")
+    if isinstance(parent, list):
+        if op == "add":
+            parent.insert(len(parent) if key == "-" else int(key), value)
+        elif op in ("set", "replace"):
+            parent[int(key)] = value
+        elif op == "remove":
+            del parent[int(key)]
+        elif op == "incr":
+            parent[int(key)] += value
+        return
+    if op in ("remove", "replace") and key not in parent:
+        raise bad_request(f"Patch path {operation['path']} does not exist")
+    if op in ("set", "add", "replace"):
+        parent[key] = value
+    elif op == "remove":
+        del parent[key]
+    elif op == "incr":
+        current = parent.get(key, 0)
+        if not isinstance(current, (int, float)) or isinstance(current, bool):
+            raise bad_request(f"Cannot increment non-numeric value at {operation['path']}")
+        parent[key] = current + value
+    else:
+        raise bad_request(f"Unsupported patch operation {op}")
+
+
+def not_found(id: str):
+    return CosmosResourceNotFoundError(status_code=404, message=f"Entity with the specified id {id} does not exist in the system.")
+
+
+class SqliteContainer:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        generated = ", ".join(
+            f"{column} GENERATED ALWAYS AS (json_extract(doc, {sql_string(json_path(keys))})) VIRTUAL"
+            for keys, column in INDEXED_FIELDS.items()
+        )
+        connection = self._connection()
+        connection.execute(f"CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, doc TEXT NOT NULL, {generated})")
+        for column in INDEXED_FIELDS.values():
+            connection.execute(f"CREATE INDEX IF NOT EXISTS documents_{column} ON documents ({column})")
+        # Translated query text is reused for every page of a scan
+        self._translated: Dict[str, TranslatedQuery] = {}
+
+    # One connection per thread, the async wrapper runs calls on the default executor's threads
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=30000")
+            self._local.connection = connection
+            self._connections.append(connection)
+        return connection
+
+    def _stamp(self, body: dict):
+        doc = copy.deepcopy(body)
+        doc["_etag"] = f'"{uuid.uuid4()}"'
+        doc["_ts"] = int(time.time())
+        return doc
+
+    def _read(self, connection, id: str):
+        row = connection.execute("SELECT doc FROM documents WHERE id = ?", (id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, connection, doc: dict):
+        connection.execute(
+            "INSERT INTO documents (id, doc) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET doc = excluded.doc",
+            (doc["id"], json.dumps(doc)),
+        )
+
+    def upsert_item(self, body: dict, response_hook=None, **kwargs):
+        doc = self._stamp(body)
+        self._write(self._connection(), doc)
+        if response_hook:
+            response_hook({}, doc)
+        return doc
+
+    def create_item(self, body: dict, response_hook=None, **kwargs):
+        doc = self._stamp(body)
+        try:
+            self._connection().execute("INSERT INTO documents (id, doc) VALUES (?, ?)", (doc["id"], json.dumps(doc)))
+        except sqlite3.IntegrityError:
+            raise CosmosResourceExistsError(status_code=409, message=f"Entity with the specified id {doc['id']} already exists.")
+        if response_hook:
+            response_hook({}, doc)
+        return doc
+
+    def read_item(self, item: str, partition_key=None, etag: Optional[str] = None, match_condition=None, **kwargs):
+        doc = self._read(self._connection(), item)
+        if doc is None:
+            raise not_found(item)
+        if match_condition == MatchConditions.IfModified and etag == doc.get("_etag"):
+            # Same as a Cosmos 304, no body
+            return {}
+        return doc
+
+    def read_items(self, items: List[Tuple[str, str]], **kwargs):
+        ids = [id for id, _ in items]
+        rows = self._connection().execute(
+            "SELECT doc FROM documents WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def patch_item(self, item: str, partition_key=None, patch_operations: Optional[list] = None, etag: Optional[str] = None,
+                   match_condition=None, response_hook=None, **kwargs):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            doc = self._read(connection, item)
+            if doc is None:
+                raise not_found(item)
+            if match_condition == MatchConditions.IfNotModified and etag != doc.get("_etag"):
+                raise CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+            for operation in patch_operations or []:
+                apply_patch_operation(doc, operation)
+            doc = self._stamp(doc)
+            self._write(connection, doc)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if response_hook:
+            response_hook({}, doc)
+        return doc
+
+    def delete_item(self, item: str, partition_key=None, **kwargs):
+        if self._connection().execute("DELETE FROM documents WHERE id = ?", (item,)).rowcount == 0:
+            raise not_found(item)
+
+    # One page of results and the continuation for the next one (None after the last page)
+    def query_page(self, query: str, parameters: Optional[list], page_size: int, continuation: Optional[str] = None):
+        translated = self._translated.get(query)
+        if translated is None:
+            translated = self._translated[query] = CosmosQueryTranslator(query).translate()
+        values = sql_parameters(parameters)
+        missing = translated.params - values.keys()
+        if missing:
+            raise bad_request(f"Missing query parameters: {', '.join(sorted(missing))}")
+        token = json.loads(continuation) if continuation else {}
+        values["_limit"] = page_size
+        if translated.keyset:
+            values["_after"] = token.get("rowid", 0)
+        else:
+            values["_offset"] = token.get("offset", 0)
+        rows = self._connection().execute(translated.sql(), values).fetchall()
+        if translated.keyset:
+            items = [translated.row_to_item(row[1:]) for row in rows]
+            next_token = {"rowid": rows[-1][0]} if len(rows) == page_size else None
+        else:
+            items = [translated.row_to_item(row) for row in rows]
+            next_token = {"offset": values["_offset"] + len(rows)} if len(rows) == page_size else None
+        items = [item for item in items if item is not undefined]
+        return items, json.dumps(next_token) if next_token else None
+
+    def query_items(self, query: str, parameters: Optional[list] = None, max_item_count: Optional[int] = None, **kwargs):
+        return QueryIterable(self, query, parameters, max_item_count or default_page_size)
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+        self._local = threading.local()
+
+
+class QueryPager:
+    def __init__(self, iterable, continuation_token: Optional[str]):
+        self.iterable = iterable
+        self.continuation_token = continuation_token
+        self._done = False
+
+    def _next_page(self):
+        if self._done:
+            return None
+        items, self.continuation_token = self.iterable.container.query_page(
+            self.iterable.query, self.iterable.parameters, self.iterable.page_size, self.continuation_token
+        )
+        self._done = self.continuation_token is None
+        return items
+
+    def __iter__(self):
+        while True:
+            items = self._next_page()
+            if items is None:
+                return
+            yield items
+
+    async def __aiter__(self):
+        while True:
+            items = await asyncio.to_thread(self._next_page)
+            if items is None:
+                return
+            yield AsyncPage(items)
+
+
+class AsyncPage:
+    def __init__(self, items: list):
+        self.items = items
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+
+# What query_items returns, iterates every result (sync or async) or pages through them with by_page
+class QueryIterable:
+    def __init__(self, container: SqliteContainer, query: str, parameters: Optional[list], page_size: int):
+        self.container = container
+        self.query = query
+        self.parameters = parameters
+        self.page_size = page_size
+
+    def by_page(self, continuation_token: Optional[str] = None):
+        return QueryPager(self, continuation_token)
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    async def __aiter__(self):
+        async for page in self.by_page():
+            for item in page.items:
+                yield item
+
+
+# Async facade used by the API, every call runs on a worker thread like a network round trip would
+class AsyncSqliteContainer:
+    def __init__(self, container: SqliteContainer):
+        self.container = container
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def upsert_item(self, body: dict, **kwargs):
+        return await asyncio.to_thread(self.container.upsert_item, body, **kwargs)
+
+    async def create_item(self, body: dict, **kwargs):
+        return await asyncio.to_thread(self.container.create_item, body, **kwargs)
+
+    async def read_item(self, item: str, partition_key=None, **kwargs):
+        return await asyncio.to_thread(self.container.read_item, item, partition_key, **kwargs)
+
+    async def read_items(self, items: List[Tuple[str, str]], **kwargs):
+        return await asyncio.to_thread(self.container.read_items, items, **kwargs)
+
+    async def patch_item(self, item: str, partition_key=None, patch_operations: Optional[list] = None, **kwargs):
+        return await asyncio.to_thread(self.container.patch_item, item, partition_key, patch_operations, **kwargs)
+
+    async def delete_item(self, item: str, partition_key=None, **kwargs):
+        return await asyncio.to_thread(self.container.delete_item, item, partition_key, **kwargs)
+
+    def query_items(self, query: str, parameters: Optional[list] = None, max_item_count: Optional[int] = None, **kwargs):
+        return self.container.query_items(query, parameters, max_item_count, **kwargs)
+
+    # Everything is one partition here, the range is opaque to callers like Cosmos' own
+    async def read_feed_ranges(self, **kwargs):
+        yield {}
+
+    async def close(self):
+        self.container.close()
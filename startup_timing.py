@@ -0,0 +1,44 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Rough breakdown of where a cold start spends its time. main.py imports this module first, so
+# offsets are measured from (almost) the start of the process. Components can nest, e.g. the
+# Key Vault fetch happens while the application modules are being imported.
+process_started = time.perf_counter()
+components: List[Dict] = []
+ready_after: Optional[float] = None
+
+
+@contextmanager
+def timed(component: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(component, started, time.perf_counter())
+
+
+def record(component: str, started: float, finished: float):
+    components.append({
+        "component": component,
+        "started_at": round(started - process_started, 4),
+        "seconds": round(finished - started, 4),
+    })
+
+
+# Everything main.py imports, including loading the config, up to the point the app object is built
+def mark_imported():
+    record("imports", process_started, time.perf_counter())
+
+
+def mark_ready():
+    global ready_after
+    ready_after = time.perf_counter() - process_started
+
+
+def startup_report():
+    return {
+        "ready_after_seconds": round(ready_after, 4) if ready_after is not None else None,
+        "components": sorted(components, key=lambda entry: (entry["started_at"], -entry["seconds"])),
+    }
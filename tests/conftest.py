@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Storage is read from the environment at import time. Tests always run on the local SQLite/filesystem
+# backend in a throwaway directory, never against Azure.
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["LOCAL_STORAGE_PATH"] = tempfile.mkdtemp(prefix="interview-data-api-tests-")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+for name in ("AZURE_AD_CLIENT_ID", "AZURE_AD_CLIENT_SECRET", "AZURE_AD_TENANT_ID"):
+    os.environ.setdefault(name, "test")
+
+
+# The shared local container, emptied before each test
+@pytest.fixture
+def documents():
+    from database import get_async_container
+    from entity_cache import entity_cache
+    from repository import local_sync_container
+
+    local_sync_container()._connection().execute("DELETE FROM documents")
+    entity_cache.clear()
+    return get_async_container()
@@ -0,0 +1,24 @@
+import math
+from analysis import analyze_claim_columns, parse_categories
+
+
+def test_parse_categories_drops_unhashable_and_empty_values():
+    parsed = parse_categories(["Auto Accident", ["Auto", "Home"], {"category": "Fire"}, None, "", "Auto Accident"])
+    assert list(parsed.cat.categories) == ["Auto Accident"]
+    assert parsed.isna().tolist() == [False, True, True, True, True, False]
+
+
+def test_analysis_skips_bad_categories_instead_of_failing():
+    columns = {
+        "id": ["1", "2", "3", "4", "5"],
+        "textfile_category": ["Fire Damage", ["Auto", "Home"], {"category": "Fire"}, None, ""],
+        "textfile_amount": [100, 200, 300, 400, 500],
+        "gptmsg_category": ["Fire Damage", "Fire Damage", None, None, None],
+        "gptmsg_amount": ["$1,000", 50, None, None, None],
+    }
+    report = analyze_claim_columns(columns)
+    assert report["claims"] == 5
+    assert report["textfile_statistics"]["Fire Damage"]["count"] == 1
+    assert set(report["textfile_statistics"]) == {"Fire Damage"}
+    assert math.isclose(report["gptmsg_statistics"]["Fire Damage"]["sum"], 1050.0)
+    assert report["agreement"]["compared_categories"] == 1
@@ -0,0 +1,89 @@
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from blob_transfer import etag_matches, parse_range, stream_blob
+from local_blob_storage import LocalBlobContainerClient
+
+BODY = b"0123456789"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=2-4", (2, 4)),
+    ("bytes=2-", (2, 9)),
+    # Suffix ranges, the last N bytes, longer than the blob means all of it
+    ("bytes=-3", (7, 9)),
+    ("bytes=-50", (0, 9)),
+    # An end past the blob is cut to its last byte
+    ("bytes=5-100", (5, 9)),
+    # Invalid range-specs and unsupported forms are ignored, the full body is served
+    ("bytes=5-3", None),
+    ("bytes=-", None),
+    ("bytes=0-1,4-5", None),
+    ("items=0-1", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(BODY)) == expected
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=10-", 10),
+    ("bytes=10-12", 10),
+    ("bytes=-0", 10),
+    ("bytes=-5", 0),
+])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(HTTPException) as error:
+        parse_range(header, size)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", "abc"', True),
+    ("*", True),
+    ('"other"', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+@pytest.fixture
+def client(tmp_path):
+    container = LocalBlobContainerClient(str(tmp_path), "notes")
+    container.get_blob_client("note.txt").upload_blob(BODY)
+    app = FastAPI()
+
+    @app.get("/blob")
+    async def get_blob(request: Request):
+        return await stream_blob(container.get_blob_client("note.txt"), request)
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_stream_blob_full_and_ranged(client):
+    full = client.get("/blob")
+    assert (full.status_code, full.content) == (200, BODY)
+    assert full.headers["accept-ranges"] == "bytes"
+
+    ranged = client.get("/blob", headers={"Range": "bytes=2-4"})
+    assert (ranged.status_code, ranged.content) == (206, b"234")
+    assert ranged.headers["content-range"] == "bytes 2-4/10"
+
+    assert client.get("/blob", headers={"Range": "bytes=5-3"}).status_code == 200
+    assert client.get("/blob", headers={"Range": "bytes=20-"}).status_code == 416
+
+
+def test_stream_blob_revalidation(client):
+    etag = client.get("/blob").headers["etag"]
+    assert client.get("/blob", headers={"If-None-Match": etag}).status_code == 304
+    # If-Range with the current ETag keeps the range, a stale one gets the whole current blob
+    current = client.get("/blob", headers={"Range": "bytes=0-1", "If-Range": etag})
+    assert (current.status_code, current.content) == (206, b"01")
+    stale = client.get("/blob", headers={"Range": "bytes=0-1", "If-Range": '"stale"'})
+    assert (stale.status_code, stale.content) == (200, BODY)
@@ -0,0 +1,167 @@
+import asyncio
+import time
+import pytest
+import jobs
+from job_worker import run_claimed_job
+from jobs import JobLeaseLost, SqliteJobQueue, claim_job, new_job_documents, read_job, run_job, update_job
+
+
+async def create_job(documents, item_ids, kind="claims-analysis", **fields):
+    job, item_docs = new_job_documents(kind, item_ids, {})
+    job.update(fields)
+    for doc in item_docs:
+        await documents.upsert_item(doc)
+    await documents.create_item(job)
+    return job["id"]
+
+
+def queue_rows(queue: SqliteJobQueue):
+    return queue._connect().execute("SELECT job_id, status, leased_by FROM job_queue").fetchall()
+
+
+def test_claim_job_takes_a_queued_job_once(documents):
+    async def scenario():
+        job_id = await create_job(documents, ["a"])
+        lease = await claim_job(job_id, "worker-a")
+        assert lease.job["owner"] == "worker-a"
+        assert lease.job["status"] == "running"
+        assert lease.job["lease_until"] > time.time()
+        # The lease is still valid, nobody else gets the job
+        assert await claim_job(job_id, "worker-b") is None
+
+    asyncio.run(scenario())
+
+
+def test_claim_job_takes_over_an_expired_lease(documents):
+    async def scenario():
+        job_id = await create_job(documents, ["a"], owner="worker-a", status="running", lease_until=time.time() - 1)
+        lease = await claim_job(job_id, "worker-b")
+        assert lease.job["owner"] == "worker-b"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("status", jobs.TERMINAL_STATUSES)
+def test_claim_job_skips_finished_jobs(documents, status):
+    async def scenario():
+        job_id = await create_job(documents, ["a"], status=status)
+        assert await claim_job(job_id, "worker-a") is None
+
+    asyncio.run(scenario())
+
+
+def test_lease_update_rereads_after_a_concurrent_write(documents):
+    async def scenario():
+        job_id = await create_job(documents, ["a"])
+        lease = await claim_job(job_id, "worker-a")
+        # cancel_job writes without the etag, the lease retries on the new version and keeps the flag
+        await update_job(job_id, cancel_requested=True)
+        job = await lease.update(cursor=1)
+        assert job["cursor"] == 1
+        assert job["cancel_requested"] is True
+
+    asyncio.run(scenario())
+
+
+def test_lease_update_fails_once_another_worker_took_the_job(documents):
+    async def scenario():
+        job_id = await create_job(documents, ["a"])
+        stale = await claim_job(job_id, "worker-a")
+        await update_job(job_id, lease_until=time.time() - 1)
+        assert await claim_job(job_id, "worker-b") is not None
+        with pytest.raises(JobLeaseLost):
+            await stale.update(cursor=1)
+        assert (await read_job(job_id))["owner"] == "worker-b"
+
+    asyncio.run(scenario())
+
+
+def test_run_job_checkpoints_and_resumes_from_the_cursor(documents, monkeypatch):
+    monkeypatch.setattr(jobs, "job_checkpoint_every", 2)
+
+    async def scenario():
+        # Missing claims fail without reaching the LLM, each one is recorded as a failure
+        job_id = await create_job(documents, ["c1", "c2", "c3", "c4", "c5"], cursor=2, failed=2)
+        assert await run_job(job_id) == "completed"
+        job = await read_job(job_id)
+        assert (job["cursor"], job["completed"], job["failed"]) == (5, 0, 5)
+        assert [failure["id"] for failure in job["failures"]] == ["c3", "c4", "c5"]
+        assert job["owner"] is None
+        progress = [item async for item in documents.query_items(
+            query="SELECT VALUE c.start FROM c WHERE c.doc_type = @doc_type AND c.job_id = @job_id",
+            parameters=[{"name": "@doc_type", "value": jobs.JOB_PROGRESS_DOC_TYPE}, {"name": "@job_id", "value": job_id}],
+        )]
+        assert sorted(progress) == [2, 4]
+
+    asyncio.run(scenario())
+
+
+def test_run_job_leaves_a_job_leased_by_another_worker_alone(documents):
+    async def scenario():
+        job_id = await create_job(documents, ["a"])
+        await claim_job(job_id, "worker-a")
+        assert await run_job(job_id) == "running"
+        job = await read_job(job_id)
+        assert (job["owner"], job["cursor"]) == ("worker-a", 0)
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_queue_claim_heartbeat_and_ack(tmp_path):
+    async def scenario():
+        queue = SqliteJobQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=60)
+        await queue.start()
+        await queue.submit("job-1")
+        await queue.submit("job-2")
+        assert await queue.claim("worker-a") == "job-1"
+        assert await queue.claim("worker-b") == "job-2"
+        assert await queue.claim("worker-c") is None
+        # Only the worker holding the row extends it
+        before = queue._connect().execute("SELECT lease_until FROM job_queue WHERE job_id = 'job-1'").fetchone()[0]
+        await queue.heartbeat("job-1", "worker-b")
+        assert queue._connect().execute("SELECT lease_until FROM job_queue WHERE job_id = 'job-1'").fetchone()[0] == before
+        await queue.heartbeat("job-1", "worker-a")
+        assert queue._connect().execute("SELECT lease_until FROM job_queue WHERE job_id = 'job-1'").fetchone()[0] > before
+        await queue.ack("job-1")
+        assert queue_rows(queue) == [("job-2", "leased", "worker-b")]
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_queue_hands_out_rows_whose_lease_ran_out(tmp_path):
+    async def scenario():
+        queue = SqliteJobQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=0.01)
+        await queue.start()
+        await queue.submit("job-1")
+        assert await queue.claim("worker-a") == "job-1"
+        await asyncio.sleep(0.05)
+        assert await queue.claim("worker-b") == "job-1"
+        assert queue_rows(queue) == [("job-1", "leased", "worker-b")]
+
+    asyncio.run(scenario())
+
+
+# The queue row expired while the first worker still holds the job's lease in Cosmos. The second worker
+# must not ack the row, or the job would never be picked up again if the first worker then dies.
+def test_worker_keeps_the_row_while_the_cosmos_lease_is_held_elsewhere(documents, tmp_path):
+    async def scenario():
+        queue = SqliteJobQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=0.01)
+        await queue.start()
+        job_id = await create_job(documents, [])
+        await queue.submit(job_id)
+        assert await queue.claim("worker-a") == job_id
+        await claim_job(job_id, "worker-a")
+        await asyncio.sleep(0.05)
+
+        assert await queue.claim("worker-b") == job_id
+        assert await run_claimed_job(queue, job_id, "worker-b") == "running"
+        assert [row[0] for row in queue_rows(queue)] == [job_id]
+
+        # worker-a dies, its Cosmos lease runs out and the retried row finishes the job
+        await update_job(job_id, lease_until=time.time() - 1)
+        await asyncio.sleep(0.05)
+        assert await queue.claim("worker-c") == job_id
+        assert await run_claimed_job(queue, job_id, "worker-c") == "completed"
+        assert queue_rows(queue) == []
+
+    asyncio.run(scenario())
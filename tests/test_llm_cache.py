@@ -0,0 +1,21 @@
+import asyncio
+from llm_cache import LLMResultCache
+
+
+# A caller mutating what it got back (including the result it just stored) must not change the cached entry
+def test_cached_results_are_copies(tmp_path):
+    async def scenario():
+        cache = LLMResultCache(str(tmp_path / "llm_cache.sqlite3"), memory_entries=16, max_bytes=1024 * 1024, ttl=60)
+        result = {"Claims Category": "Auto", "tags": ["a"]}
+        await cache.set("key", result)
+        result["tags"].append("changed")
+        first = await cache.get("key")
+        first["Claims Category"] = "Changed"
+        assert await cache.get("key") == {"Claims Category": "Auto", "tags": ["a"]}
+
+        cache.memory.clear()
+        from_disk = await cache.get("key")
+        from_disk["tags"].append("changed")
+        assert await cache.get("key") == {"Claims Category": "Auto", "tags": ["a"]}
+
+    asyncio.run(scenario())
@@ -0,0 +1,163 @@
+import pytest
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosHttpResponseError
+from sqlite_repository import SqliteContainer
+
+POLICYHOLDERS_WHERE = "NOT IS_DEFINED(c.policyholder_id) AND NOT IS_DEFINED(c.doc_type)"
+CATEGORY = 'c.analysis.textfile_analysis["Claims Category"]'
+AMOUNT = 'c.analysis.textfile_analysis["Claim Amount"]'
+
+DOCUMENTS = [
+    {"id": "p1", "name": "Ann Lee", "policy_amount": 100},
+    {"id": "p2", "name": "Bob Stone", "policy_amount": "$250.00"},
+    {"id": "p3", "name": "Cara Lee", "policy_amount": 300},
+    {"id": "c1", "policyholder_id": "p1", "analysis": {"textfile_analysis": {"Claims Category": "Auto", "Claim Amount": 100}}},
+    {"id": "c2", "policyholder_id": "p1", "analysis": {"textfile_analysis": {"Claims Category": "Auto", "Claim Amount": 300}}},
+    {"id": "c3", "policyholder_id": "p2", "analysis": {"textfile_analysis": {"Claims Category": "Home", "Claim Amount": "$50"}}},
+    {"id": "c4", "policyholder_id": "p3", "analysis": {"textfile_analysis": {"Claims Category": "Home", "Claim Amount": 150}}},
+    {"id": "j1", "doc_type": "job", "status": "running"},
+    {"id": "j2", "doc_type": "job", "status": "completed"},
+]
+
+
+@pytest.fixture
+def container(tmp_path):
+    container = SqliteContainer(str(tmp_path / "documents.sqlite3"))
+    for doc in DOCUMENTS:
+        container.upsert_item(doc)
+    yield container
+    container.close()
+
+
+def strip_system_fields(item):
+    return {key: value for key, value in item.items() if not key.startswith("_")} if isinstance(item, dict) else item
+
+
+# The query shapes crud.py, rollup.py and jobs.py send, results compared ignoring order unless the query has ORDER BY
+@pytest.mark.parametrize("query, parameters, expected", [
+    ("SELECT VALUE COUNT(1) FROM c WHERE IS_DEFINED(c.policyholder_id)", None, [4]),
+    (f"SELECT VALUE SUM(c.policy_amount) FROM c WHERE {POLICYHOLDERS_WHERE} AND IS_NUMBER(c.policy_amount)", None, [400]),
+    (f"SELECT VALUE c.policy_amount FROM c WHERE {POLICYHOLDERS_WHERE} AND IS_STRING(c.policy_amount)", None, ["$250.00"]),
+    ("SELECT DISTINCT VALUE c.policyholder_id FROM c WHERE IS_DEFINED(c.policyholder_id)", None, ["p1", "p2", "p3"]),
+    (
+        "SELECT c.id FROM c WHERE c.doc_type = @doc_type AND c.status IN ('queued', 'running')",
+        [{"name": "@doc_type", "value": "job"}],
+        [{"id": "j1"}],
+    ),
+    (
+        "SELECT c.id, c.name FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+        [{"name": "@ids", "value": ["p1", "p3", "missing"]}],
+        [{"id": "p1", "name": "Ann Lee"}, {"id": "p3", "name": "Cara Lee"}],
+    ),
+    ("SELECT VALUE c.id FROM c WHERE c.policyholder_id = @id", [{"name": "@id", "value": "p1"}], ["c1", "c2"]),
+    (
+        f"SELECT * FROM c WHERE {POLICYHOLDERS_WHERE} AND CONTAINS(LOWER(c.name), LOWER(@name))",
+        [{"name": "@name", "value": "lee"}],
+        [DOCUMENTS[0], DOCUMENTS[2]],
+    ),
+    (
+        f"SELECT {CATEGORY} AS category, {AMOUNT} AS amount FROM c WHERE IS_DEFINED(c.policyholder_id) AND IS_STRING({AMOUNT})",
+        None,
+        [{"category": "Home", "amount": "$50"}],
+    ),
+    (
+        f"SELECT {CATEGORY} AS category, COUNT(1) AS claim_count, SUM({AMOUNT}) AS amount_sum FROM c "
+        f"WHERE IS_DEFINED(c.policyholder_id) AND IS_NUMBER({AMOUNT}) GROUP BY {CATEGORY}",
+        None,
+        [{"category": "Auto", "claim_count": 2, "amount_sum": 400}, {"category": "Home", "claim_count": 1, "amount_sum": 150}],
+    ),
+    # Undefined values are dropped from VALUE results like Cosmos does
+    ("SELECT VALUE c.name FROM c WHERE IS_DEFINED(c.policyholder_id)", None, []),
+])
+def test_query_shapes(container, query, parameters, expected):
+    results = [strip_system_fields(item) for item in container.query_items(query, parameters)]
+    key = lambda item: repr(sorted(item.items())) if isinstance(item, dict) else repr(item)
+    assert sorted(results, key=key) == sorted(expected, key=key)
+
+
+@pytest.mark.parametrize("query, parameters, expected", [
+    (f"SELECT VALUE c.id FROM c WHERE {POLICYHOLDERS_WHERE} ORDER BY c.id DESC", None, ["p3", "p2", "p1"]),
+    (f"SELECT VALUE c.id FROM c WHERE {POLICYHOLDERS_WHERE} ORDER BY c.id OFFSET 1 LIMIT 1", None, ["p2"]),
+    (
+        f"SELECT VALUE c.id FROM c WHERE {POLICYHOLDERS_WHERE} AND CONTAINS(LOWER(c.name), LOWER(@name)) OFFSET 0 LIMIT @limit",
+        [{"name": "@name", "value": "lee"}, {"name": "@limit", "value": 1}],
+        ["p1"],
+    ),
+])
+def test_ordered_and_limited_queries(container, query, parameters, expected):
+    assert list(container.query_items(query, parameters)) == expected
+
+
+def pages(iterable, continuation=None):
+    return [list(page) for page in iterable.by_page(continuation)]
+
+
+# Plain filtered scans page by rowid, a row deleted between two pages doesn't shift the next one
+def test_keyset_paging(container):
+    query = "SELECT VALUE c.id FROM c WHERE IS_DEFINED(c.policyholder_id)"
+    pager = container.query_items(query, max_item_count=3).by_page()
+    first = next(iter(pager))
+    assert list(first) == ["c1", "c2", "c3"]
+    container.delete_item("c1")
+    assert pages(container.query_items(query, max_item_count=3), pager.continuation_token) == [["c4"]]
+
+
+def test_offset_paging_for_ordered_queries(container):
+    query = "SELECT VALUE c.id FROM c WHERE IS_DEFINED(c.policyholder_id) ORDER BY c.id DESC"
+    assert pages(container.query_items(query, max_item_count=3)) == [["c4", "c3", "c2"], ["c1"]]
+
+
+@pytest.mark.parametrize("query, parameters", [
+    ("SELECT * FROM c JOIN t IN c.tags", None),
+    ("SELECT VALUE c.id FROM c WHERE c.id = @id", None),
+    ("SELECT VALUE UNKNOWNFN(c.id) FROM c", None),
+])
+def test_unsupported_queries_are_bad_requests(container, query, parameters):
+    with pytest.raises(CosmosHttpResponseError) as error:
+        list(container.query_items(query, parameters))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("operations, expected", [
+    ([{"op": "set", "path": "/status", "value": "done"}], {"status": "done"}),
+    ([{"op": "set", "path": "/stats/average", "value": 2.5}], {"stats": {"count": 1, "average": 2.5}}),
+    ([{"op": "incr", "path": "/stats/count", "value": 2}], {"stats": {"count": 3}}),
+    ([{"op": "incr", "path": "/attempts", "value": 1}], {"attempts": 1}),
+    ([{"op": "remove", "path": "/name"}], {"name": None}),
+    ([{"op": "add", "path": "/tags/-", "value": "c"}], {"tags": ["a", "b", "c"]}),
+    ([{"op": "remove", "path": "/tags/0"}], {"tags": ["b"]}),
+])
+def test_patch_operations(container, operations, expected):
+    container.upsert_item({"id": "d1", "name": "Doc", "status": "new", "stats": {"count": 1}, "tags": ["a", "b"]})
+    doc = container.patch_item("d1", "d1", operations)
+    for field, value in expected.items():
+        if value is None:
+            assert field not in doc
+        else:
+            assert doc[field] == value
+    assert container.read_item("d1", "d1") == doc
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "remove", "path": "/missing"},
+    {"op": "replace", "path": "/missing", "value": 1},
+    {"op": "incr", "path": "/name", "value": 1},
+    {"op": "set", "path": "/missing/child", "value": 1},
+])
+def test_invalid_patch_operations_leave_the_document_alone(container, operation):
+    before = container.read_item("p1", "p1")
+    with pytest.raises(CosmosHttpResponseError) as error:
+        container.patch_item("p1", "p1", [{"op": "set", "path": "/name", "value": "Changed"}, operation])
+    assert error.value.status_code == 400
+    assert container.read_item("p1", "p1") == before
+
+
+def test_patch_with_a_stale_etag_fails(container):
+    stale = container.read_item("p1", "p1")
+    container.patch_item("p1", "p1", [{"op": "set", "path": "/name", "value": "Ann Smith"}])
+    with pytest.raises(CosmosAccessConditionFailedError):
+        container.patch_item(
+            "p1", "p1", [{"op": "set", "path": "/name", "value": "Ann Jones"}],
+            etag=stale["_etag"], match_condition=MatchConditions.IfNotModified,
+        )
+    assert container.read_item("p1", "p1")["name"] == "Ann Smith"